@@ -0,0 +1,28 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""General settings needed by worker classes.
+
+Mirrors `Worker.GLOBAL_SETTINGS` for the controller, which does not import
+the workers, so that tasks only carry the settings their worker reads.
+"""
+
+# Names of general settings keyed by worker class, for worker classes
+# declaring non-empty `GLOBAL_SETTINGS`.
+WORKER_GLOBAL_SETTINGS: dict[str, list[str]] = {}
+
+
+def for_worker(worker_class: str) -> list[str]:
+  """Returns the names of general settings needed by a worker class."""
+  return WORKER_GLOBAL_SETTINGS.get(worker_class, [])
@@ -0,0 +1,46 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Heartbeat class definition."""
+
+from common import message
+
+
+class Heartbeat:
+  """Signal sent periodically to the controller while a task is running."""
+
+  _TOPIC = 'crmint-3-task-heartbeat'
+
+  def __init__(self, task_name, job_id):
+    self.task_name = task_name
+    self.job_id = job_id
+
+  def to_data(self):
+    return {
+        'task_name': self.task_name,
+        'job_id': self.job_id,
+    }
+
+  def send(self):
+    message.send(self.to_data(), self._TOPIC)
+
+  @classmethod
+  def from_data(cls, data):
+    """Creates a heartbeat from decoded message data."""
+    return cls(data['task_name'], data['job_id'])
+
+  @classmethod
+  def from_request(cls, request):
+    """Creates a heartbeat using data from an incoming Flask HTTP request."""
+    return cls.from_data(message.extract_data(request))
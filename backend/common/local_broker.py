@@ -0,0 +1,221 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process message broker, replacing Pub/Sub on a single node.
+
+Messages are delivered by calling the handler subscribed to their topic
+directly, in the same process. Delayed messages wait in a timer queue until
+they are due. Long-running handlers can be subscribed as concurrent, they then
+run in a pool of threads instead of delaying the delivery of other messages.
+
+Example:
+  broker = local_broker.Broker()
+  broker.subscribe('crmint-3-start-task', handle_task, concurrent=True)
+  message.set_transport(broker)
+  broker.start()
+"""
+
+from concurrent import futures
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from common import message
+
+Handler = Callable[[dict[str, Any]], None]
+
+_logger = logging.getLogger(__name__)
+
+
+class Broker:
+  """Delivers published messages to handlers through a timer queue.
+
+  Implements the subset of `pubsub_v1.PublisherClient` used by
+  `common.message`, so it can be set as its transport.
+  """
+
+  supports_delayed_delivery = True
+
+  def __init__(self, max_workers: int = 8):
+    """Initializes the broker.
+
+    Args:
+      max_workers: Maximum number of messages handled at the same time by
+        concurrent handlers.
+    """
+    self._handlers: dict[str, Handler] = {}
+    self._concurrent_topics = set()
+    self._max_workers = max_workers
+    self._executor = None
+    # Heap of (due monotonic time, sequence number, topic, data, attributes).
+    self._queue = []
+    self._sequence = itertools.count()
+    self._in_flight = 0
+    self._condition = threading.Condition()
+    self._thread = None
+    self._stopped = False
+
+  def subscribe(self,
+                topic: str,
+                handler: Handler,
+                concurrent: bool = False) -> None:
+    """Registers the handler receiving decoded messages sent to a topic.
+
+    Args:
+      topic: Name of the topic, e.g. `crmint-3-start-task`.
+      handler: Function called with the data of each message.
+      concurrent: If True, messages delivered in the background are handled
+        in a pool of threads, the delivery thread only dispatches them.
+        Defaults to False, handling them in the delivery thread.
+    """
+    self._handlers[topic] = handler
+    if concurrent:
+      self._concurrent_topics.add(topic)
+    else:
+      self._concurrent_topics.discard(topic)
+
+  def publish(self, topic_path: str, data: bytes, **attrs) -> futures.Future:
+    """Queues a message until its `start_time` attribute has passed.
+
+    Args:
+      topic_path: Path of the topic, e.g. `projects/p/topics/t`.
+      data: Raw content of the message.
+      **attrs: Attributes of the message.
+
+    Returns:
+      Future already resolved, as publishing cannot fail.
+    """
+    topic = topic_path.rsplit('/', 1)[-1]
+    due_time = time.monotonic() + self._seconds_until_start(attrs)
+    with self._condition:
+      sequence = next(self._sequence)
+      heapq.heappush(self._queue, (due_time, sequence, topic, data, attrs))
+      self._condition.notify_all()
+    future = futures.Future()
+    future.set_result(str(sequence))
+    return future
+
+  def start(self) -> None:
+    """Starts delivering messages in a background thread."""
+    self._stopped = False
+    self._executor = futures.ThreadPoolExecutor(
+        max_workers=self._max_workers,
+        thread_name_prefix='crmint-local-handler')
+    self._thread = threading.Thread(
+        target=self._run, name='crmint-local-broker', daemon=True)
+    self._thread.start()
+
+  def stop(self) -> None:
+    """Stops delivering messages, queued messages are dropped.
+
+    Messages being handled by concurrent handlers are not interrupted.
+    """
+    with self._condition:
+      self._stopped = True
+      self._condition.notify_all()
+    if self._thread not in (None, threading.current_thread()):
+      self._thread.join()
+    self._thread = None
+    if self._executor is not None:
+      self._executor.shutdown(wait=False, cancel_futures=True)
+      self._executor = None
+
+  def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+    """Blocks until all queued messages have been handled.
+
+    Args:
+      timeout: Maximum number of seconds to wait, None to wait forever.
+
+    Returns:
+      True if the broker is idle, False if the timeout expired.
+    """
+    with self._condition:
+      return self._condition.wait_for(
+          lambda: not self._queue and not self._in_flight, timeout=timeout)
+
+  def drain(self) -> None:
+    """Handles all messages in the calling thread, until the queue is empty.
+
+    Useful to run a whole pipeline deterministically, e.g. in tests and
+    benchmarks. Waits for delayed messages to be due. Concurrent handlers
+    also run in the calling thread.
+    """
+    while self._deliver_next(block=False, executor=None):
+      pass
+
+  def _run(self) -> None:
+    while self._deliver_next(block=True, executor=self._executor):
+      pass
+
+  def _deliver_next(self,
+                    block: bool,
+                    executor: Optional[futures.Executor]) -> bool:
+    """Delivers the next message, returns False if there is nothing left."""
+    with self._condition:
+      while True:
+        if self._stopped or (not block and not self._queue):
+          return False
+        if self._queue:
+          wait_time = self._queue[0][0] - time.monotonic()
+          if wait_time <= 0:
+            break
+        else:
+          wait_time = None
+        self._condition.wait(timeout=wait_time)
+      _, _, topic, data, attrs = heapq.heappop(self._queue)
+      self._in_flight += 1
+    if executor is not None and topic in self._concurrent_topics:
+      executor.submit(self._handle_in_flight, topic, data, attrs)
+    else:
+      self._handle_in_flight(topic, data, attrs)
+    return True
+
+  def _handle_in_flight(self,
+                        topic: str,
+                        data: bytes,
+                        attrs: dict[str, str]) -> None:
+    try:
+      self._handle(topic, data, attrs)
+    finally:
+      with self._condition:
+        self._in_flight -= 1
+        self._condition.notify_all()
+
+  def _handle(self, topic: str, data: bytes, attrs: dict[str, str]) -> None:
+    handler = self._handlers.get(topic)
+    if handler is None:
+      _logger.warning('No handler subscribed to topic %s', topic)
+      return
+    try:
+      data_decoded = message.decode(data, attrs)
+    except message.TooEarlyError:
+      # Wall clock and monotonic clock drifted apart, tries again shortly.
+      self.publish(topic, data, **attrs)
+      return
+    try:
+      handler(data_decoded)
+    except Exception:  # pylint: disable=broad-except
+      # Unlike Pub/Sub, failed messages are not redelivered.
+      _logger.exception('Failed to handle message on topic %s', topic)
+
+  @staticmethod
+  def _seconds_until_start(attrs: dict[str, str]) -> float:
+    # Mirrors how `message.decode` compares `start_time` with the clock.
+    start_time = datetime.datetime.fromtimestamp(int(attrs['start_time']))
+    delta = start_time - datetime.datetime.utcnow()
+    return max(0.0, delta.total_seconds())
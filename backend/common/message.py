@@ -15,11 +15,15 @@
 """Helpers for communicating with Pub/Sub."""
 
 import base64
+import contextlib
 import datetime
 import functools
 import json
 import os
-from typing import Any
+import threading
+import time
+from typing import Any, Iterable, Iterator, Mapping, Optional
+import zlib
 
 import flask
 from google.cloud import pubsub_v1
@@ -29,6 +33,26 @@ from common import crmint_logging
 _PROJECT = os.getenv('GOOGLE_CLOUD_PROJECT')
 _PUBSUB_TIMEOUT = 10  # Unit in seconds.
 
+# Lets the client group messages published in a burst (e.g. a fan-out of
+# tasks) into a few publish requests instead of one request per message.
+_BATCH_SETTINGS = pubsub_v1.types.BatchSettings(
+    max_messages=100,
+    max_bytes=1024 * 1024,  # 1 MiB
+    max_latency=0.01,  # Unit in seconds.
+)
+
+# Messages larger than this are compressed. Unit in bytes.
+_COMPRESSION_MIN_SIZE = 1024
+
+# Value of the `encoding` attribute of compressed messages.
+_ZLIB_ENCODING = 'zlib'
+
+# Futures of messages published inside a `batch()` block, per thread.
+_pending = threading.local()
+
+# Replaces Pub/Sub to deliver messages, see `set_transport`.
+_transport = None
+
 
 class _Error(Exception):
   """Generic message module error."""
@@ -56,12 +80,86 @@ class BadRequestError(_Error):
 
 @functools.cache
 def _get_publisher_client() -> pubsub_v1.PublisherClient:
-  return pubsub_v1.PublisherClient()
+  return pubsub_v1.PublisherClient(batch_settings=_BATCH_SETTINGS)
+
+
+def set_transport(transport: Optional[Any]) -> None:
+  """Sets the transport used to deliver messages instead of Pub/Sub.
+
+  A transport follows the interface of `pubsub_v1.PublisherClient`, it
+  implements `publish(topic_path, data, **attrs)` returning a future and
+  `stop()`. See `common.local_broker.Broker` for an in-process transport.
+
+  Args:
+    transport: Transport to use, or None to use Pub/Sub again.
+  """
+  global _transport  # pylint: disable=global-statement
+  _transport = transport
+
+
+def supports_delayed_delivery() -> bool:
+  """Returns True if the transport holds delayed messages until they are due.
+
+  Pub/Sub delivers messages immediately, delayed messages are then rejected
+  with `TooEarlyError` until their start time.
+  """
+  return getattr(_transport, 'supports_delayed_delivery', False)
+
+
+def _get_transport() -> Any:
+  if _transport is not None:
+    return _transport
+  return _get_publisher_client()
+
+
+def _wait_for_futures(
+    futures: list[pubsub_v1.publisher.futures.Future]) -> None:
+  """Blocks until all futures are resolved, within a shared timeout."""
+  deadline = time.monotonic() + _PUBSUB_TIMEOUT
+  for future in futures:
+    future.result(timeout=max(0, deadline - time.monotonic()))
+
+
+@contextlib.contextmanager
+def batch(isolated: bool = False) -> Iterator[None]:
+  """Publishes all messages sent within the block in batches.
+
+  Messages are handed to the publisher client as soon as `send` is called, but
+  we only wait for their delivery when leaving the block. Nested blocks are
+  merged into the outermost one, unless `isolated` is set.
+
+  Example:
+    with message.batch():
+      for task_inst in tasks:
+        task_inst.enqueue()  # Does not block.
+    # All tasks have been published at this point.
+
+  Args:
+    isolated: If True, waits for the messages sent within this block when
+      leaving it, even if nested in another block.
+
+  Raises:
+    pubsub_v1.exceptions.TimeoutError: if a message to Pub/Sub times out.
+    Exception: for undefined exceptions in the underlying pubsub call execution.
+  """
+  outer_futures = getattr(_pending, 'futures', None)
+  if outer_futures is not None and not isolated:
+    yield
+    return
+  futures = _pending.futures = []
+  try:
+    yield
+  finally:
+    _pending.futures = outer_futures
+  _wait_for_futures(futures)
 
 
 def send(data: dict[str, Any], topic: str, delay: int = 0) -> None:
   """Sends data in a message to a PubSub topic to be processed with a delay.
 
+  When called inside a `batch()` block, returns without waiting for the
+  message to be delivered.
+
   Args:
     data: Data structure to encode as the message.
     topic: Name of the topic to publish messages to.
@@ -73,48 +171,92 @@ def send(data: dict[str, Any], topic: str, delay: int = 0) -> None:
     Exception: for undefined exceptions in the underlying pubsub call execution.
   """
   topic_path = f'projects/{_PROJECT}/topics/{topic}'
-  binary_data = json.dumps(data).encode('utf-8')
+  binary_data = json.dumps(data, separators=(',', ':')).encode('utf-8')
   delay_delta = datetime.timedelta(seconds=delay)
   start_time = int((datetime.datetime.utcnow() + delay_delta).timestamp())
-  client = _get_publisher_client()
-  future = client.publish(topic_path,
-                          binary_data,
-                          start_time=str(start_time))
-  future.result(timeout=_PUBSUB_TIMEOUT)
+  attrs = {'start_time': str(start_time)}
+  if len(binary_data) >= _COMPRESSION_MIN_SIZE:
+    binary_data = zlib.compress(binary_data)
+    attrs['encoding'] = _ZLIB_ENCODING
+  client = _get_transport()
+  future = client.publish(topic_path, binary_data, **attrs)
+  pending_futures = getattr(_pending, 'futures', None)
+  if pending_futures is not None:
+    pending_futures.append(future)
+  else:
+    _wait_for_futures([future])
 
 
-def extract_data(request: flask.Request) -> dict[str, Any]:
-  """Returns a PubSub message data from an incoming Flask request.
+def send_many(data_list: Iterable[dict[str, Any]],
+              topic: str,
+              delay: int = 0) -> None:
+  """Sends multiple messages to a PubSub topic and waits for all of them.
 
   Args:
-    request: Incoming Flask request.
+    data_list: Data structures to encode as messages, one per message.
+    topic: Name of the topic to publish messages to.
+    delay: Number of seconds to delay the delivery of the messages.
+      Defaults to zero.
+
+  Raises:
+    pubsub_v1.exceptions.TimeoutError: if a message to Pub/Sub times out.
+    Exception: for undefined exceptions in the underlying pubsub call execution.
+  """
+  with batch():
+    for data in data_list:
+      send(data, topic, delay=delay)
+
+
+def decode(binary_data: bytes,
+           attributes: Mapping[str, str]) -> dict[str, Any]:
+  """Returns the data of a PubSub message, if it is time to process it.
+
+  Args:
+    binary_data: Raw content of the message.
+    attributes: Attributes of the message.
+
+  Raises:
+    TooEarlyError: if the message is delayed and should be processed later.
+    BadRequestError: if the message cannot be decoded.
   """
-  envelope = request.get_json()
-  try:
-    message = envelope['message']
-  except (TypeError, KeyError) as e:
-    raise BadRequestError() from e
   try:
     start_time = datetime.datetime.fromtimestamp(
-        int(message['attributes']['start_time']))
+        int(attributes['start_time']))
     if datetime.datetime.utcnow() < start_time:
       raise TooEarlyError(start_time)
   except KeyError as e:
     raise BadRequestError() from e
+  encoding = attributes.get('encoding')
   try:
-    data = json.loads(base64.b64decode(message['data']).decode('utf-8'))
-  except (
-      KeyError,
-      base64.binascii.Error,
-      UnicodeDecodeError,
-      json.decoder.JSONDecodeError) as e:
+    if encoding == _ZLIB_ENCODING:
+      binary_data = zlib.decompress(binary_data)
+    elif encoding is not None:
+      raise BadRequestError()
+    data = json.loads(binary_data.decode('utf-8'))
+  except (zlib.error, UnicodeDecodeError, json.decoder.JSONDecodeError) as e:
     raise BadRequestError() from e
   return data
 
 
+def extract_data(request: flask.Request) -> dict[str, Any]:
+  """Returns a PubSub message data from an incoming Flask request.
+
+  Args:
+    request: Incoming Flask request.
+  """
+  envelope = request.get_json()
+  try:
+    message = envelope['message']
+    attributes = message['attributes']
+    binary_data = base64.b64decode(message['data'])
+  except (TypeError, KeyError, base64.binascii.Error) as e:
+    raise BadRequestError() from e
+  return decode(binary_data, attributes)
+
+
 def shutdown() -> None:
   """Cleans Pub/Sub client state."""
   # Stop accepting new messages and commit outstanding ones (if possible).
-  _get_publisher_client().stop()
+  _get_transport().stop()
   crmint_logging.log_global_message(
       'PubSub client stopped.', log_level='WARNING')
@@ -22,7 +22,9 @@ class Result:
 
   _TOPIC = 'crmint-3-task-finished'
 
-  def __init__(self, task_name, job_id, success, workers_to_enqueue=None):
+  # pylint: disable=too-many-arguments
+  def __init__(self, task_name, job_id, success, workers_to_enqueue=None,
+               attempts=1, queue_wait=None):
     self.task_name = task_name
     self.job_id = job_id
     self.success = success
@@ -30,22 +32,37 @@ class Result:
       self.workers_to_enqueue = []
     else:
       self.workers_to_enqueue = workers_to_enqueue
+    # Number of times the task was executed.
+    self.attempts = attempts
+    # Seconds waited by the last attempt before being executed, if known.
+    self.queue_wait = queue_wait
+  # pylint: enable=too-many-arguments
 
-  def report(self):
-    data = {
+  def to_data(self):
+    return {
         'task_name': self.task_name,
         'job_id': self.job_id,
         'success': self.success,
         'workers_to_enqueue': self.workers_to_enqueue,
+        'attempts': self.attempts,
+        'queue_wait': self.queue_wait,
     }
-    message.send(data, self._TOPIC)
+
+  def report(self):
+    message.send(self.to_data(), self._TOPIC)
 
   @classmethod
-  def from_request(cls, request):
-    """Creates a task result using data form an inciming Flask HTTP request."""
-    data = message.extract_data(request)
+  def from_data(cls, data):
+    """Creates a task result from decoded message data."""
     return cls(
         data['task_name'],
         data['job_id'],
         data['success'],
-        data['workers_to_enqueue'])
+        data['workers_to_enqueue'],
+        attempts=data.get('attempts', 1),
+        queue_wait=data.get('queue_wait'))
+
+  @classmethod
+  def from_request(cls, request):
+    """Creates a task result using data form an inciming Flask HTTP request."""
+    return cls.from_data(message.extract_data(request))
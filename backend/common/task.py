@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 from common import message
 
 
@@ -22,36 +24,45 @@ class Task:
 
   # pylint: disable=too-many-arguments
   def __init__(self, name, pipeline_id, job_id,
-               worker_class, worker_params, general_settings, attempts=1):
+               worker_class, worker_params, general_settings, attempts=1,
+               general_settings_version=None, enqueued_at=None):
     self.name = name
     self.pipeline_id = pipeline_id
     self.job_id = job_id
     self.worker_class = worker_class
     self.worker_params = worker_params
+    # Subset of the general settings snapshot identified by its version.
     self.general_settings = general_settings
+    self.general_settings_version = general_settings_version
     self.attempts = attempts
+    # Timestamp from which the task can be executed, to measure its wait.
+    self.enqueued_at = enqueued_at
   # pylint: enable=too-many-arguments
 
-  def enqueue(self, delay=0):
-    data = {
+  def to_data(self):
+    return {
         'task_name': self.name,
         'pipeline_id': self.pipeline_id,
         'job_id': self.job_id,
         'worker_class': self.worker_class,
         'worker_params': self.worker_params,
         'general_settings': self.general_settings,
+        'general_settings_version': self.general_settings_version,
         'attempts': self.attempts,
+        'enqueued_at': self.enqueued_at,
     }
-    message.send(data, self._TOPIC, delay=delay)
+
+  def enqueue(self, delay=0):
+    self.enqueued_at = time.time() + delay
+    message.send(self.to_data(), self._TOPIC, delay=delay)
 
   def reenqueue(self):
     self.attempts += 1
     self.enqueue()
 
   @classmethod
-  def from_request(cls, request):
-    """Creates a task using data form an incoming Flask HTTP request."""
-    data = message.extract_data(request)
+  def from_data(cls, data):
+    """Creates a task from decoded message data."""
     return cls(
         data['task_name'],
         data['pipeline_id'],
@@ -59,4 +70,17 @@ class Task:
         data['worker_class'],
         data['worker_params'],
         data['general_settings'],
-        attempts=data['attempts'])
+        attempts=data['attempts'],
+        general_settings_version=data.get('general_settings_version'),
+        enqueued_at=data.get('enqueued_at'))
+
+  @classmethod
+  def from_request(cls, request):
+    """Creates a task using data form an incoming Flask HTTP request."""
+    return cls.from_data(message.extract_data(request))
+
+  @classmethod
+  def from_pubsub_message(cls, pubsub_message):
+    """Creates a task from a message received by a streaming pull."""
+    data = message.decode(pubsub_message.data, pubsub_message.attributes)
+    return cls.from_data(data)
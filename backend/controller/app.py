@@ -19,11 +19,14 @@ from typing import Any, Optional
 
 from flask import Flask
 
+from controller import database
+from controller import event
 from controller import extensions
 from controller import job
 from controller import ml_model
 from controller import pipeline
 from controller import result
+from controller import run
 from controller import stage
 from controller import starter
 from controller import views
@@ -44,6 +47,12 @@ def create_app(config: Optional[dict[str, Any]] = None) -> Flask:
   app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
       'DATABASE_URI',
       'mysql+mysqlconnector://crmint:crmint@db:3306/crmint_development')
+  app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+  replica_uri = os.getenv('DATABASE_REPLICA_URI')
+  if replica_uri:
+    app.config['SQLALCHEMY_BINDS'] = {
+        extensions.REPLICA_BIND: replica_uri,
+    }
   if config:
     app.config.update(**config)
   register_extensions(app)
@@ -51,10 +60,28 @@ def create_app(config: Optional[dict[str, Any]] = None) -> Flask:
   return app
 
 
+def engine_options() -> dict[str, Any]:
+  """Returns the options of database engines, set from the environment.
+
+  Connections are checked before use and recycled before Cloud SQL drops them
+  for being idle. The pool is sized for bursts of push requests, sizes are
+  ignored by SQLite which uses a single connection.
+  """
+  return {
+      'pool_pre_ping': bool(int(os.getenv('DATABASE_POOL_PRE_PING', '1'))),
+      # Recycles each connection after 5 minutes by default.
+      'pool_recycle': int(os.getenv('DATABASE_POOL_RECYCLE', '300')),
+      'pool_size': int(os.getenv('DATABASE_POOL_SIZE', '10')),
+      'max_overflow': int(os.getenv('DATABASE_MAX_OVERFLOW', '20')),
+      'pool_timeout': int(os.getenv('DATABASE_POOL_TIMEOUT', '30')),
+  }
+
+
 def register_extensions(app):
   """Register Flask extensions."""
   extensions.cors.init_app(app)
   extensions.db.init_app(app)
+  database.listen_to_pool_events()
   extensions.migrate.init_app(app, extensions.db)
 
 
@@ -65,5 +92,7 @@ def register_blueprints(app):
   app.register_blueprint(pipeline.views.blueprint, url_prefix='/api')
   app.register_blueprint(job.views.blueprint, url_prefix='/api')
   app.register_blueprint(stage.views.blueprint, url_prefix='/api')
+  app.register_blueprint(run.views.blueprint, url_prefix='/api')
+  app.register_blueprint(event.views.blueprint, url_prefix='/api')
   app.register_blueprint(result.views.blueprint)
   app.register_blueprint(starter.views.blueprint)
@@ -0,0 +1,136 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Index of the jobs of a pipeline and of their start conditions.
+
+Start conditions rarely change while statuses change on every task
+completion, so the structure of a pipeline is indexed once per revision and
+evaluated against the statuses of its jobs.
+"""
+
+import collections
+import dataclasses
+import threading
+from typing import Callable, Hashable, Iterable
+
+
+@dataclasses.dataclass(frozen=True)
+class Edge:
+  """Start condition of a job, on the status of a preceding job."""
+  preceding_job_id: int
+  job_id: int
+  condition: str
+
+
+@dataclasses.dataclass(frozen=True)
+class PipelineDag:
+  """Jobs of a pipeline linked by their start conditions.
+
+  Attributes:
+    revision: Identifies the revision of the pipeline structure indexed.
+    order: Job ids in topological order, jobs in a cycle come last.
+    start_conditions: Edges to each job, from the jobs it depends on.
+    dependents: Ids of the jobs depending on each job.
+    leaves: Ids of the jobs no other job depends on.
+  """
+  revision: Hashable
+  order: tuple[int, ...]
+  start_conditions: dict[int, tuple[Edge, ...]]
+  dependents: dict[int, tuple[int, ...]]
+  leaves: frozenset[int]
+
+  @classmethod
+  def build(cls,
+            revision: Hashable,
+            job_ids: Iterable[int],
+            edges: Iterable[Edge]) -> 'PipelineDag':
+    """Returns the index of jobs and edges, in linear time."""
+    job_ids = sorted(set(job_ids))
+    start_conditions = collections.defaultdict(list)
+    dependents = collections.defaultdict(list)
+    for edge in edges:
+      start_conditions[edge.job_id].append(edge)
+      dependents[edge.preceding_job_id].append(edge.job_id)
+    # Kahn's algorithm, jobs without start conditions come first.
+    in_degrees = {
+        job_id: len(start_conditions.get(job_id, ())) for job_id in job_ids}
+    queue = collections.deque(
+        job_id for job_id in job_ids if not in_degrees[job_id])
+    order = []
+    while queue:
+      job_id = queue.popleft()
+      order.append(job_id)
+      for dependent_id in dependents.get(job_id, ()):
+        if dependent_id not in in_degrees:
+          continue  # Job of another pipeline.
+        in_degrees[dependent_id] -= 1
+        if not in_degrees[dependent_id]:
+          queue.append(dependent_id)
+    ordered_ids = set(order)
+    order.extend(job_id for job_id in job_ids if job_id not in ordered_ids)
+    return cls(
+        revision=revision,
+        order=tuple(order),
+        start_conditions={
+            job_id: tuple(job_edges)
+            for job_id, job_edges in start_conditions.items()},
+        dependents={
+            job_id: tuple(job_dependents)
+            for job_id, job_dependents in dependents.items()},
+        leaves=frozenset(
+            job_id for job_id in job_ids if job_id not in dependents))
+
+  def start_conditions_of(self, job_id: int) -> tuple[Edge, ...]:
+    return self.start_conditions.get(job_id, ())
+
+  def dependents_of(self, job_id: int) -> tuple[int, ...]:
+    return self.dependents.get(job_id, ())
+
+
+class DagCache:
+  """Keeps the last indexed revision of the most recently used pipelines."""
+
+  def __init__(self, max_size: int = 256):
+    self._dags: collections.OrderedDict[int, PipelineDag] = (
+        collections.OrderedDict())
+    self._max_size = max_size
+    self._lock = threading.Lock()
+
+  def get(self,
+          pipeline_id: int,
+          revision: Hashable,
+          load: Callable[[], PipelineDag]) -> PipelineDag:
+    """Returns the index of a pipeline, loaded if missing or outdated.
+
+    Args:
+      pipeline_id: Id of the pipeline.
+      revision: Current revision of the pipeline structure.
+      load: Function returning the index of the current revision.
+    """
+    with self._lock:
+      dag = self._dags.get(pipeline_id)
+      if dag is not None and dag.revision == revision:
+        self._dags.move_to_end(pipeline_id)
+        return dag
+    dag = load()
+    with self._lock:
+      self._dags[pipeline_id] = dag
+      self._dags.move_to_end(pipeline_id)
+      while len(self._dags) > self._max_size:
+        self._dags.popitem(last=False)
+    return dag
+
+  def clear(self) -> None:
+    with self._lock:
+      self._dags.clear()
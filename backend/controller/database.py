@@ -14,13 +14,19 @@
 
 """Database helper methods."""
 
+import datetime
+import functools
 from typing import Callable, Optional
 
 import flask
+from flask_restful import utils
+import sqlalchemy
 from sqlalchemy import orm
+from werkzeug import http
 
 from common import crmint_logging
 from controller import extensions
+from controller import metrics
 from controller import models
 
 
@@ -49,14 +55,26 @@ def load_fixtures(logger_func: Optional[Callable[[str], None]] = None) -> None:
       general_setting.save()
       if logger_func:
         logger_func('Added setting %s' % setting)
+  models.GeneralSetting.invalidate_snapshot()
 
 
 def reset_jobs_and_pipelines_statuses_to_idle() -> None:
   models.TaskEnqueued.query.delete()
   for pipeline in models.Pipeline.all():
+    # Events are committed along with the statuses, for clients following
+    # status changes to see the reset.
+    if pipeline.jobs:
+      models.StatusEvent.record(
+          'idle', pipeline.id, [job.id for job in pipeline.jobs])
     for job in pipeline.jobs:
-      job.update(status='idle')
+      job.update(status='idle', running_tasks_count=0)
+    models.StatusEvent.record('idle', pipeline.id)
     pipeline.update(status='idle')
+  # Runs interrupted by the reset are kept in the history as idle.
+  now = datetime.datetime.utcnow()
+  for run_model in (models.JobRun, models.PipelineRun):
+    run_model.query.filter(run_model.finished_at.is_(None)).update(
+        {'status': 'idle', 'finished_at': now}, synchronize_session=False)
 
 
 def shutdown(app: flask.Flask) -> None:
@@ -70,3 +88,112 @@ def shutdown(app: flask.Flask) -> None:
   extensions.db.get_engine(app).dispose()
   crmint_logging.log_global_message(
       'Database connection disposed.', log_level='WARNING')
+
+
+def read_from_replica(func: Callable) -> Callable:
+  """Decorates a view to run its queries on the read replica, if configured.
+
+  Replicas lag behind the primary database, only views displaying data can
+  read from them. Changes are still flushed to the primary database. The
+  decorator has to wrap `marshal_with`, which loads relationships.
+
+  Args:
+    func: View function or method.
+  """
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    session_info = extensions.db.session.info
+    previous_value = session_info.get(extensions.READ_FROM_REPLICA, False)
+    session_info[extensions.READ_FROM_REPLICA] = True
+    try:
+      return func(*args, **kwargs)
+    finally:
+      session_info[extensions.READ_FROM_REPLICA] = previous_value
+
+  return wrapper
+
+
+def conditional(change_token: Callable[[], models.ChangeToken]) -> Callable:
+  """Decorates a view to answer requests for unchanged data with a 304.
+
+  The change token is computed before the view runs, requests whose
+  `If-None-Match` header matches its ETag are answered without running it.
+  `If-Modified-Since` is not checked, since the last modification time does
+  not tell apart changes made within the same second. The decorator has to
+  wrap `marshal_with`, and to be wrapped by `read_from_replica` for the token
+  to be read from the database the data is read from.
+
+  Args:
+    change_token: Function returning the token of the data of the view.
+  """
+
+  def decorator(func):
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      token = change_token()
+      headers = {
+          'ETag': http.quote_etag(token.etag),
+          # Clients revalidate the data on every request.
+          'Cache-Control': 'no-cache',
+      }
+      if token.last_modified is not None:
+        headers['Last-Modified'] = http.http_date(
+            token.last_modified.replace(tzinfo=datetime.timezone.utc))
+      if flask.request.if_none_match.contains(token.etag):
+        metrics.increment('not_modified_responses')
+        return flask.Response(status=304, headers=headers)
+      data, code, view_headers = utils.unpack(
+          func(*args, **kwargs))
+      return data, code, dict(view_headers, **headers)
+
+    return wrapper
+
+  return decorator
+
+
+def _count_connection(*args):
+  del args  # Unused argument
+  metrics.increment('db_connections_opened')
+
+
+def _count_invalidation(*args):
+  del args  # Unused argument
+  metrics.increment('db_connections_invalidated')
+
+
+def listen_to_pool_events() -> None:
+  """Counts connections opened and invalidated, e.g. dropped when idle."""
+  for name, listener in (('connect', _count_connection),
+                         ('invalidate', _count_invalidation)):
+    if not sqlalchemy.event.contains(sqlalchemy.pool.Pool, name, listener):
+      sqlalchemy.event.listen(sqlalchemy.pool.Pool, name, listener)
+
+
+def pool_metrics(app: flask.Flask) -> dict[str, metrics.Number]:
+  """Returns the utilization of the connection pool of each database bind.
+
+  Metrics are prefixed with `db_pool` for the primary database and with
+  `db_pool_<bind>` for others, e.g. `db_pool_replica_checked_out`. Pools
+  without a fixed size, like the SQLite one, are not reported.
+
+  Args:
+    app: Flask application configuring the database binds.
+  """
+  binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or {})
+  pool_metrics_ = {}
+  for bind in binds:
+    pool = extensions.db.get_engine(app, bind=bind).pool
+    if not isinstance(pool, sqlalchemy.pool.QueuePool):
+      continue
+    prefix = 'db_pool' if bind is None else f'db_pool_{bind}'
+    size = pool.size()
+    checked_out = pool.checkedout()
+    pool_metrics_[f'{prefix}_size'] = size
+    pool_metrics_[f'{prefix}_checked_out'] = checked_out
+    pool_metrics_[f'{prefix}_overflow'] = max(0, pool.overflow())
+    # Above 1 when overflow connections are in use.
+    pool_metrics_[f'{prefix}_utilization'] = (
+        checked_out / size if size else 0.0)
+  return pool_metrics_
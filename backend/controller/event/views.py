@@ -0,0 +1,168 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Status event section.
+
+Clients follow the status changes of pipelines and jobs instead of polling
+their lists, either by long-polling or with a stream of server-sent events.
+Both resume from a cursor, the id of the last event read. Cursors only
+advance past events committed in order, see `models.StatusEvent.horizon`.
+"""
+
+import json
+import time
+
+import flask
+from flask_restful import Api
+from flask_restful import fields
+from flask_restful import inputs
+from flask_restful import marshal
+from flask_restful import reqparse
+from flask_restful import Resource
+
+from controller import models
+
+# Seconds between two reads of new events, while waiting for them.
+_POLL_INTERVAL = 1.0
+# Maximum and default seconds a long-poll request waits for new events.
+_MAX_WAIT = 30
+_DEFAULT_WAIT = 25
+# Seconds after which a stream ends, since each one holds a server thread.
+# Clients reconnect after the retry delay, in milliseconds, and resume from
+# the last event received.
+_STREAM_DURATION = 60
+_STREAM_RETRY = 1000
+
+blueprint = flask.Blueprint('event', __name__)
+api = Api(blueprint)
+
+event_parser = reqparse.RequestParser()
+event_parser.add_argument('cursor', type=inputs.natural, location='args')
+event_parser.add_argument('pipeline_id', type=inputs.positive, location='args')
+
+wait_parser = event_parser.copy()
+wait_parser.add_argument(
+    'timeout', type=inputs.int_range(0, _MAX_WAIT), default=_DEFAULT_WAIT,
+    location='args')
+
+event_fields = {
+    'id': fields.Integer,
+    'pipeline_id': fields.Integer,
+    # Null for the status changes of pipelines.
+    'job_id': fields.Integer(default=None),
+    'status': fields.String,
+    'created_at': fields.String,
+}
+
+
+def _read_events(cursor, pipeline_id):
+  """Returns the marshalled events following the cursor, and the next cursor.
+
+  Events are read up to the horizon of the cursor, the next cursor is the
+  last event read, or the horizon once all events up to it are read. The
+  transaction is ended for the next read to see newly committed events,
+  which also releases the connection while waiting.
+  """
+  try:
+    horizon = models.StatusEvent.horizon(cursor)
+    if horizon == cursor:
+      return [], cursor
+    events = models.StatusEvent.since(cursor, pipeline_id, until=horizon)
+    if len(events) == models.StatusEvent.MAX_EVENTS_PER_READ:
+      return marshal(events, event_fields), events[-1].id
+    return marshal(events, event_fields), horizon
+  finally:
+    models.StatusEvent.session.rollback()
+
+
+def _last_cursor():
+  try:
+    return models.StatusEvent.last_id()
+  finally:
+    models.StatusEvent.session.rollback()
+
+
+def _wait_for_events(cursor, pipeline_id, timeout):
+  deadline = time.monotonic() + timeout
+  while True:
+    events, cursor = _read_events(cursor, pipeline_id)
+    if events or time.monotonic() + _POLL_INTERVAL > deadline:
+      return events, cursor
+    time.sleep(_POLL_INTERVAL)
+
+
+def _stream_events(cursor, pipeline_id):
+  yield f'retry: {_STREAM_RETRY}\n\n'
+  deadline = time.monotonic() + _STREAM_DURATION
+  while True:
+    previous_cursor = cursor
+    events, cursor = _read_events(cursor, pipeline_id)
+    for event in events:
+      yield f'id: {event["id"]}\nevent: status\ndata: {json.dumps(event)}\n\n'
+    if len(events) == models.StatusEvent.MAX_EVENTS_PER_READ:
+      continue  # Catches up without waiting.
+    last_event_id = events[-1]['id'] if events else previous_cursor
+    if cursor != last_event_id:
+      # Moves the `Last-Event-ID` of the client past the events not sent,
+      # e.g. of other pipelines, without dispatching an event.
+      yield f'id: {cursor}\n\n'
+    elif not events:
+      # Comment line, keeps proxies from closing the idle connection.
+      yield ': keep-alive\n\n'
+    if time.monotonic() + _POLL_INTERVAL > deadline:
+      return
+    time.sleep(_POLL_INTERVAL)
+
+
+class StatusEventList(Resource):
+  """Waits for the status changes following a cursor.
+
+  Without cursor, returns the cursor of the last event right away, to wait
+  for the changes following it.
+  """
+
+  def get(self):
+    args = wait_parser.parse_args()
+    cursor = args['cursor']
+    if cursor is None:
+      return {'events': [], 'cursor': _last_cursor()}
+    events, cursor = _wait_for_events(
+        cursor, args['pipeline_id'], args['timeout'])
+    return {'events': events, 'cursor': cursor}
+
+
+class StatusEventStream(Resource):
+  """Streams status changes as server-sent events.
+
+  Reconnecting clients resume from their `Last-Event-ID` header, new clients
+  from the `cursor` argument or from the last event.
+  """
+
+  def get(self):
+    args = event_parser.parse_args()
+    cursor = flask.request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+      cursor = args['cursor']
+    if cursor is None:
+      cursor = _last_cursor()
+    stream = flask.stream_with_context(
+        _stream_events(cursor, args['pipeline_id']))
+    return flask.Response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+api.add_resource(StatusEventList, '/events')
+api.add_resource(StatusEventStream, '/events/stream')
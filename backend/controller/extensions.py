@@ -19,26 +19,66 @@ Each extension is initialized in the app factory located in app.py.
 
 from flask_cors import CORS
 from flask_migrate import Migrate
+from flask_sqlalchemy import get_state
 from flask_sqlalchemy import model
+from flask_sqlalchemy import SignallingSession
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy import pool
 
 from controller import mixins
 
+# Key of the read-only bind in `SQLALCHEMY_BINDS`, and of `Session.info`
+# telling that queries can be routed to it.
+REPLICA_BIND = 'replica'
+READ_FROM_REPLICA = 'read_from_replica'
+
+_QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
 
 class BaseModel(model.Model, mixins.AllFeaturesMixin, mixins.TimestampsMixin):
   """Base class for models."""
   __abstract__ = True
 
 
-db = SQLAlchemy(
+class RoutingSession(SignallingSession):
+  """Session routing reads to the replica bind when allowed.
+
+  Flushes always go to the primary database, see `database.read_from_replica`
+  for the views reading from the replica.
+  """
+
+  def get_bind(self, mapper=None, clause=None):
+    if (self.info.get(READ_FROM_REPLICA) and not self._flushing and
+        REPLICA_BIND in (self.app.config.get('SQLALCHEMY_BINDS') or {})):
+      return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+    return super().get_bind(mapper=mapper, clause=clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  """Extension creating sessions which can read from a replica."""
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+  def create_engine(self, sa_url, engine_opts):
+    # SQLite uses a single connection, unless a queue pool is requested.
+    poolclass = engine_opts.get('poolclass')
+    if sa_url.get_backend_name() == 'sqlite' and not (
+        poolclass and issubclass(poolclass, pool.QueuePool)):
+      engine_opts = {
+          key: value for key, value in engine_opts.items()
+          if key not in _QUEUE_POOL_OPTIONS
+      }
+    return super().create_engine(sa_url, engine_opts)
+
+
+# Engine options are set from the environment, see `app.create_app`.
+db = RoutingSQLAlchemy(
     model_class=BaseModel,
     session_options={
         'autocommit': False,
         'autoflush': False,
-    },
-    engine_options={
-        'pool_pre_ping': True,
-        'pool_recycle': 300,  # Recycle each connection after 5 minutes.
     }
 )
 db.Model.set_session(db.session)  # Binds the scoped session to our models.
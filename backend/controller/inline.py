@@ -12,22 +12,79 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent import futures
 from datetime import datetime, timedelta
+import os
+import threading
+import time
+from typing import Any, Iterable, Optional
+
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 
+from controller import metrics
+
+# Tables are fetched by this many threads at most when prefetched.
+_PREFETCH_WORKERS = 8
+
+# Rendering session of each thread, requests are served by several threads.
+_local = threading.local()
+
+
+class _TableCache:
+  """First row of BigQuery tables, shared by sessions for a limited time.
+
+  Scheduled pipelines often read the same configuration tables, rows are kept
+  across sessions to fetch them once per time-to-live rather than once per
+  rendering. Tables updated since can be invalidated explicitly.
+  """
+
+  def __init__(self, ttl: float):
+    self._ttl = ttl
+    self._rows: dict[str, tuple[float, dict[str, Any]]] = {}
+    self._lock = threading.Lock()
+
+  def get(self, table_id: str) -> Optional[dict[str, Any]]:
+    """Returns the cached row of a table, None if missing or expired."""
+    with self._lock:
+      entry = self._rows.get(table_id)
+      if entry is None:
+        return None
+      expires_at, row = entry
+      if expires_at <= time.monotonic():
+        del self._rows[table_id]
+        return None
+      return row
+
+  def put(self, table_id: str, row: dict[str, Any]) -> None:
+    if self._ttl <= 0:
+      return
+    with self._lock:
+      self._rows[table_id] = (time.monotonic() + self._ttl, row)
+
+  def invalidate(self, table_id: Optional[str] = None) -> None:
+    """Drops the row of a table, or of all tables if None."""
+    with self._lock:
+      if table_id is None:
+        self._rows.clear()
+      else:
+        self._rows.pop(table_id, None)
+
 
-_SESSION = None
+_bq_cache = _TableCache(
+    ttl=float(os.getenv('INLINE_BIGQUERY_CACHE_TTL', '300')))
 
 
 def open_session():
-  global _SESSION  # pylint: disable=global-statement
-  _SESSION = {'bq_cache': {}}
+  _local.session = {'bq_cache': {}}
 
 
 def close_session():
-  global _SESSION  # pylint: disable=global-statement
-  _SESSION = None
+  _local.session = None
+
+
+def _session():
+  return getattr(_local, 'session', None)
 
 
 def _today(datetime_format):
@@ -48,30 +105,84 @@ def _days_since(date, datetime_format):
   return (datetime.today() - datetime.strptime(str(date), datetime_format)).days
 
 
+def invalidate_bigquery_cache(table_id: Optional[str] = None) -> None:
+  """Fetches a table again on its next use, or all tables if None.
+
+  Sessions already open keep the rows they have read.
+  """
+  _bq_cache.invalidate(table_id)
+
+
+def _get_bq_client():
+  session = _session()
+  try:
+    return session['bq_client']
+  except KeyError:
+    session['bq_client'] = bigquery.Client()
+    return session['bq_client']
+
+
+def _fetch_first_row(client, table_id):
+  try:
+    rows = client.list_rows(table_id, max_results=1)
+    row = next(iter(rows))
+  except NotFound as e:
+    raise ValueError(f'BigQuery table `{table_id}` not found') from e
+  except StopIteration as e:
+    raise ValueError(f'BigQuery table `{table_id}` is empty') from e
+  return dict(row.items())
+
+
+def _cached_row(table_id):
+  """Returns the row read by this session or cached, None if missing."""
+  session_rows = _session()['bq_cache']
+  row = session_rows.get(table_id)
+  if row is None:
+    row = _bq_cache.get(table_id)
+    if row is not None:
+      metrics.increment('inline_bigquery_cache_hits')
+      session_rows[table_id] = row
+  return row
+
+
+def _store_row(table_id, row):
+  metrics.increment('inline_bigquery_cache_misses')
+  _session()['bq_cache'][table_id] = row
+  _bq_cache.put(table_id, row)
+
+
+def prefetch_bigquery_tables(table_ids: Iterable[str]) -> None:
+  """Fetches the first row of tables concurrently, for the current session.
+
+  Tables failing to be fetched are left to `bigquery()`, which reports why
+  while rendering the param referencing them.
+
+  Args:
+    table_ids: Ids of the tables referenced, e.g. `project.dataset.table`.
+  """
+  missing_ids = sorted(
+      table_id for table_id in set(table_ids) if _cached_row(table_id) is None)
+  if not missing_ids:
+    return
+  client = _get_bq_client()
+  with futures.ThreadPoolExecutor(
+      max_workers=min(_PREFETCH_WORKERS, len(missing_ids))) as executor:
+    fetches = {
+        table_id: executor.submit(_fetch_first_row, client, table_id)
+        for table_id in missing_ids
+    }
+  for table_id, fetch in fetches.items():
+    if fetch.exception() is None:
+      _store_row(table_id, fetch.result())
+
+
 def _bigquery(table_id, field_name):
-  def _get_bq_client():
-    try:
-      return _SESSION['bq_client']
-    except KeyError:
-      _SESSION['bq_client'] = bigquery.Client()
-      return _SESSION['bq_client']
-
-  def _fetch_bq_table_data(table_id):
-    client = _get_bq_client()
-    try:
-      rows = client.list_rows(table_id, max_results=1)
-    except NotFound as e:
-      raise ValueError(f'BigQuery table `{table_id}` not found') from e
-    try:
-      row = next(iter(rows))
-    except StopIteration as e:
-      raise ValueError(f'BigQuery table `{table_id}` is empty') from e
-    _SESSION['bq_cache'][table_id] = dict(row.items())
-
-  if table_id not in _SESSION['bq_cache']:
-    _fetch_bq_table_data(table_id)
+  row = _cached_row(table_id)
+  if row is None:
+    row = _fetch_first_row(_get_bq_client(), table_id)
+    _store_row(table_id, row)
   try:
-    value = _SESSION['bq_cache'][table_id][field_name]
+    value = row[field_name]
   except KeyError as e:
     raise ValueError(
         f"No field '{field_name}' in BigQuery table `{table_id}`") from e
@@ -23,6 +23,8 @@ from flask_restful import reqparse
 from flask_restful import Resource
 
 from common import insight
+from controller import database
+from controller import mixins
 from controller import models
 
 blueprint = Blueprint('job', __name__)
@@ -71,7 +73,7 @@ class JobSingle(Resource):
 
   @marshal_with(job_fields)
   def get(self, job_id):
-    job = models.Job.find(job_id)
+    job = models.Job.find(job_id, profile=mixins.LoadingProfile.DETAIL)
     abort_if_job_doesnt_exist(job, job_id)
     return job
 
@@ -92,7 +94,7 @@ class JobSingle(Resource):
 
   @marshal_with(job_fields)
   def put(self, job_id):
-    job = models.Job.find(job_id)
+    job = models.Job.find(job_id, profile=mixins.LoadingProfile.DETAIL)
     abort_if_job_doesnt_exist(job, job_id)
 
     if job.pipeline.is_blocked():
@@ -108,13 +110,20 @@ class JobSingle(Resource):
     return job, 200
 
 
+def _jobs_change_token() -> models.ChangeToken:
+  return models.listing_change_token(parser.parse_args()['pipeline_id'])
+
+
 class JobList(Resource):
   """Shows a list of all jobs, and lets you POST to add new jobs."""
 
+  @database.read_from_replica
+  @database.conditional(_jobs_change_token)
   @marshal_with(job_fields)
   def get(self):
     args = parser.parse_args()
-    pipeline = models.Pipeline.find(args['pipeline_id'])
+    pipeline = models.Pipeline.find(
+        args['pipeline_id'], profile=mixins.LoadingProfile.DETAIL)
     jobs = pipeline.jobs
     return jobs
 
@@ -146,7 +155,10 @@ class JobStart(Resource):
   @marshal_with(job_fields)
   def post(self, job_id):
     job = models.Job.find(job_id)
-    job.pipeline.start_single_job(job)
+    # Loads the jobs of the pipeline, this one included, to start it.
+    pipeline = models.Pipeline.find(
+        job.pipeline_id, profile=mixins.LoadingProfile.STATE_MACHINE)
+    pipeline.start_single_job(job)
     tracker = insight.GAProvider()
     tracker.track_event(
         category='jobs',
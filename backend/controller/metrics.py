@@ -0,0 +1,51 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Counters describing the activity of this controller instance.
+
+Values are kept in memory and reset when the instance restarts, they are
+exposed on `/api/metrics`.
+"""
+
+import collections
+import threading
+from typing import Union
+
+Number = Union[int, float]
+
+_lock = threading.Lock()
+_counters = collections.Counter()
+
+
+def increment(name: str, value: Number = 1) -> None:
+  """Adds a value to a counter.
+
+  Args:
+    name: Name of the counter, e.g. `delayed_tasks_scheduled`.
+    value: Value to add, defaults to one.
+  """
+  with _lock:
+    _counters[name] += value
+
+
+def get_all() -> dict[str, Number]:
+  """Returns a snapshot of all counters."""
+  with _lock:
+    return dict(_counters)
+
+
+def reset() -> None:
+  """Resets all counters to zero."""
+  with _lock:
+    _counters.clear()
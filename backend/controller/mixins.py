@@ -21,15 +21,57 @@ Source: https://github.com/absent1706/sqlalchemy-mixins
 License: MIT
 """
 
+import contextlib
+import enum
+import functools
+import random
+import time
+from typing import Optional
+
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import func
 from sqlalchemy import inspect
 from sqlalchemy import orm
+from sqlalchemy import Integer
 from sqlalchemy import sql
 
+from common import message
+from controller import metrics
+
 _OPERATOR_SPLITTER = "__"
 
+# Keys of `Session.info` counting the nested units of work in progress,
+# holding the records to insert in bulk and the functions to call once they
+# are committed.
+_UNIT_OF_WORK_DEPTH = "unit_of_work_depth"
+_BULK_INSERTS = "bulk_inserts"
+_AFTER_COMMIT_CALLBACKS = "after_commit_callbacks"
+
+# Retry policy of units of work failing with a `ConflictError`: attempts are
+# spaced by a random delay, up to an exponentially growing bound in seconds.
+MAX_CONFLICT_ATTEMPTS = 5
+_CONFLICT_BACKOFF_BASE = 0.05
+_CONFLICT_BACKOFF_MAX = 1.0
+
+
+class ConflictError(Exception):
+  """Raised when a record has been updated concurrently since it was read."""
+
+
+class LoadingProfile(enum.Enum):
+  """Relationships to load along with records, depending on their use.
+
+  Relationships are loaded lazily by default, models declare the loader
+  options of each profile in `loading_options`.
+  """
+  # Records summarized by endpoints, as in lists.
+  LIST = "list"
+  # Records with all their nested children, as exported or edited.
+  DETAIL = "detail"
+  # Pipelines and jobs being started, stopped or finished.
+  STATE_MACHINE = "state_machine"
+
 
 class TimestampsMixin(object):
   created_at = Column(DateTime, nullable=False, default=func.now())
@@ -41,6 +83,60 @@ class TimestampsMixin(object):
   )
 
 
+class VersionedMixin(object):
+  """Compare-and-swap updates, for records updated by concurrent instances.
+
+  Each update made with `compare_and_swap` increments the version, and fails
+  if another transaction has incremented it since the record was read.
+  """
+  version = Column(Integer, nullable=False, default=0, server_default="0")
+
+  def compare_and_swap(self, **values):
+    """Updates the record, if it has not changed since it was read.
+
+    Args:
+      **values: Attributes to update.
+
+    Raises:
+      ConflictError: if the record has been updated concurrently, the unit
+        of work must then be rolled back and retried.
+    """
+    type(self).compare_and_swap_all([self], **values)
+
+  @classmethod
+  def compare_and_swap_all(cls, records, **values):
+    """Updates records with a single statement, if none of them changed.
+
+    Args:
+      records: Records to update.
+      **values: Attributes to update.
+
+    Raises:
+      ConflictError: if a record has been updated concurrently, the unit of
+        work must then be rolled back and retried.
+    """
+    if not records:
+      return
+    # Pending changes would otherwise be flushed after this update.
+    cls.session.flush()
+    primary_key = cls._primary_key_attribute()
+    versions = [(record.id, record.version) for record in records]
+    result = cls.session.execute(
+        sql.update(cls)
+        .where(sql.tuple_(primary_key, cls.version).in_(versions))
+        .values(version=cls.version + 1, **values)
+        .execution_options(synchronize_session=False))
+    if result.rowcount != len(records):
+      raise ConflictError(
+          f"{cls.__name__} records {[id_ for id_, _ in versions]} were "
+          f"updated concurrently")
+    for record, (_, version) in zip(records, versions):
+      for key, value in values.items():
+        orm.attributes.set_committed_value(record, key, value)
+      orm.attributes.set_committed_value(record, "version", version + 1)
+      cls.session.expire(record, ["updated_at"])
+
+
 class classproperty:  # pylint: disable=invalid-name
   """Minimalistic class property implementation.
 
@@ -112,10 +208,132 @@ class ActiveRecordMixin(InspectionMixin, SessionMixin):
 
     return self
 
+  @classmethod
+  @contextlib.contextmanager
+  def unit_of_work(cls):
+    """Groups the changes made within the context in a single transaction.
+
+    Commits made by the helpers of this mixin are postponed until the
+    outermost unit of work exits, changes are then flushed together. The
+    transaction is rolled back if an exception is raised.
+
+    Example:
+      with Pipeline.unit_of_work():
+        pipeline.set_status(Pipeline.STATUS.RUNNING)
+        for job in pipeline.jobs:
+          job.set_status(Job.STATUS.WAITING)
+    """
+    session = cls.session
+    depth = session.info.get(_UNIT_OF_WORK_DEPTH, 0)
+    session.info[_UNIT_OF_WORK_DEPTH] = depth + 1
+    try:
+      yield
+    except BaseException:
+      session.info[_UNIT_OF_WORK_DEPTH] = depth
+      if depth == 0:
+        session.info.pop(_BULK_INSERTS, None)
+        session.info.pop(_AFTER_COMMIT_CALLBACKS, None)
+        session.rollback()
+      raise
+    session.info[_UNIT_OF_WORK_DEPTH] = depth
+    if depth > 0:
+      return
+    bulk_inserts = session.info.pop(_BULK_INSERTS, [])
+    callbacks = session.info.pop(_AFTER_COMMIT_CALLBACKS, [])
+    try:
+      if bulk_inserts:
+        # One statement per model, even when models are saved interleaved.
+        session.bulk_save_objects(bulk_inserts, preserve_order=False)
+      session.commit()
+    except BaseException:
+      session.rollback()
+      raise
+    for callback in callbacks:
+      callback()
+
+  @classmethod
+  def run_with_retries(cls, func, *args, **kwargs):
+    """Runs a function in a unit of work, retried on `ConflictError`.
+
+    The function is called again once the unit of work has been rolled
+    back, it should therefore read the records it updates. Within another
+    unit of work, the function is called once and the outermost retry runs
+    it again. Messages sent once the unit of work is committed, e.g. tasks
+    enqueued, are published in a batch.
+
+    Args:
+      func: Function to run.
+      *args: Positional arguments of the function.
+      **kwargs: Keyword arguments of the function.
+
+    Returns:
+      Value returned by the function.
+
+    Raises:
+      ConflictError: if all the attempts conflicted.
+    """
+    if cls.in_unit_of_work():
+      return func(*args, **kwargs)
+    for attempt in range(1, MAX_CONFLICT_ATTEMPTS + 1):
+      try:
+        # The batch ends after the commit, to wait for messages sent by
+        # callbacks of the unit of work.
+        with message.batch(), cls.unit_of_work():
+          return func(*args, **kwargs)
+      except ConflictError:
+        metrics.increment("conflicts")
+        if attempt == MAX_CONFLICT_ATTEMPTS:
+          raise
+      backoff = min(_CONFLICT_BACKOFF_MAX, _CONFLICT_BACKOFF_BASE * 2**attempt)
+      time.sleep(random.uniform(0, backoff))
+
+  @classmethod
+  def in_unit_of_work(cls):
+    """Returns True if commits are postponed by a unit of work."""
+    return cls.session.info.get(_UNIT_OF_WORK_DEPTH, 0) > 0
+
+  @classmethod
+  def after_commit(cls, callback):
+    """Calls a function once the current changes are committed.
+
+    Useful to notify other services about changes, e.g. publishing a task
+    only once it has been registered.
+
+    Args:
+      callback: Function called without arguments, dropped if the unit of
+        work is rolled back.
+    """
+    if cls.in_unit_of_work():
+      cls.session.info.setdefault(_AFTER_COMMIT_CALLBACKS, []).append(callback)
+    else:
+      callback()
+
+  @classmethod
+  def commit(cls):
+    """Commits the current session, unless within a unit of work."""
+    if not cls.in_unit_of_work():
+      cls.session.commit()
+
   def save(self):
     """Saves the updated model to the current entity db."""
     self.session.add(self)
-    self.session.commit()
+    if self.in_unit_of_work():
+      # New records are flushed right away, to assign their primary keys.
+      if inspect(self).pending:
+        self.session.flush()
+    else:
+      self.session.commit()
+    return self
+
+  def save_in_bulk(self):
+    """Inserts the new model along with others, in a single statement.
+
+    Within a unit of work, the insert is postponed until it commits and the
+    model does not get its primary key. Saves the model right away otherwise.
+    """
+    if not self.in_unit_of_work():
+      return self.save()
+    self.session.info.setdefault(_BULK_INSERTS, []).append(self)
     return self
 
   @classmethod
@@ -138,37 +356,112 @@ class ActiveRecordMixin(InspectionMixin, SessionMixin):
     """Removes the model from the current entity session and mark for deletion.
     """
     self.session.delete(self)
-    self.session.commit()
+    self.commit()
+
+  @classmethod
+  def dependent_foreign_keys(cls):
+    """Returns the foreign keys of records deleted along with this model.
+
+    Override to cascade deletions, e.g. `[Param.job_id]` for jobs.
+    """
+    return []
+
+  @classmethod
+  def delete_where(cls, *criteria):
+    """Deletes the records matching the criteria, with their dependents.
+
+    Issues a single `DELETE` statement per table, records referencing the
+    deleted ones through `dependent_foreign_keys` are deleted first.
+
+    Args:
+      *criteria: Filtering conditions, e.g. `Param.job_id == 1`.
+
+    Returns:
+      Number of records of this model deleted.
+    """
+    with cls.unit_of_work():
+      # Bulk statements do not flush the pending changes.
+      cls.session.flush()
+      dependent_foreign_keys = cls.dependent_foreign_keys()
+      if dependent_foreign_keys:
+        primary_key = cls._primary_key_attribute()
+        ids = [id_ for id_, in cls.session.query(primary_key).filter(
+            *criteria)]
+        if not ids:
+          return 0
+        for foreign_key in dependent_foreign_keys:
+          foreign_key.class_.delete_where(foreign_key.in_(ids))
+        criteria = [primary_key.in_(ids)]
+      return cls.query.filter(*criteria).delete(
+          synchronize_session="evaluate")
 
   @classmethod
   def destroy(cls, *ids):
-    """Deletes the records with the given ids.
+    """Deletes the records with the given ids, see `delete_where`.
 
     Args:
       *ids: Primary key ids of records.
+
+    Returns:
+      Number of records deleted.
     """
-    for pk in ids:
-      obj = cls.find(pk)
-      if obj:
-        obj.delete()
-    cls.session.flush()
+    if not ids:
+      return 0
+    return cls.delete_where(cls._primary_key_attribute().in_(ids))
+
+  @classmethod
+  def _primary_key_attribute(cls):
+    mapper = inspect(cls)
+    if len(mapper.primary_key) != 1:
+      raise TypeError(f"{cls.__name__} has a composite primary key")
+    column_property = mapper.get_property_by_column(mapper.primary_key[0])
+    return getattr(cls, column_property.key)
+
+  @classmethod
+  def loading_options(cls, profile: LoadingProfile) -> list[orm.Load]:
+    """Returns the loader options of a profile, none by default."""
+    del profile  # Unused argument
+    return []
+
+  @classmethod
+  def query_for(cls, profile: LoadingProfile) -> orm.Query:
+    """Returns a query loading records with the relationships of a profile."""
+    return cls.query.options(*cls.loading_options(profile))
 
   @classmethod
-  def all(cls):
-    return cls.query.all()
+  def all(cls, profile: Optional[LoadingProfile] = None):
+    if profile is None:
+      return cls.query.all()
+    return cls.query_for(profile).all()
 
   @classmethod
   def first(cls):
     return cls.query.first()
 
   @classmethod
-  def find(cls, id_):
+  def find(cls, id_, profile: Optional[LoadingProfile] = None):
     """Returns the record fetched for the given id.
 
+    A record already in the session is returned as is, its relationships are
+    only loaded with the profile when fetched.
+
     Args:
       id_: The primary key.
+      profile: Relationships to load along with the record, if any.
     """
-    return cls.query.get(id_)
+    if profile is None:
+      return cls.query.get(id_)
+    return cls.query_for(profile).get(id_)
+
+
+def retry_on_conflict(method):
+  """Decorates a model method to run it with `run_with_retries`."""
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    return self.run_with_retries(method, self, *args, **kwargs)
+
+  return wrapper
 
 
 class ReprMixin:
@@ -26,6 +26,7 @@ from flask_restful import reqparse
 from flask_restful import Resource
 
 from common import insight
+from controller import mixins
 from controller import ml_model
 from controller import models
 
@@ -125,7 +126,7 @@ class MlModelSingle(Resource):
     tracker = insight.GAProvider()
     tracker.track_event(category='ml-models', action='get')
 
-    obj = models.MlModel.find(id)
+    obj = models.MlModel.find(id, profile=mixins.LoadingProfile.DETAIL)
     abort_when_not_found(obj)
     return obj
 
@@ -145,7 +146,7 @@ class MlModelSingle(Resource):
 
   @marshal_with(ml_model_structure)
   def put(self, id):  # pylint: disable=redefined-builtin
-    obj = models.MlModel.find(id)
+    obj = models.MlModel.find(id, profile=mixins.LoadingProfile.DETAIL)
 
     abort_when_not_found(obj)
     abort_when_pipeline_active(obj)
@@ -172,7 +173,7 @@ class MlModelList(Resource):
     tracker = insight.GAProvider()
     tracker.track_event(category='ml-models', action='list')
 
-    objs = models.MlModel.all()
+    objs = models.MlModel.all(profile=mixins.LoadingProfile.LIST)
     return objs
 
   @marshal_with(ml_model_structure)
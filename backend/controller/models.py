@@ -22,14 +22,24 @@
 
 """Models definitions."""
 
+import collections
+import dataclasses
 import datetime
 import enum
+import functools
+import hashlib
+import itertools
+import json
+import math
 import numbers
 import re
-from typing import Optional, Union, Any
+import threading
+import time
+from typing import Any, Iterable, Optional, Union
 import uuid
 
 import jinja2
+import sqlalchemy
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
@@ -41,9 +51,14 @@ from sqlalchemy import String
 from sqlalchemy import Text
 
 from common import crmint_logging
+from common import global_settings
+from common import message
 from common import task
+from controller import dag
 from controller import extensions
 from controller import inline
+from controller import metrics
+from controller import mixins
 from controller import shared
 
 
@@ -65,6 +80,74 @@ def _str_to_number(x: str) -> numbers.Number:
     return float(x)
 
 
+class InvalidImportError(ValueError):
+  """Raised when an imported pipeline is malformed, nothing is imported."""
+
+
+def _validate_import_data(data: Any) -> None:
+  """Checks an exported pipeline before any of it is imported.
+
+  Args:
+    data: Pipeline as exported by the pipeline export endpoint.
+
+  Raises:
+    InvalidImportError: describing the first malformed entry.
+  """
+  if not isinstance(data, dict):
+    raise InvalidImportError('Pipeline must be an object')
+  for key in ('params', 'schedules', 'jobs'):
+    if not isinstance(data.get(key), list):
+      raise InvalidImportError(f'Pipeline {key} must be a list')
+  for param_data in data['params']:
+    _validate_import_param(param_data, 'Pipeline')
+  for schedule_data in data['schedules']:
+    if not isinstance(schedule_data, dict) or not schedule_data.get('cron'):
+      raise InvalidImportError('Pipeline schedules must have a cron')
+  job_ids = set()
+  for job_data in data['jobs']:
+    if not isinstance(job_data, dict) or job_data.get('id') is None:
+      raise InvalidImportError('Pipeline jobs must have an id')
+    if job_data['id'] in job_ids:
+      raise InvalidImportError(f'Job id {job_data["id"]} is not unique')
+    job_ids.add(job_data['id'])
+  conditions = {
+      StartCondition.CONDITION.SUCCESS,
+      StartCondition.CONDITION.FAIL,
+      StartCondition.CONDITION.WHATEVER,
+  }
+  for job_data in data['jobs']:
+    job_params = job_data.get('params', [])
+    start_conditions = job_data.get('hash_start_conditions', [])
+    if not isinstance(job_params, list):
+      raise InvalidImportError(f'Job {job_data["id"]} params must be a list')
+    if not isinstance(start_conditions, list):
+      raise InvalidImportError(
+          f'Job {job_data["id"]} start conditions must be a list')
+    for param_data in job_params:
+      _validate_import_param(param_data, f'Job {job_data["id"]}')
+    for start_condition in start_conditions:
+      if not isinstance(start_condition, dict):
+        raise InvalidImportError(
+            f'Job {job_data["id"]} start conditions must be objects')
+      if start_condition.get('preceding_job_id') not in job_ids:
+        raise InvalidImportError(
+            f'Job {job_data["id"]} depends on unknown job '
+            f'{start_condition.get("preceding_job_id")}')
+      if start_condition.get('condition') not in conditions:
+        raise InvalidImportError(
+            f'Job {job_data["id"]} has an invalid start condition '
+            f'{start_condition.get("condition")}')
+
+
+def _validate_import_param(param_data: Any, owner: str) -> None:
+  if (not isinstance(param_data, dict)
+      or not param_data.get('name')
+      or not param_data.get('type')
+      or 'value' not in param_data):
+    raise InvalidImportError(
+        f'{owner} params must have a name, a type and a value')
+
+
 @enum.unique
 class PipelineReadyStatus(enum.Enum):
   """Statuses for pipeline readiness."""
@@ -75,7 +158,11 @@ class PipelineReadyStatus(enum.Enum):
   JOBS_NOT_READY = enum.auto()
 
 
-class Pipeline(extensions.db.Model):
+# Structure of the recently used pipelines, see `Pipeline.get_dag`.
+_dag_cache = dag.DagCache()
+
+
+class Pipeline(extensions.db.Model, mixins.VersionedMixin):
   """Model definining a pipeline."""
   __tablename__ = 'pipelines'
   __repr_attrs__ = ['name']
@@ -84,25 +171,26 @@ class Pipeline(extensions.db.Model):
   name = Column(String(255))
   status = Column(String(50), nullable=False, default='idle')
   status_changed_at = Column(DateTime)
+  # Relationships are loaded lazily, see `loading_options` for each use.
   jobs = orm.relationship(
       'Job',
-      backref='pipeline',
-      lazy='joined')
+      backref='pipeline')
   run_on_schedule = Column(Boolean, nullable=False, default=False)
   schedules = orm.relationship(
       'Schedule',
-      lazy='joined',
       order_by='asc(Schedule.id)',
       back_populates='pipeline')
   params = orm.relationship(
       'Param',
-      lazy='joined',
       order_by='asc(Param.name)')
   ml_model_id = Column(Integer, ForeignKey('ml_models.id'), nullable=True)
   ml_model = orm.relationship(
       'MlModel',
       foreign_keys=[ml_model_id],
       back_populates='pipelines')
+  # Incremented when jobs or start conditions of the pipeline change, to
+  # identify the cached index of its structure.
+  dag_revision = Column(Integer, nullable=False, default=0, server_default='0')
 
   STATUS = shared.PipelineStatus
   INACTIVE_STATUSES = [
@@ -129,11 +217,12 @@ class Pipeline(extensions.db.Model):
       self.__setattr__(key, value)
 
   def save_relations(self, relations):
-    for key, value in relations.items():
-      if key == 'schedules':
-        self.assign_schedules(value)
-      elif key == 'params':
-        self.assign_params(value)
+    with self.unit_of_work():
+      for key, value in relations.items():
+        if key == 'schedules':
+          self.assign_schedules(value)
+        elif key == 'params':
+          self.assign_params(value)
 
   def assign_params(self, parameters):
     Param.update_list(parameters, self)
@@ -159,58 +248,105 @@ class Pipeline(extensions.db.Model):
         ids_for_removing.append(schedule.id)
     Schedule.destroy(*ids_for_removing)
 
-  def populate_params_runtime_values(self):
+  def render_context(
+      self, prefetched_params: Iterable['Param'] = ()) -> dict[str, str]:
+    """Returns the rendered values of global and pipeline variables.
+
+    Args:
+      prefetched_params: Params rendered next, BigQuery tables they reference
+        are fetched concurrently along with the ones of variables.
+
+    Raises:
+      ParamRenderingError: if a variable cannot be rendered.
+    """
+    global_params = Param.where(pipeline_id=None, job_id=None).all()
+    _prefetch_bigquery_tables(
+        itertools.chain(global_params, self.params, prefetched_params))
+    global_context = {}
+    for param in global_params:
+      global_context[param.name] = _render_param(param)
+    context = global_context.copy()
+    for param in self.params:
+      context[param.name] = _render_param(param, global_context)
+    return context
+
+  def render_run_context(
+      self, jobs: list['Job']) -> Optional[dict[str, str]]:
+    """Returns the context of a new run, None if it cannot be rendered.
+
+    Args:
+      jobs: Jobs of the run, BigQuery tables referenced by their params are
+        fetched once for the run rather than as each job starts.
+    """
     inline.open_session()
     try:
-      global_context = {}
-      for param in Param.where(pipeline_id=None, job_id=None).all():
-        global_context[param.name] = param.populate_runtime_value()
-      pipeline_context = global_context.copy()
-      for param in self.params:
-        pipeline_context[param.name] = param.populate_runtime_value(
-            global_context)
-      for job in self.jobs:
-        for param in job.params:
-          param.populate_runtime_value(pipeline_context)
+      return self.render_context(
+          itertools.chain.from_iterable(job.params for job in jobs))
+    except ParamRenderingError as e:
+      self.log_rendering_error(e)
+      return None
+    finally:
       inline.close_session()
+
+  def populate_params_runtime_values(self):
+    """Renders the params of all jobs, e.g. to validate them up front."""
+    inline.open_session()
+    try:
+      with self.unit_of_work():
+        job_params = [param for job in self.jobs for param in job.params]
+        pipeline_context = self.render_context(job_params)
+        runtime_values = [
+            _render_param(param, pipeline_context) for param in job_params]
+        Param.save_runtime_values(job_params, runtime_values)
       return True
-    except (jinja2.exceptions.TemplateError, TypeError, ValueError) as e:
-      inline.close_session()
-      job_id = 'N/A'
-      worker_class = 'N/A'
-      if param.job_id is not None:
-        job_id = param.job_id
-        worker_class = param.job.worker_class
-        message = 'Invalid job parameter "%s": %s' % (param.label, e)
-      elif param.pipeline_id is not None:
-        message = 'Invalid pipeline variable "%s": %s' % (param.label, e)
-      else:
-        message = 'Invalid global variable "%s": %s' % (param.label, e)
-      crmint_logging.log_message(
-          message,
-          log_level='ERROR',
-          pipeline_id=self.id,
-          job_id=job_id,
-          worker_class=worker_class)
+    except ParamRenderingError as e:
+      self.log_rendering_error(e)
       return False
+    finally:
+      inline.close_session()
+
+  def log_rendering_error(self, error: 'ParamRenderingError') -> None:
+    param = error.param
+    job_id = 'N/A'
+    worker_class = 'N/A'
+    if param.job_id is not None:
+      job_id = param.job_id
+      worker_class = param.job.worker_class
+      error_message = 'Invalid job parameter "%s": %s' % (param.label, error)
+    elif param.pipeline_id is not None:
+      error_message = 'Invalid pipeline variable "%s": %s' % (param.label,
+                                                             error)
+    else:
+      error_message = 'Invalid global variable "%s": %s' % (param.label, error)
+    crmint_logging.log_message(
+        error_message,
+        log_level='ERROR',
+        pipeline_id=self.id,
+        job_id=job_id,
+        worker_class=worker_class)
 
   def set_status(self, status: shared.PipelineStatus):
-    self.update(
+    """Updates the status, raises `ConflictError` if updated concurrently."""
+    self.compare_and_swap(
         status=str(status),
         status_changed_at=datetime.datetime.now(tz=datetime.timezone.utc))
+    StatusEvent.record(str(status), self.id)
 
   def get_ready(self,
-                jobs: Optional[list['Job']] = None) -> PipelineReadyStatus:
+                jobs: Optional[list['Job']] = None,
+                validate_params: bool = False) -> PipelineReadyStatus:
     """Returns the status of the pipeline if it's ready or not to be started.
 
     Args:
       jobs: List of job to run `get_ready` on too. If None, all pipeline's jobs
         will be fetched.
+      validate_params: Whether to check that the params of all jobs can be
+        rendered. Params are otherwise rendered as each job starts.
     """
     if self.status not in Pipeline.INACTIVE_STATUSES:
       return PipelineReadyStatus.ALREADY_RUNNING
     # Checks that parameters can be rendered to runtime values.
-    if not self.populate_params_runtime_values():
+    if validate_params and not self.populate_params_runtime_values():
       return PipelineReadyStatus.FAILED_RENDERING_PARAMETERS
     # Checks if there is at least one job to run.
     if not jobs:
@@ -223,152 +359,327 @@ class Pipeline(extensions.db.Model):
         return PipelineReadyStatus.JOBS_NOT_READY
     return PipelineReadyStatus.READY
 
-  def _start(self) -> None:
+  def _root_jobs(self) -> list['Job']:
+    """Returns the jobs without start conditions, others wait for them."""
+    pipeline_dag = self.get_dag()
+    return [
+        job for job in self.jobs
+        if not pipeline_dag.start_conditions_of(job.id)
+    ]
+
+  def _start(self,
+             context: dict[str, str],
+             root_jobs: list['Job'],
+             worker_params: list[dict[str, Any]]) -> None:
     # Updates statuses of pipeline and jobs, before starting any task.
     self.set_status(Pipeline.STATUS.RUNNING)
-    for job in self.jobs:
-      job.set_status(Job.STATUS.WAITING)
+    pipeline_run = PipelineRun.record_start(self, context)
+    Job.set_statuses(self.jobs, Job.STATUS.WAITING)
+    Job.set_statuses(root_jobs, Job.STATUS.RUNNING)
     # Starts jobs now that all statuses are up-to-date.
-    for job in self.jobs:
-      job.start()
-
-  def start(self) -> bool:
-    """Returns True if all jobs have been started."""
-    ready_status = self.get_ready()
-    if ready_status == PipelineReadyStatus.READY:
-      self._start()
-      return True
+    with message.batch():
+      for job, job_worker_params in zip(root_jobs, worker_params):
+        job.enqueue_worker(pipeline_run.id, context, job_worker_params)
 
-    # Invites the user to look at logs by setting all jobs as failed,
-    # since a not ready signal could be at the pipeline level, and we don't
-    # have a UI signal for a pipeline level failure.
-    notify_failure_for_statuses = [
-        PipelineReadyStatus.FAILED_RENDERING_PARAMETERS,
-        PipelineReadyStatus.JOBS_NOT_READY
-    ]
-    if ready_status in notify_failure_for_statuses:
-      self.set_status(Pipeline.STATUS.FAILED)
-      for job in self.jobs:
-        job.set_status(Job.STATUS.FAILED)
-    return False
+  @mixins.retry_on_conflict
+  def start(self, validate_params: bool = False) -> bool:
+    """Returns True if all jobs have been started.
 
+    Args:
+      validate_params: Whether to render the params of all jobs up front,
+        failing the pipeline before any job starts if one is invalid.
+    """
+    with self.unit_of_work():
+      ready_status = self.get_ready(validate_params=validate_params)
+      if ready_status == PipelineReadyStatus.READY:
+        # Variables are rendered once per run, job params as jobs start. Params
+        # of the jobs starting now are rendered before any status changes, so
+        # that an invalid one leaves no job running without a task.
+        context = self.render_run_context(self.jobs)
+        root_jobs = self._root_jobs()
+        worker_params = None
+        if context is not None:
+          worker_params = Job.render_all_worker_params(root_jobs, context)
+        if worker_params is not None:
+          self._start(context, root_jobs, worker_params)
+          return True
+        ready_status = PipelineReadyStatus.FAILED_RENDERING_PARAMETERS
+
+      # Invites the user to look at logs by setting all jobs as failed,
+      # since a not ready signal could be at the pipeline level, and we don't
+      # have a UI signal for a pipeline level failure.
+      notify_failure_for_statuses = [
+          PipelineReadyStatus.FAILED_RENDERING_PARAMETERS,
+          PipelineReadyStatus.JOBS_NOT_READY
+      ]
+      if ready_status in notify_failure_for_statuses:
+        self.set_status(Pipeline.STATUS.FAILED)
+        Job.set_statuses(self.jobs, Job.STATUS.FAILED)
+      return False
+
+  @mixins.retry_on_conflict
   def stop(self) -> bool:
     """Returns True if all jobs have been requested to stop."""
-    if self.status != Pipeline.STATUS.RUNNING:
-      return False
-    self.set_status(Pipeline.STATUS.STOPPING)
-    for job in self.jobs:
-      job.stop()
-    return True
+    with self.unit_of_work():
+      if self.status != Pipeline.STATUS.RUNNING:
+        return False
+      self.set_status(Pipeline.STATUS.STOPPING)
+      for job in self.jobs:
+        job.stop()
+      return True
 
-  def _start_as_single(self, job: 'Job') -> Union['TaskEnqueued', None]:
+  def _start_as_single(
+      self,
+      job: 'Job',
+      context: dict[str, str],
+      worker_params: dict[str, Any]) -> Union['TaskEnqueued', None]:
     # Updates statuses of pipeline and jobs, before starting any task.
     self.set_status(Pipeline.STATUS.RUNNING)
+    pipeline_run = PipelineRun.record_start(self, context)
     job.set_status(Job.STATUS.WAITING)
     # Starts jobs now that all statuses are up-to-date.
-    return job.start_as_single()
+    return job.start_as_single(pipeline_run.id, context, worker_params)
 
+  @mixins.retry_on_conflict
   def start_single_job(self, job: 'Job') -> Union['TaskEnqueued', None]:
     """Returns True if the job has been started."""
-    if self.get_ready([job]) == PipelineReadyStatus.READY:
-      return self._start_as_single(job)
+    with self.unit_of_work():
+      if self.get_ready([job]) == PipelineReadyStatus.READY:
+        context = self.render_run_context([job])
+        worker_params = None
+        if context is not None:
+          worker_params = job.render_worker_params(context)
+        if worker_params is not None:
+          return self._start_as_single(job, context, worker_params)
+
+      # Invites the user to look at logs by setting the job as failed.
+      self.set_status(Pipeline.STATUS.FAILED)
+      job.set_status(Job.STATUS.FAILED)
+      return
 
-    # Invites the user to look at logs by setting the job as failed.
-    self.set_status(Pipeline.STATUS.FAILED)
-    job.set_status(Job.STATUS.FAILED)
-    return
+  @classmethod
+  def increment_dag_revisions(cls,
+                              pipeline_ids: set[int],
+                              job_ids: set[int]) -> None:
+    """Marks the cached structure of pipelines as outdated.
+
+    Args:
+      pipeline_ids: Ids of pipelines whose jobs changed.
+      job_ids: Ids of jobs whose start conditions changed.
+    """
+    criteria = []
+    if pipeline_ids:
+      criteria.append(cls.id.in_(pipeline_ids))
+    if job_ids:
+      criteria.append(cls.id.in_(
+          sqlalchemy.select(Job.pipeline_id).where(Job.id.in_(job_ids))))
+    if not criteria:
+      return
+    cls.session.execute(
+        sqlalchemy.update(cls)
+        .where(sqlalchemy.or_(*criteria))
+        .values(dag_revision=cls.dag_revision + 1)
+        .execution_options(synchronize_session=False))
+    for obj in cls.session.identity_map.values():
+      if isinstance(obj, cls):
+        cls.session.expire(obj, ['dag_revision'])
 
-  def has_finished(self) -> bool:
+  @classmethod
+  def invalidate_dag_cache(cls) -> None:
+    """Reloads the structure of all pipelines on next use."""
+    _dag_cache.clear()
+
+  def get_dag(self) -> dag.PipelineDag:
+    """Returns the index of jobs and start conditions of this pipeline."""
+    # Sessions do not autoflush, flushes changes to start conditions first.
+    self.session.flush()
+    return _dag_cache.get(self.id, self._dag_revision_key(), self._load_dag)
+
+  def _dag_revision_key(self) -> tuple[datetime.datetime, int]:
+    # Ids of deleted pipelines can be reused by new ones.
+    return self.created_at, self.dag_revision
+
+  def _load_dag(self) -> dag.PipelineDag:
+    revision = self._dag_revision_key()
+    rows = (
+        self.session.query(
+            Job.id,
+            StartCondition.preceding_job_id,
+            StartCondition.condition)
+        .outerjoin(StartCondition, StartCondition.job_id == Job.id)
+        .filter(Job.pipeline_id == self.id)
+        .all())
+    return dag.PipelineDag.build(
+        revision,
+        job_ids=[job_id for job_id, _, _ in rows],
+        edges=[
+            dag.Edge(preceding_job_id, job_id, condition)
+            for job_id, preceding_job_id, condition in rows
+            if preceding_job_id is not None
+        ])
+
+  def job_statuses(self) -> dict[int, str]:
+    """Returns the current status of each job, with a single query."""
+    self.session.flush()
+    return dict(
+        self.session.query(Job.id, Job.status)
+        .filter(Job.pipeline_id == self.id))
+
+  def has_finished(self,
+                   statuses: Optional[dict[int, str]] = None) -> bool:
     """Returns True if a pipeline is in a finished state.
 
     A pipeline is considered finished when all jobs are in an inactive status.
+
+    Args:
+      statuses: Status of each job, queried if None.
     """
-    for job in self.jobs:
-      if job.status not in Job.INACTIVE_STATUSES:
-        return False
-    return True
+    if statuses is None:
+      statuses = self.job_statuses()
+    return all(
+        status in Job.INACTIVE_STATUSES for status in statuses.values())
 
-  def has_stopped(self) -> bool:
-    """Returns True if a pipeline was stopped and has jobs in idle status."""
-    for job in self.jobs:
-      if job.status in Job.STATUS.IDLE:
-        return True
-    return False
+  def has_stopped(self,
+                  statuses: Optional[dict[int, str]] = None) -> bool:
+    """Returns True if a pipeline was stopped and has jobs in idle status.
+
+    Args:
+      statuses: Status of each job, queried if None.
+    """
+    if statuses is None:
+      statuses = self.job_statuses()
+    return any(status == Job.STATUS.IDLE for status in statuses.values())
 
-  def has_failed(self) -> bool:
+  def has_failed(self,
+                 statuses: Optional[dict[int, str]] = None) -> bool:
     """Returns True if a pipeline is in a failed state.
 
     A pipeline is considered failed if one of these conditions is met:
       1. a leaf job failed (isolated or not)
       2. a starting condition is not fulfilled
+
+    Args:
+      statuses: Status of each job, queried if None.
     """
-    for job in self.jobs:
+    if statuses is None:
+      statuses = self.job_statuses()
+    pipeline_dag = self.get_dag()
+    for job_id in pipeline_dag.order:
       # 1. Checks if a leaf job has failed.
-      if not job.dependent_jobs:
-        if job.status == Job.STATUS.FAILED:
+      if job_id in pipeline_dag.leaves:
+        if statuses.get(job_id) == Job.STATUS.FAILED:
           return True
       # 2. Checks if a starting condition has been invalidated.
-      for start_condition in job.start_conditions:
-        if job.start_condition_invalidated(start_condition):
+      for edge in pipeline_dag.start_conditions_of(job_id):
+        if StartCondition.is_invalidated(
+            edge.condition, statuses.get(edge.preceding_job_id)):
           return True
     return False
 
   # TODO(dulacp): rename this method to `job_finished`
   def leaf_job_finished(self) -> None:
     """Determines if the pipeline should be considered finished or failed."""
-    if self.has_failed():
-      self.stop()
-      self.set_status(Pipeline.STATUS.FAILED)
-      crmint_logging.log_pipeline_status(
-          f'Failed pipeline "{self.name}"',
-          pipeline_status=self.status,
-          pipeline_id=self.id)
-    elif self.has_stopped():
-      self.set_status(Pipeline.STATUS.IDLE)
-    elif self.has_finished():
-      self.set_status(Pipeline.STATUS.SUCCEEDED)
-      crmint_logging.log_pipeline_status(
-          f'Succeeded pipeline "{self.name}"',
-          pipeline_status=self.status,
-          pipeline_id=self.id)
+    with self.unit_of_work():
+      statuses = self.job_statuses()
+      if self.has_failed(statuses):
+        self.stop()
+        self.set_status(Pipeline.STATUS.FAILED)
+        crmint_logging.log_pipeline_status(
+            f'Failed pipeline "{self.name}"',
+            pipeline_status=self.status,
+            pipeline_id=self.id)
+      elif self.has_stopped(statuses):
+        self.set_status(Pipeline.STATUS.IDLE)
+      elif self.has_finished(statuses):
+        self.set_status(Pipeline.STATUS.SUCCEEDED)
+        crmint_logging.log_pipeline_status(
+            f'Succeeded pipeline "{self.name}"',
+            pipeline_status=self.status,
+            pipeline_id=self.id)
+      if self.status in Pipeline.INACTIVE_STATUSES:
+        PipelineRun.record_finish(self.id, self.status)
 
   def import_data(self, data):
-    self.assign_params(data['params'])
-    self.assign_schedules(data['schedules'])
-    job_mapping = {}
-    jobs = []
-    if data['jobs']:
+    """Imports the params, schedules and jobs of an exported pipeline.
+
+    The whole payload is validated first. Jobs are then inserted with a single
+    flush, their params and start conditions in bulk, in one transaction.
+
+    Args:
+      data: Pipeline as exported, its jobs referencing each other by their
+        original ids in `hash_start_conditions`.
+
+    Raises:
+      InvalidImportError: if the payload is malformed.
+    """
+    _validate_import_data(data)
+    with self.unit_of_work():
+      self.assign_params(data['params'])
+      self.assign_schedules(data['schedules'])
+      jobs = []
       for job_data in data['jobs']:
-        job = Job.create()
-        job.pipeline_id = self.id
+        job = Job(pipeline_id=self.id)
         job.assign_attributes(job_data)
-        job.save()
-        job.save_relations(job_data)
         jobs.append(job)
-        job_mapping[job_data['id']] = job.id
-      for job in jobs:
-        index = list(job_mapping.values()).index(job.id)
-        job_id = list(job_mapping.keys())[index]
-        job_data = next((j for j in data['jobs'] if j['id'] == job_id), None)
-        job.assign_hash_start_conditions(job_data['hash_start_conditions'],
-                                         job_mapping)
+      self.session.add_all(jobs)
+      # Assigns the primary keys of all the new jobs at once.
+      self.session.flush()
+      job_mapping = {
+          job_data['id']: job.id for job_data, job in zip(data['jobs'], jobs)}
+      for job_data, job in zip(data['jobs'], jobs):
+        for param_data in job_data.get('params', []):
+          param = Param()
+          param.job_id = job.id
+          param.assign_attributes(param_data)
+          param.save_in_bulk()
+        for start_condition in job_data.get('hash_start_conditions', []):
+          StartCondition(
+              job_id=job.id,
+              preceding_job_id=job_mapping[start_condition['preceding_job_id']],
+              condition=start_condition['condition']).save_in_bulk()
 
   def is_blocked(self):
     return (self.run_on_schedule or
             self.status in [Pipeline.STATUS.RUNNING, Pipeline.STATUS.STOPPING])
 
-  def destroy(self):
-    sc_ids = [sc.id for sc in self.schedules]
-    if sc_ids:
-      Schedule.destroy(*sc_ids)
+  @classmethod
+  def loading_options(cls, profile: mixins.LoadingProfile) -> list[orm.Load]:
+    if profile == mixins.LoadingProfile.LIST:
+      return [
+          orm.selectinload(cls.schedules),
+          orm.selectinload(cls.params),
+          # Only tells whether the pipeline has jobs.
+          orm.selectinload(cls.jobs).load_only(Job.id),
+      ]
+    if profile == mixins.LoadingProfile.DETAIL:
+      return [
+          orm.selectinload(cls.schedules),
+          orm.selectinload(cls.params),
+          orm.selectinload(cls.jobs).options(
+              orm.selectinload(Job.params),
+              orm.selectinload(Job.start_conditions)),
+      ]
+    # Parameters are rendered on start, start conditions are evaluated from
+    # the index of the pipeline structure.
+    return [
+        orm.selectinload(cls.params),
+        orm.selectinload(cls.jobs).options(
+            orm.selectinload(Job.params),
+            orm.raiseload(Job.dependent_jobs),
+            orm.raiseload(Job.affecting_jobs)),
+    ]
 
-    for job in self.jobs:
-      job.destroy()
+  @classmethod
+  def dependent_foreign_keys(cls):
+    return [
+        Schedule.pipeline_id,
+        PipelineRun.pipeline_id,
+        Job.pipeline_id,
+        Param.pipeline_id,
+    ]
 
-    param_ids = [p.id for p in self.params]
-    if param_ids:
-      Param.destroy(*param_ids)
-    self.delete()
+  def destroy(self):
+    Pipeline.delete_where(Pipeline.id == self.id)
 
 
 class MlModel(extensions.db.Model):
@@ -378,30 +689,22 @@ class MlModel(extensions.db.Model):
 
   id = Column(Integer, primary_key=True, autoincrement=True)
   name = Column(String(255), nullable=False)
+  # Relationships are loaded lazily, see `loading_options` for each use.
   bigquery_dataset = orm.relationship(
       'MlModelBigQueryDataset',
-      uselist=False,
-      lazy='joined')
+      uselist=False)
   type = Column(String(255), nullable=False)
   unique_id = Column(String(255), nullable=False)
   uses_first_party_data = Column(Boolean, nullable=False, default=False)
-  hyper_parameters = orm.relationship(
-      'MlModelHyperParameter',
-      lazy='joined')
-  features = orm.relationship(
-      'MlModelFeature',
-      lazy='joined')
+  hyper_parameters = orm.relationship('MlModelHyperParameter')
+  features = orm.relationship('MlModelFeature')
   label = orm.relationship(
       'MlModelLabel',
-      uselist=False,
-      lazy='joined')
+      uselist=False)
   class_imbalance = Column(Integer, nullable=False, default=4)
-  timespans = orm.relationship(
-      'MlModelTimespan',
-      lazy='joined')
+  timespans = orm.relationship('MlModelTimespan')
   pipelines = orm.relationship(
       'Pipeline',
-      lazy='joined',
       order_by='asc(Pipeline.id)')
 
   TYPES = [
@@ -433,19 +736,20 @@ class MlModel(extensions.db.Model):
         self.__setattr__(key, value)
 
   def save_relations(self, relations):
-    for key, value in relations.items():
-      if key == 'bigquery_dataset':
-        self.assign_bigquery_dataset(value)
-      elif key == 'features':
-        self.assign_features(value)
-      elif key == 'label':
-        self.assign_label(value)
-      elif key == 'hyper_parameters':
-        self.assign_hyper_parameters(value)
-      elif key == 'timespans':
-        self.assign_timespans(value)
-      elif key == 'pipelines':
-        self.assign_pipelines(value)
+    with self.unit_of_work():
+      for key, value in relations.items():
+        if key == 'bigquery_dataset':
+          self.assign_bigquery_dataset(value)
+        elif key == 'features':
+          self.assign_features(value)
+        elif key == 'label':
+          self.assign_label(value)
+        elif key == 'hyper_parameters':
+          self.assign_hyper_parameters(value)
+        elif key == 'timespans':
+          self.assign_timespans(value)
+        elif key == 'pipelines':
+          self.assign_pipelines(value)
 
   def assign_bigquery_dataset(self, dataset):
     if self.bigquery_dataset:
@@ -482,8 +786,7 @@ class MlModel(extensions.db.Model):
         MlModelTimespan.create(ml_model_id=self.id, **timespan)
 
   def assign_pipelines(self, pipelines):
-    for pipeline in self.pipelines:
-      pipeline.destroy()
+    Pipeline.delete_where(Pipeline.ml_model_id == self.id)
 
     for pipeline in pipelines:
       model_pipeline = Pipeline(name=pipeline['name'])
@@ -491,26 +794,35 @@ class MlModel(extensions.db.Model):
       model_pipeline.save()
       model_pipeline.import_data(pipeline)
 
-  def destroy(self):
-    for pipeline in self.pipelines:
-      pipeline.destroy()
-
-    if self.bigquery_dataset:
-      self.bigquery_dataset.delete()
-
-    for feature in self.features:
-      feature.delete()
-
-    if self.label:
-      self.label.delete()
-
-    for param in self.hyper_parameters:
-      param.delete()
+  @classmethod
+  def loading_options(cls, profile: mixins.LoadingProfile) -> list[orm.Load]:
+    if profile == mixins.LoadingProfile.STATE_MACHINE:
+      return []
+    # Lists and details display the whole ml model with its pipelines.
+    return [
+        orm.selectinload(cls.bigquery_dataset),
+        orm.selectinload(cls.hyper_parameters),
+        orm.selectinload(cls.features),
+        orm.selectinload(cls.label),
+        orm.selectinload(cls.timespans),
+        orm.selectinload(cls.pipelines).options(
+            orm.selectinload(Pipeline.schedules),
+            orm.selectinload(Pipeline.jobs).selectinload(Job.params)),
+    ]
 
-    for timespan in self.timespans:
-      timespan.delete()
+  @classmethod
+  def dependent_foreign_keys(cls):
+    return [
+        Pipeline.ml_model_id,
+        MlModelBigQueryDataset.ml_model_id,
+        MlModelFeature.ml_model_id,
+        MlModelLabel.ml_model_id,
+        MlModelHyperParameter.ml_model_id,
+        MlModelTimespan.ml_model_id,
+    ]
 
-    self.delete()
+  def destroy(self):
+    MlModel.delete_where(MlModel.id == self.id)
 
 
 class MlModelBigQueryDataset(extensions.db.Model):
@@ -589,6 +901,20 @@ class TaskEnqueued(extensions.db.Model):
   id = Column(Integer, primary_key=True, autoincrement=True)
   task_namespace = Column(String(60), index=True)
   task_name = Column(String(100), index=True, unique=True)
+  last_heartbeat_at = Column(DateTime)
+
+  @classmethod
+  def record_heartbeat(cls, task_name: str) -> bool:
+    """Records that a task is still running.
+
+    Returns:
+      False if the task is not registered, e.g. it has finished already.
+    """
+    updated_count = cls.query.filter_by(task_name=task_name).update(
+        {'last_heartbeat_at': datetime.datetime.utcnow()},
+        synchronize_session=False)
+    cls.commit()
+    return updated_count > 0
 
   @classmethod
   def count_in_namespace(cls, task_namespace: str) -> int:
@@ -602,6 +928,105 @@ class TaskEnqueued(extensions.db.Model):
     return self.task_name
 
 
+class DelayedTask(extensions.db.Model):
+  """Model holding tasks enqueued with a delay until they are due.
+
+  Pub/Sub has no delayed delivery, a task published right away would be
+  rejected with `TooEarlyError` and redelivered by the subscription until its
+  start time. Instead, due tasks are published by `enqueue_due_tasks`, called
+  on every scheduler tick and task result.
+  """
+  __tablename__ = 'delayed_tasks'
+  __repr_attrs__ = ['task_name', 'deliver_at']
+
+  # Minimum backoff of the `crmint-3-start-task` subscription, in seconds.
+  START_TASK_MIN_BACKOFF = 60
+
+  # Maximum number of tasks published by a single `enqueue_due_tasks` call.
+  MAX_TASKS_PER_FLUSH = 500
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  task_name = Column(String(100), unique=True)
+  data = Column(Text())
+  deliver_at = Column(DateTime, nullable=False, index=True)
+
+  @classmethod
+  def schedule(cls, task_inst: task.Task, delay: int) -> 'DelayedTask':
+    """Holds a task until its delay has passed.
+
+    Args:
+      task_inst: Task to enqueue once due.
+      delay: Delay in seconds.
+
+    Returns:
+      The stored delayed task.
+    """
+    deliver_at = (datetime.datetime.utcnow()
+                  + datetime.timedelta(seconds=delay))
+    delayed_task = cls.create(
+        task_name=task_inst.name,
+        data=json.dumps(task_inst.to_data()),
+        deliver_at=deliver_at)
+    # Counted once committed, units of work retried on conflict would
+    # otherwise count it again.
+    cls.after_commit(
+        lambda: metrics.increment('delayed_tasks_scheduled'))
+    # Each redelivery of a published task waits at least the minimum backoff.
+    bounces_avoided = math.ceil(delay / cls.START_TASK_MIN_BACKOFF)
+    cls.after_commit(
+        lambda: metrics.increment(
+            'delayed_tasks_bounces_avoided', bounces_avoided))
+    return delayed_task
+
+  @classmethod
+  def enqueue_due_tasks(cls,
+                        now: Optional[datetime.datetime] = None) -> int:
+    """Publishes the tasks whose delay has passed.
+
+    Rows are deleted only after their tasks have been published, a failure
+    leaves them to the next call. Tasks are published in their own batch, a
+    batch opened by the caller would only be resolved after the deletion is
+    committed.
+
+    Args:
+      now: Current UTC time, defaults to `datetime.datetime.utcnow()`.
+
+    Returns:
+      Number of tasks published.
+    """
+    now = now or datetime.datetime.utcnow()
+    due_tasks = (
+        cls.query
+        .filter(cls.deliver_at <= now)
+        .order_by(cls.deliver_at)
+        .limit(cls.MAX_TASKS_PER_FLUSH)
+        # Concurrent controller instances skip rows being published.
+        .with_for_update(skip_locked=True)
+        .all())
+    if not due_tasks:
+      cls.commit()
+      return 0
+    try:
+      with message.batch(isolated=True):
+        for delayed_task in due_tasks:
+          task.Task.from_data(json.loads(delayed_task.data)).enqueue()
+    except Exception as e:  # pylint: disable=broad-except
+      # Releases the row locks, tasks published before the failure are
+      # published again by the next call.
+      cls.commit()
+      crmint_logging.log_global_message(
+          f'Failed to publish {len(due_tasks)} delayed tasks: {e}',
+          log_level='ERROR')
+      return 0
+    cls.query.filter(
+        cls.id.in_([delayed_task.id for delayed_task in due_tasks])
+    ).delete(synchronize_session=False)
+    cls.commit()
+    cls.after_commit(
+        lambda: metrics.increment('delayed_tasks_enqueued', len(due_tasks)))
+    return len(due_tasks)
+
+
 class StartCondition(extensions.db.Model):
   """Model for a starting condition between two jobs."""
   __tablename__ = 'start_conditions'
@@ -646,8 +1071,27 @@ class StartCondition(extensions.db.Model):
         'condition': value['condition']
     }
 
+  @classmethod
+  def is_fulfilled(cls, condition: str, preceding_job_status: str) -> bool:
+    """Returns True if a job can start given the preceding job status."""
+    if condition == cls.CONDITION.SUCCESS:
+      if preceding_job_status != Job.STATUS.SUCCEEDED:
+        return False
+    elif condition == cls.CONDITION.FAIL:
+      if preceding_job_status == Job.STATUS.SUCCEEDED:
+        return False
+    return True
+
+  @classmethod
+  def is_invalidated(cls, condition: str, preceding_job_status: str) -> bool:
+    """Returns True if the preceding job finished without fulfilling it."""
+    if preceding_job_status not in [Job.STATUS.FAILED, Job.STATUS.SUCCEEDED]:
+      # Still running or idle
+      return False
+    return not cls.is_fulfilled(condition, preceding_job_status)
+
 
-class Job(extensions.db.Model):
+class Job(extensions.db.Model, mixins.VersionedMixin):
   """Model for a job."""
   __tablename__ = 'jobs'
   __repr_attrs__ = ['name']
@@ -658,12 +1102,16 @@ class Job(extensions.db.Model):
   status_changed_at = Column(DateTime)
   worker_class = Column(String(255))
   pipeline_id = Column(Integer, ForeignKey('pipelines.id'))
-  params = orm.relationship('Param', backref='job', lazy='joined')
+  # Number of tasks registered in `enqueued_tasks` for this job, only updated
+  # atomically with SQL expressions.
+  running_tasks_count = Column(
+      Integer, nullable=False, default=0, server_default='0')
+  # Relationships are loaded lazily, see `loading_options` for each use.
+  params = orm.relationship('Param', backref='job')
   start_conditions = orm.relationship(
       'StartCondition',
       primaryjoin='Job.id==StartCondition.job_id',
-      back_populates='job',
-      lazy='joined')
+      back_populates='job')
   affected_conditions = orm.relationship(
       'StartCondition',
       primaryjoin='Job.id==StartCondition.preceding_job_id',
@@ -696,20 +1144,32 @@ class Job(extensions.db.Model):
     self.worker_class = worker_class
     self.pipeline_id = pipeline_id
 
-  def destroy(self):
-    sc_ids = [sc.id for sc in self.start_conditions]
-    if sc_ids:
-      StartCondition.destroy(*sc_ids)
+  @classmethod
+  def loading_options(cls, profile: mixins.LoadingProfile) -> list[orm.Load]:
+    if profile == mixins.LoadingProfile.STATE_MACHINE:
+      return [
+          orm.raiseload(cls.dependent_jobs),
+          orm.raiseload(cls.affecting_jobs),
+      ]
+    return [
+        orm.selectinload(cls.params),
+        orm.selectinload(cls.start_conditions).joinedload(
+            StartCondition.preceding_job).load_only(Job.name),
+    ]
 
-    dependent_job_sc_ids = [
-        sc.id for sc in StartCondition.where(preceding_job_id=self.id).all()]
-    if dependent_job_sc_ids:
-      StartCondition.destroy(*dependent_job_sc_ids)
+  @classmethod
+  def dependent_foreign_keys(cls):
+    return [
+        StartCondition.job_id,
+        StartCondition.preceding_job_id,
+        Param.job_id,
+        JobRun.job_id,
+    ]
 
-    param_ids = [p.id for p in self.params]
-    if param_ids:
-      Param.destroy(*param_ids)
-    self.delete()
+  def destroy(self):
+    with self.unit_of_work():
+      Pipeline.increment_dag_revisions({self.pipeline_id}, set())
+      Job.delete_where(Job.id == self.id)
 
   def assign_attributes(self, attributes):
     for key, value in attributes.items():
@@ -718,11 +1178,12 @@ class Job(extensions.db.Model):
       self.__setattr__(key, value)
 
   def save_relations(self, relations):
-    for key, value in relations.items():
-      if key == 'params':
-        self.assign_params(value)
-      elif key == 'start_conditions':
-        self.assign_start_conditions(value)
+    with self.unit_of_work():
+      for key, value in relations.items():
+        if key == 'params':
+          self.assign_params(value)
+        elif key == 'start_conditions':
+          self.assign_start_conditions(value)
 
   def add_start_conditions(self, items):
     for item in items:
@@ -731,15 +1192,6 @@ class Job(extensions.db.Model):
   def assign_params(self, parameters):
     Param.update_list(parameters, self)
 
-  def assign_hash_start_conditions(self, arg_start_conditions, job_mapping):
-    for arg_start_condition in arg_start_conditions:
-      preceding_job_id = job_mapping[arg_start_condition['preceding_job_id']]
-      StartCondition.create(
-          job_id=self.id,
-          preceding_job_id=preceding_job_id,
-          condition=arg_start_condition['condition']
-      )
-
   def assign_start_conditions(self, arg_start_conditions):
     scs = []
     for arg_start_condition in arg_start_conditions:
@@ -768,15 +1220,31 @@ class Job(extensions.db.Model):
         sc.save()
     # Delete extra start conditions
     delete_sc_ids = set(cur_sc_ids) - set(arg_sc_ids)
-    StartCondition.where(
-        job_id=self.id,
-        preceding_job_id__in=delete_sc_ids
-    ).delete(synchronize_session=False)
+    if delete_sc_ids:
+      StartCondition.delete_where(
+          StartCondition.job_id == self.id,
+          StartCondition.preceding_job_id.in_(delete_sc_ids))
+      Pipeline.increment_dag_revisions(set(), {self.id})
 
   def set_status(self, status: shared.JobStatus):
-    self.update(
+    """Updates the status, raises `ConflictError` if updated concurrently."""
+    self.compare_and_swap(
         status=str(status),
         status_changed_at=datetime.datetime.now(tz=datetime.timezone.utc))
+    StatusEvent.record(str(status), self.pipeline_id, [self.id])
+
+  @classmethod
+  def set_statuses(cls, jobs: list['Job'], status: shared.JobStatus):
+    """Updates the status of jobs with a single statement."""
+    cls.compare_and_swap_all(
+        jobs,
+        status=str(status),
+        status_changed_at=datetime.datetime.now(tz=datetime.timezone.utc))
+    job_ids_by_pipeline = collections.defaultdict(list)
+    for job in jobs:
+      job_ids_by_pipeline[job.pipeline_id].append(job.id)
+    for pipeline_id, job_ids in job_ids_by_pipeline.items():
+      StatusEvent.record(str(status), pipeline_id, job_ids)
 
   def get_ready(self) -> bool:
     """Returns True if the job is ready to be started."""
@@ -784,69 +1252,200 @@ class Job(extensions.db.Model):
       return False
     return True
 
-  def start_condition_invalidated(self,
-                                  start_condition: StartCondition) -> bool:
-    predecing_job_status = start_condition.preceding_job.status
-    if predecing_job_status not in [Job.STATUS.FAILED, Job.STATUS.SUCCEEDED]:
-      # Still running or idle
-      return False
-    return not self._start_condition_is_fulfilled(start_condition)
-
-  def _start_condition_is_fulfilled(self, start_condition) -> bool:
-    preceding_job_status = start_condition.preceding_job.status
-    if start_condition.condition == StartCondition.CONDITION.SUCCESS:
-      if preceding_job_status != Job.STATUS.SUCCEEDED:
-        return False
-    elif start_condition.condition == StartCondition.CONDITION.FAIL:
-      if preceding_job_status == Job.STATUS.SUCCEEDED:
-        return False
-    return True
-
-  def _start_dependent_jobs(self) -> list[TaskEnqueued]:
+  def _start_dependent_jobs(
+      self,
+      dependent_ids: tuple[int, ...],
+      statuses: dict[int, str]) -> list[TaskEnqueued]:
     enqueued_tasks = []
-    for job in self.dependent_jobs:
-      started_task = job.start()
-      if started_task:
-        enqueued_tasks.append(started_task)
+    with message.batch():
+      for job_id in dependent_ids:
+        started_task = Job.find(job_id).start(statuses)
+        if started_task:
+          enqueued_tasks.append(started_task)
     return enqueued_tasks
 
-  def start(self) -> Union[TaskEnqueued, None]:
+  def start(
+      self,
+      statuses: Optional[dict[int, str]] = None) -> Union[TaskEnqueued, None]:
+    """Starts the job if its start conditions are fulfilled.
+
+    Args:
+      statuses: Status of each job of the pipeline, queried if None.
+    """
     if self.status not in Job.STATUS.WAITING:
       # NOTE: Usually means that a single job was started from the UI,
       #       so other jobs are still in an inactive status.
       return None
-    for start_condition in self.start_conditions:
-      if start_condition.preceding_job.status not in Job.INACTIVE_STATUSES:
+    if statuses is None:
+      statuses = self.pipeline.job_statuses()
+    for edge in self.pipeline.get_dag().start_conditions_of(self.id):
+      preceding_job_status = statuses.get(edge.preceding_job_id)
+      if preceding_job_status not in Job.INACTIVE_STATUSES:
         # Starting condition still running.
         return None
-      if not self._start_condition_is_fulfilled(start_condition):
+      if not StartCondition.is_fulfilled(edge.condition, preceding_job_status):
         # Cannot start this job, pipeline has failed.
         self.pipeline.leaf_job_finished()
         return None
     return self.start_as_single()
 
-  def start_as_single(self) -> Union[TaskEnqueued, None]:
+  def start_as_single(
+      self,
+      pipeline_run_id: Optional[int] = None,
+      context: Optional[dict[str, str]] = None,
+      worker_params: Optional[dict[str, Any]] = None
+  ) -> Union[TaskEnqueued, None]:
     if self.status != Job.STATUS.WAITING:
       # We raise an error as this case should never happen.
       raise RuntimeError('Job.start_as_single was called outside of '
                          'Pipeline.start or Pipeline.start_as_single')
     self.set_status(Job.STATUS.RUNNING)
-    worker_params = {p.name: p.worker_value for p in self.params}
+    return self.enqueue_worker(pipeline_run_id, context, worker_params)
+
+  def enqueue_worker(
+      self,
+      pipeline_run_id: Optional[int] = None,
+      context: Optional[dict[str, str]] = None,
+      worker_params: Optional[dict[str, Any]] = None
+  ) -> Union[TaskEnqueued, None]:
+    """Records a run of this job, renders its params and enqueues its task.
+
+    Args:
+      pipeline_run_id: Id of the pipeline run, looked up if None.
+      context: Rendered variables of the run, read from the run if None.
+      worker_params: Params already rendered, rendered with the variables of
+        the run if None.
+    """
+    if pipeline_run_id is None:
+      pipeline_run_id = PipelineRun.current_id(self.pipeline_id)
+    JobRun.record_start(self, pipeline_run_id)
+    if worker_params is None:
+      if context is None and pipeline_run_id is not None:
+        context = PipelineRun.context_of(pipeline_run_id)
+      worker_params = self.render_worker_params(context)
+    if worker_params is None:
+      # Fails as a failed task would, e.g. starting jobs depending on failure.
+      self._last_task_finished(Job.STATUS.FAILED)
+      return None
     return self.enqueue(self.worker_class, worker_params)
 
+  @classmethod
+  def render_all_worker_params(
+      cls,
+      jobs: list['Job'],
+      context: dict[str, str]) -> Optional[list[dict[str, Any]]]:
+    """Returns the worker params of each job, None if one cannot be rendered.
+
+    Args:
+      jobs: Jobs about to start.
+      context: Rendered variables of the run.
+    """
+    worker_params = []
+    for job in jobs:
+      job_worker_params = job.render_worker_params(context)
+      if job_worker_params is None:
+        return None
+      worker_params.append(job_worker_params)
+    return worker_params
+
+  def render_worker_params(
+      self, context: Optional[dict[str, str]]) -> Optional[dict[str, Any]]:
+    """Renders the params of the job, with the variables of its run.
+
+    Args:
+      context: Rendered variables of the run, rendered again if None, e.g.
+        if the run did not record them.
+
+    Returns:
+      Worker value of each param, None if one cannot be rendered.
+    """
+    inline.open_session()
+    try:
+      if context is None:
+        context = self.pipeline.render_context(self.params)
+      else:
+        _prefetch_bigquery_tables(self.params)
+      runtime_values = [_render_param(p, context) for p in self.params]
+    except ParamRenderingError as e:
+      self.pipeline.log_rendering_error(e)
+      return None
+    finally:
+      inline.close_session()
+    Param.save_runtime_values(self.params, runtime_values)
+    return {p.name: p.worker_value for p in self.params}
+
   def _get_task_namespace(self):
     return f'pipeline={self.pipeline_id}_job={self.id}'
 
   def _add_task_with_name(self, task_name) -> TaskEnqueued:
     """Keeps track of running tasks."""
     namespace = self._get_task_namespace()
-    return TaskEnqueued.create(task_namespace=namespace, task_name=task_name)
+    task_enqueued = TaskEnqueued(task_namespace=namespace, task_name=task_name)
+    task_enqueued.save_in_bulk()
+    # Increments the counter atomically with the next update of the job row,
+    # e.g. along with its status in a unit of work.
+    running_tasks_count = sqlalchemy.inspect(self).dict.get(
+        'running_tasks_count')
+    if not isinstance(running_tasks_count, sqlalchemy.sql.ClauseElement):
+      running_tasks_count = Job.running_tasks_count
+    self.running_tasks_count = running_tasks_count + 1
+    self.save()
+    return task_enqueued
+
+  def _add_running_tasks(self, value: int) -> int:
+    """Adds a value to the running tasks counter and reads it, uncommitted.
+
+    The update locks the job row until the end of the transaction, so that
+    concurrent transactions see the counter change one after the other.
 
-  def _get_tasks_with_name(self, task_name: str) -> list[TaskEnqueued]:
-    """Returns list of tasks attached to a given name."""
-    task_namespace = self._get_task_namespace()
-    return TaskEnqueued.where(task_namespace=task_namespace,
-                              task_name=task_name).all()
+    Args:
+      value: Number of tasks to add, negative for finished tasks.
+
+    Returns:
+      Number of tasks still running for this job.
+    """
+    job_query = self.session.query(Job).filter(Job.id == self.id)
+    job_query.update(
+        {Job.running_tasks_count: Job.running_tasks_count + value},
+        synchronize_session=False)
+    return job_query.with_entities(Job.running_tasks_count).scalar()
+
+  def _remove_tasks_with_names(self, task_names: list[str]) -> tuple[int, int]:
+    """Unregisters finished tasks.
+
+    Deleting a task row claims it, so that a task finished twice concurrently
+    (e.g. a duplicate delivery) is only counted once. The counter is then
+    decremented in the same transaction: only one transaction can see it
+    reach zero.
+
+    Args:
+      task_names: Names of the finished tasks.
+
+    Returns:
+      Pair of the number of tasks unregistered and the number of tasks still
+      running for this job.
+    """
+    # Bulk statements do not flush, e.g. counter increments of tasks enqueued
+    # in the same unit of work.
+    self.session.flush()
+    deleted_count = TaskEnqueued.query.filter(
+        TaskEnqueued.task_namespace == self._get_task_namespace(),
+        TaskEnqueued.task_name.in_(task_names),
+    ).delete(synchronize_session='evaluate')
+    if deleted_count:
+      num_running_tasks = self._add_running_tasks(-deleted_count)
+    else:
+      num_running_tasks = self.session.query(Job.running_tasks_count).filter(
+          Job.id == self.id).scalar()
+    self.commit()
+    return deleted_count, num_running_tasks
+
+  def registered_task_names(self, task_names: list[str]) -> set[str]:
+    """Returns the names of running tasks among the given ones."""
+    query = self.session.query(TaskEnqueued.task_name).filter(
+        TaskEnqueued.task_namespace == self._get_task_namespace(),
+        TaskEnqueued.task_name.in_(task_names))
+    return {task_name for task_name, in query}
 
   def _enqueued_task_count(self):
     task_namespace = self._get_task_namespace()
@@ -859,23 +1458,36 @@ class Job(extensions.db.Model):
     if self.status != Job.STATUS.RUNNING:
       return None
     name = str(uuid.uuid4())
-    general_settings = {gs.name: gs.value for gs in GeneralSetting.all()}
+    snapshot = GeneralSetting.snapshot()
+    general_settings = {
+        setting_name: snapshot.values[setting_name]
+        for setting_name in global_settings.for_worker(worker_class)
+        if setting_name in snapshot.values
+    }
     task_inst = task.Task(
         name,
         self.pipeline_id,
         self.id,
         worker_class,
         worker_params,
-        general_settings)
-    task_inst.enqueue(delay)
+        general_settings,
+        general_settings_version=snapshot.version)
+    # Registers the task before publishing it, so that its result cannot be
+    # received before.
+    task_enqueued = self._add_task_with_name(name)
+    if delay and not message.supports_delayed_delivery():
+      DelayedTask.schedule(task_inst, delay)
+    else:
+      self.after_commit(lambda: task_inst.enqueue(delay))
     crmint_logging.log_message(
         f'Enqueued task for (worker_class, name): ({worker_class}, {name})',
         log_level='DEBUG',
         worker_class=self.worker_class,
         pipeline_id=self.pipeline_id,
         job_id=self.id)
-    return self._add_task_with_name(name)
+    return task_enqueued
 
+  @mixins.retry_on_conflict
   def _task_finished(self,
                      task_name: str,
                      new_job_status: str) -> int:
@@ -898,57 +1510,97 @@ class Job(extensions.db.Model):
         pipeline_id=self.pipeline_id,
         job_id=self.id)
     # Ignores tasks that are not registered which should be considered an error.
-    found_tasks = self._get_tasks_with_name(task_name)
-    if not found_tasks:
+    deleted_count, num_running_tasks = self._remove_tasks_with_names(
+        [task_name])
+    if not deleted_count:
       crmint_logging.log_message(
           f'Unregistered task for name: {task_name}',
           log_level='WARNING',
           worker_class=self.worker_class,
           pipeline_id=self.pipeline_id,
           job_id=self.id)
-      return self._enqueued_task_count()
+      return num_running_tasks
 
-    # Deletes matched tasks
-    for task_inst in found_tasks:
-      task_inst.delete()
-    num_running_tasks = self._enqueued_task_count()
     crmint_logging.log_message(
         f'Running tasks: {num_running_tasks}',
         log_level='INFO',
         worker_class=self.worker_class,
         pipeline_id=self.pipeline_id,
         job_id=self.id)
+    if num_running_tasks > 0:
+      return num_running_tasks
+    return self._last_task_finished(new_job_status)
 
-    # NOTE: `was_last_task_lock` acts as a kind of concurrent lock, only one
-    #       task can validate this condition.
-    was_last_task_lock = num_running_tasks == 0
-    if not was_last_task_lock:
+  @mixins.retry_on_conflict
+  def tasks_finished(self, task_statuses: list[tuple[str, str]]) -> int:
+    """Records the finishing state of several tasks at once.
+
+    Equivalent to calling `_task_finished` for each task in order, with a
+    single query deleting the finished tasks.
+
+    Args:
+      task_statuses: Pairs of registered task name and status of the
+        finished task, in order of completion.
+
+    Returns:
+      Number of tasks still running for this given job.
+    """
+    task_names = [task_name for task_name, _ in task_statuses]
+    deleted_count, num_running_tasks = self._remove_tasks_with_names(
+        task_names)
+    crmint_logging.log_message(
+        f'Finished {deleted_count} task(s), running tasks: '
+        f'{num_running_tasks}',
+        log_level='INFO',
+        worker_class=self.worker_class,
+        pipeline_id=self.pipeline_id,
+        job_id=self.id)
+    if deleted_count == 0 or num_running_tasks > 0:
       return num_running_tasks
+    _, new_job_status = task_statuses[-1]
+    return self._last_task_finished(new_job_status)
 
-    # Updates the job database status if there is no more running tasks.
-    # This is essential because one job could spin multiple tasks.
-    # NOTE: if a job has spinned multiple tasks, we will only consider the
-    #       status of the last task to complete.
-    stopping_signal = self.status == Job.STATUS.STOPPING
-    self.set_status(new_job_status)
+  def _last_task_finished(self, new_job_status: str) -> int:
+    """Updates the job and starts dependent jobs, once all tasks finished.
 
-    # Once the job status has been updated, we can check if the pipeline has
-    # already been marked failed to avoid notifying multiple times users.
-    if self.pipeline.status == Pipeline.STATUS.FAILED:
-      return 0
+    Args:
+      new_job_status: Status of the last finished task.
 
-    # We can safely start children jobs, because of our above concurrent lock.
-    # NOTE: Only if stopping has not been triggered.
-    # NOTE: And only if other jobs are still waiting.
-    waiting_signal = all(
-        job.status == Job.STATUS.WAITING for job in self.dependent_jobs)
-    if self.dependent_jobs and not stopping_signal and waiting_signal:
-      self._start_dependent_jobs()
+    Returns:
+      Number of tasks still running for this given job, i.e. zero.
+    """
+    with self.unit_of_work():
+      # Updates the job database status if there is no more running tasks.
+      # This is essential because one job could spin multiple tasks.
+      # NOTE: if a job has spinned multiple tasks, we will only consider the
+      #       status of the last task to complete.
+      stopping_signal = self.status == Job.STATUS.STOPPING
+      self.set_status(new_job_status)
+      JobRun.record_finish(self.id, new_job_status)
+      # Serializes the jobs of a pipeline finishing concurrently, so that
+      # start conditions are evaluated on the latest statuses.
+      self.pipeline.compare_and_swap()
+
+      # Once the job status has been updated, we can check if the pipeline has
+      # already been marked failed to avoid notifying multiple times users.
+      if self.pipeline.status == Pipeline.STATUS.FAILED:
+        return 0
+
+      # We can safely start children jobs, because of our above concurrent lock.
+      # NOTE: Only if stopping has not been triggered.
+      # NOTE: And only if other jobs are still waiting.
+      dependent_ids = self.pipeline.get_dag().dependents_of(self.id)
+      statuses = self.pipeline.job_statuses()
+      waiting_signal = all(
+          statuses.get(job_id) == Job.STATUS.WAITING
+          for job_id in dependent_ids)
+      if dependent_ids and not stopping_signal and waiting_signal:
+        self._start_dependent_jobs(dependent_ids, statuses)
+        return 0
+
+      self.pipeline.leaf_job_finished()
       return 0
 
-    self.pipeline.leaf_job_finished()
-    return 0
-
   def task_succeeded(self, task_name: str) -> int:
     return self._task_finished(task_name, Job.STATUS.SUCCEEDED)
 
@@ -967,6 +1619,10 @@ class Job(extensions.db.Model):
     return False
 
 
+_LEGACY_STATEMENT_SYNTAX = re.compile(r'{% ([A-Z0-9_]+) %}')
+_LEGACY_FORMAT_SYNTAX = re.compile(r'%\(([^)]+)\)')
+
+
 def _update_legacy_syntaxes(template: str) -> str:
   """Returns an updated template, using correct jinj2 engine syntax.
 
@@ -979,12 +1635,81 @@ def _update_legacy_syntaxes(template: str) -> str:
     template: Content of the template to upgrade.
   """
   # 1. `{% VAR_NAME %}`
-  template = re.sub(r'{% ([A-Z0-9_]+) %}', r'{{ \1 }}', template)
+  template = _LEGACY_STATEMENT_SYNTAX.sub(r'{{ \1 }}', template)
   # 2. `%(var_name)`
-  template = re.sub(r'%\(([^)]+)\)', r'{{ \1 }}', template)
+  template = _LEGACY_FORMAT_SYNTAX.sub(r'{{ \1 }}', template)
   return template
 
 
+# Param values are compiled once per distinct value, see `_compile_template`.
+_template_environment = jinja2.Environment(undefined=jinja2.StrictUndefined)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_template(value: str) -> jinja2.Template:
+  """Returns the compiled template of a param value, cached by value.
+
+  Args:
+    value: Raw value of the param, possibly using legacy syntaxes.
+
+  Raises:
+    jinja2.TemplateSyntaxError: if the value is not a valid template.
+  """
+  return _template_environment.from_string(_update_legacy_syntaxes(value))
+
+
+@functools.lru_cache(maxsize=1024)
+def _bigquery_tables_of(value: str) -> frozenset[str]:
+  """Returns the tables read by `bigquery()` calls of a param value.
+
+  Only tables named by a literal string can be found before rendering.
+
+  Args:
+    value: Raw value of the param, possibly using legacy syntaxes.
+  """
+  try:
+    ast = _template_environment.parse(_update_legacy_syntaxes(value))
+  except jinja2.TemplateSyntaxError:
+    return frozenset()  # Reported when rendering the param.
+  table_ids = set()
+  for call in ast.find_all(jinja2.nodes.Call):
+    if (isinstance(call.node, jinja2.nodes.Name)
+        and call.node.name == 'bigquery'
+        and call.args
+        and isinstance(call.args[0], jinja2.nodes.Const)
+        and isinstance(call.args[0].value, str)):
+      table_ids.add(call.args[0].value)
+  return frozenset(table_ids)
+
+
+def _prefetch_bigquery_tables(params: Iterable['Param']) -> None:
+  """Fetches the BigQuery tables referenced by params, concurrently."""
+  inline.prefetch_bigquery_tables(itertools.chain.from_iterable(
+      _bigquery_tables_of(param.value) for param in params if param.value))
+
+
+class ParamRenderingError(Exception):
+  """Raised when the value of a param cannot be rendered."""
+
+  def __init__(self, param: 'Param', error: Exception):
+    super().__init__(str(error))
+    self.param = param
+
+
+def _render_param(param: 'Param',
+                  context: Optional[dict[str, str]] = None) -> str:
+  """Returns the runtime value of a param.
+
+  Raises:
+    ParamRenderingError: if the value is not a valid template, or if an
+      inline function failed.
+  """
+  try:
+    return param.render(context)
+  except (jinja2.exceptions.TemplateError, TypeError, ValueError) as e:
+    raise ParamRenderingError(param, e) from e
+
+
 class Param(extensions.db.Model):
   """Model encapsulating a parameter value."""
   __tablename__ = 'params'
@@ -1001,17 +1726,42 @@ class Param(extensions.db.Model):
   value = Column(Text())
   runtime_value = Column(Text())
 
-  def populate_runtime_value(self, context=None):
+  def render(self, context=None) -> str:
+    """Returns the runtime value of the param, without saving it."""
     if context is None:
       context = {}
     # Leverages jinja2 templating system to render inline functions.
-    updated_value = _update_legacy_syntaxes(self.value)
-    template = jinja2.Template(updated_value, undefined=jinja2.StrictUndefined)
-    value = template.render(**inline.functions, **context)
+    template = _compile_template(self.value)
+    return template.render(**inline.functions, **context)
+
+  def populate_runtime_value(self, context=None):
+    value = self.render(context)
     if self.job_id is not None:
       self.update(runtime_value=value)
     return value
 
+  @classmethod
+  def save_runtime_values(cls, params: list['Param'],
+                          runtime_values: list[str]) -> None:
+    """Saves the rendered runtime values of params with a single update.
+
+    Params hold their new runtime value as if it had been loaded, their
+    worker values can be read without another query.
+
+    Args:
+      params: Params rendered.
+      runtime_values: Runtime value of each param.
+    """
+    if not params:
+      return
+    cls.session.bulk_update_mappings(cls, [
+        {'id': param.id, 'runtime_value': runtime_value}
+        for param, runtime_value in zip(params, runtime_values)
+    ])
+    for param, runtime_value in zip(params, runtime_values):
+      orm.attributes.set_committed_value(param, 'runtime_value', runtime_value)
+    cls.commit()
+
   @property
   def worker_value(self):
     if self.type == 'boolean':
@@ -1038,41 +1788,42 @@ class Param(extensions.db.Model):
     self.name = name
     self.type = param_type
 
+  def assign_attributes(self, attributes):
+    self.name = attributes['name']
+    self.label = attributes.get('label', attributes['name'])
+    self.type = attributes['type']
+    if attributes['type'] == 'boolean':
+      self.value = attributes['value']
+    else:
+      self.value = str(attributes['value'])
+
   @classmethod
   def update_list(cls, parameters, obj=None):
-    arg_param_ids = []
-    for arg_param in parameters:
-      param = None
-      if arg_param.get('id') is not None:
-        # Updating
-        param = Param.find(arg_param.get('id'))
-      else:
-        # Creating
-        param = Param()
-        if obj and isinstance(obj, Pipeline):
-          param.pipeline_id = obj.id
-        elif obj and isinstance(obj, Job):
-          param.job_id = obj.id
-      param.name = arg_param['name']
-      try:
-        param.label = arg_param['label']
-      except KeyError:
-        param.label = arg_param['name']
-      param.type = arg_param['type']
-      if arg_param['type'] == 'boolean':
-        param.value = arg_param['value']
-      else:
-        param.value = str(arg_param['value'])
-      param.save()
-      arg_param_ids.append(param.id)
-    # Removing
-    ids_for_removing = []
-    params = obj.params if obj else Param.where(pipeline_id=None,
-                                                job_id=None).all()
-    for param in params:
-      if param.id not in arg_param_ids:
-        ids_for_removing.append(param.id)
-    Param.destroy(*ids_for_removing)
+    with cls.unit_of_work():
+      arg_param_ids = []
+      for arg_param in parameters:
+        param = None
+        if arg_param.get('id') is not None:
+          # Updating
+          param = Param.find(arg_param.get('id'))
+        else:
+          # Creating
+          param = Param()
+          if obj and isinstance(obj, Pipeline):
+            param.pipeline_id = obj.id
+          elif obj and isinstance(obj, Job):
+            param.job_id = obj.id
+        param.assign_attributes(arg_param)
+        param.save()
+        arg_param_ids.append(param.id)
+      # Removing
+      ids_for_removing = []
+      params = obj.params if obj else Param.where(pipeline_id=None,
+                                                  job_id=None).all()
+      for param in params:
+        if param.id not in arg_param_ids:
+          ids_for_removing.append(param.id)
+      Param.destroy(*ids_for_removing)
 
 
 class Schedule(extensions.db.Model):
@@ -1088,15 +1839,516 @@ class Schedule(extensions.db.Model):
       'Pipeline', foreign_keys=[pipeline_id], back_populates='schedules')
 
 
+def _seconds_between(
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]) -> Optional[float]:
+  if start is None or end is None:
+    return None
+  return (end - start).total_seconds()
+
+
+class PipelineRun(extensions.db.Model):
+  """Model recording a run of a pipeline, kept once it has finished."""
+  __tablename__ = 'pipeline_runs'
+  __repr_attrs__ = ['pipeline_id', 'status']
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  pipeline_id = Column(Integer, ForeignKey('pipelines.id'), index=True)
+  status = Column(String(50), nullable=False)
+  started_at = Column(DateTime, nullable=False)
+  finished_at = Column(DateTime)
+  # Rendered global and pipeline variables, as JSON, see `context_of`.
+  context = Column(Text())
+  job_runs = orm.relationship(
+      'JobRun',
+      order_by='asc(JobRun.id)',
+      back_populates='pipeline_run')
+
+  @property
+  def duration(self) -> Optional[float]:
+    """Seconds from the start to the end of the run, None if running."""
+    return _seconds_between(self.started_at, self.finished_at)
+
+  @classmethod
+  def dependent_foreign_keys(cls):
+    return [JobRun.pipeline_run_id]
+
+  @classmethod
+  def record_start(cls,
+                   pipeline: Pipeline,
+                   context: Optional[dict[str, str]] = None) -> 'PipelineRun':
+    """Records the start of a run.
+
+    Args:
+      pipeline: Pipeline started.
+      context: Rendered variables, job params are rendered with them as each
+        job starts.
+    """
+    return cls.create(
+        pipeline_id=pipeline.id,
+        status=Pipeline.STATUS.RUNNING,
+        started_at=datetime.datetime.utcnow(),
+        context=json.dumps(context) if context is not None else None)
+
+  @classmethod
+  def context_of(cls, run_id: int) -> Optional[dict[str, str]]:
+    """Returns the rendered variables of a run, None if not recorded."""
+    context = cls.session.query(cls.context).filter(cls.id == run_id).scalar()
+    if context is None:
+      return None
+    return json.loads(context)
+
+  @classmethod
+  def current_id(cls, pipeline_id: int) -> Optional[int]:
+    """Returns the id of the unfinished run of a pipeline, if any."""
+    query = (
+        cls.session.query(cls.id)
+        .filter(cls.pipeline_id == pipeline_id, cls.finished_at.is_(None))
+        .order_by(cls.id.desc())
+        .limit(1))
+    return query.scalar()
+
+  @classmethod
+  def record_finish(cls, pipeline_id: int, status: str) -> int:
+    """Ends the unfinished runs of a pipeline.
+
+    Returns:
+      Number of runs ended.
+    """
+    return cls.query.filter(
+        cls.pipeline_id == pipeline_id, cls.finished_at.is_(None)
+    ).update(
+        {'status': status, 'finished_at': datetime.datetime.utcnow()},
+        synchronize_session='evaluate')
+
+
+class JobRun(extensions.db.Model):
+  """Model recording a run of a job with statistics about its tasks."""
+  __tablename__ = 'job_runs'
+  __repr_attrs__ = ['job_id', 'status']
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  pipeline_run_id = Column(
+      Integer, ForeignKey('pipeline_runs.id'), nullable=True, index=True)
+  job_id = Column(Integer, ForeignKey('jobs.id'), index=True)
+  # Copied from the job, which can be edited after its run.
+  name = Column(String(255))
+  worker_class = Column(String(255))
+  status = Column(String(50), nullable=False)
+  started_at = Column(DateTime, nullable=False)
+  finished_at = Column(DateTime)
+  # Counters updated atomically with SQL expressions, as results arrive.
+  tasks_succeeded = Column(Integer, nullable=False, default=0)
+  tasks_failed = Column(Integer, nullable=False, default=0)
+  task_attempts = Column(Integer, nullable=False, default=0)
+  # Total seconds waited by tasks between their enqueuing and execution.
+  queue_wait = Column(Float, nullable=False, default=0.0)
+  pipeline_run = orm.relationship(
+      'PipelineRun',
+      foreign_keys=[pipeline_run_id],
+      back_populates='job_runs')
+
+  @property
+  def duration(self) -> Optional[float]:
+    """Seconds from the start to the end of the run, None if running."""
+    return _seconds_between(self.started_at, self.finished_at)
+
+  @property
+  def tasks_count(self) -> int:
+    return self.tasks_succeeded + self.tasks_failed
+
+  @property
+  def average_queue_wait(self) -> Optional[float]:
+    if not self.tasks_count:
+      return None
+    return self.queue_wait / self.tasks_count
+
+  @classmethod
+  def record_start(cls, job: 'Job', pipeline_run_id: Optional[int]) -> None:
+    cls(
+        pipeline_run_id=pipeline_run_id,
+        job_id=job.id,
+        name=job.name,
+        worker_class=job.worker_class,
+        status=Job.STATUS.RUNNING,
+        started_at=datetime.datetime.utcnow(),
+        tasks_succeeded=0,
+        tasks_failed=0,
+        task_attempts=0,
+        queue_wait=0.0,
+    ).save_in_bulk()
+
+  @classmethod
+  def record_tasks(cls,
+                   job_id: int,
+                   succeeded: int = 0,
+                   failed: int = 0,
+                   attempts: int = 0,
+                   queue_wait: float = 0.0) -> int:
+    """Adds finished tasks to the unfinished run of a job.
+
+    Args:
+      job_id: Id of the job.
+      succeeded: Number of tasks which succeeded.
+      failed: Number of tasks which failed.
+      attempts: Number of executions of these tasks.
+      queue_wait: Seconds waited by these tasks before their execution.
+
+    Returns:
+      Number of runs updated.
+    """
+    return cls.query.filter(
+        cls.job_id == job_id, cls.finished_at.is_(None)
+    ).update(
+        {
+            cls.tasks_succeeded: cls.tasks_succeeded + succeeded,
+            cls.tasks_failed: cls.tasks_failed + failed,
+            cls.task_attempts: cls.task_attempts + attempts,
+            cls.queue_wait: cls.queue_wait + queue_wait,
+        },
+        synchronize_session=False)
+
+  @classmethod
+  def record_finish(cls, job_id: int, status: str) -> int:
+    """Ends the unfinished runs of a job.
+
+    Returns:
+      Number of runs ended.
+    """
+    return cls.query.filter(
+        cls.job_id == job_id, cls.finished_at.is_(None)
+    ).update(
+        {'status': status, 'finished_at': datetime.datetime.utcnow()},
+        synchronize_session='evaluate')
+
+
+class StatusEvent(extensions.db.Model):
+  """Model recording a status change of a pipeline or of a job.
+
+  Events are numbered by their increasing ids, clients resume the stream of
+  status changes from the id of the last event they received. Ids are
+  assigned on insert, events of concurrent transactions can therefore be
+  committed in another order, see `horizon`.
+  """
+  __tablename__ = 'status_events'
+  __repr_attrs__ = ['pipeline_id', 'job_id', 'status']
+
+  # Events are pruned once older, clients further behind reload their lists.
+  RETENTION = datetime.timedelta(days=1)
+
+  # Maximum number of events returned by a single `since` call.
+  MAX_EVENTS_PER_READ = 500
+
+  # Events following a missing id are held back for this long at most, for
+  # it to be committed, or known to be rolled back.
+  COMMIT_DELAY = datetime.timedelta(seconds=5)
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  pipeline_id = Column(Integer, index=True)
+  job_id = Column(Integer)
+  status = Column(String(50), nullable=False)
+
+  @classmethod
+  def record(cls, status: str, pipeline_id: Optional[int],
+             job_ids: Optional[list[int]] = None) -> None:
+    """Records the status change of a pipeline, or of some of its jobs.
+
+    Events are inserted in the transaction updating the status, in bulk
+    within a unit of work.
+
+    Args:
+      status: New status.
+      pipeline_id: Id of the pipeline, or of the pipeline of the jobs.
+      job_ids: Ids of the jobs whose status changed, None for the pipeline.
+    """
+    for job_id in job_ids or [None]:
+      event = cls().fill(pipeline_id=pipeline_id, job_id=job_id, status=status)
+      if cls.in_unit_of_work():
+        event.save_in_bulk()
+      else:
+        # Flushed along with the status update, by the caller's commit.
+        cls.session.add(event)
+
+  @classmethod
+  def horizon(cls, cursor: int) -> int:
+    """Returns the id up to which events following the cursor can be read.
+
+    Ids following the cursor are read in order until a missing one, which
+    may belong to an event not committed yet. Events following it are held
+    back, until it is committed or for `COMMIT_DELAY` since they were
+    recorded, since its transaction may have been rolled back.
+
+    Args:
+      cursor: Id of the last event received.
+    """
+    rows = (
+        cls.session.query(cls.id, cls.created_at)
+        .filter(cls.id > cursor)
+        .order_by(cls.id)
+        .limit(cls.MAX_EVENTS_PER_READ)
+        .all())
+    settled_before = datetime.datetime.utcnow() - cls.COMMIT_DELAY
+    horizon = cursor
+    for event_id, created_at in rows:
+      if event_id != horizon + 1 and created_at > settled_before:
+        break
+      horizon = event_id
+    return horizon
+
+  @classmethod
+  def since(cls,
+            cursor: int,
+            pipeline_id: Optional[int] = None,
+            until: Optional[int] = None) -> list['StatusEvent']:
+    """Returns the events recorded after the given one, oldest first.
+
+    Args:
+      cursor: Id of the last event received, 0 for all retained events.
+      pipeline_id: Only returns the events of this pipeline, if given.
+      until: Id of the last event to return, e.g. the `horizon` of the
+        cursor, if given.
+    """
+    query = cls.query.filter(cls.id > cursor)
+    if until is not None:
+      query = query.filter(cls.id <= until)
+    if pipeline_id is not None:
+      query = query.filter(cls.pipeline_id == pipeline_id)
+    return query.order_by(cls.id).limit(cls.MAX_EVENTS_PER_READ).all()
+
+  @classmethod
+  def last_id(cls) -> int:
+    """Returns a cursor to follow new events from, 0 if there is none.
+
+    Events recorded within `COMMIT_DELAY` follow the cursor, they may have
+    been committed after events with greater ids.
+    """
+    settled_before = datetime.datetime.utcnow() - cls.COMMIT_DELAY
+    return cls.session.query(sqlalchemy.func.max(cls.id)).filter(
+        cls.created_at <= settled_before).scalar() or 0
+
+  @classmethod
+  def prune(cls) -> int:
+    """Deletes the events older than the retention period.
+
+    Returns:
+      Number of events deleted.
+    """
+    expired_before = datetime.datetime.utcnow() - cls.RETENTION
+    count = cls.query.filter(cls.created_at < expired_before).delete(
+        synchronize_session=False)
+    cls.commit()
+    return count
+
+
+@dataclasses.dataclass(frozen=True)
+class ChangeToken:
+  """Identifies a version of the data displayed by a view.
+
+  Attributes:
+    etag: Changes whenever the data changes.
+    last_modified: Last update of the data, None if there is none. Precise
+      to the second only, changes made within the same second share it.
+  """
+  etag: str
+  last_modified: Optional[datetime.datetime]
+
+
+# Session info key of the transactions in which revisions were incremented.
+_INCREMENTED_REVISIONS = 'incremented_revisions'
+
+class Revision(extensions.db.Model):
+  """Model counting the changes made to the records it tracks.
+
+  Unlike update times, stored with a one-second precision, revisions tell
+  apart changes made within the same second.
+  """
+  __tablename__ = 'revisions'
+  __repr_attrs__ = ['name', 'value']
+
+  # Edits of pipelines, jobs, and of their params, schedules and start
+  # conditions, see `listing_change_token`.
+  LISTING = 'listing'
+
+  name = Column(String(50), primary_key=True)
+  value = Column(Integer, nullable=False, default=0)
+
+  @classmethod
+  def increment(cls, name: str) -> None:
+    """Increments a revision, once per transaction.
+
+    The row of the revision stays locked until the transaction ends, later
+    changes in the same transaction are committed along with the increment.
+    """
+    session = cls.session()
+    transaction = session.get_transaction()
+    incremented_in = session.info.setdefault(_INCREMENTED_REVISIONS, {})
+    if incremented_in.get(name) is transaction:
+      return
+    session.execute(
+        sqlalchemy.update(cls)
+        .where(cls.name == name)
+        .values(value=cls.value + 1)
+        .execution_options(synchronize_session=False))
+    incremented_in[name] = transaction
+
+
+@sqlalchemy.event.listens_for(Revision.__table__, 'after_create')
+def _insert_revisions(target, connection, **kwargs):
+  """Inserts the revisions along with their table, as migrations do."""
+  del kwargs  # Unused argument
+  connection.execute(target.insert().values(name=Revision.LISTING, value=0))
+
+
+def listing_change_token(pipeline_id: Optional[int] = None) -> ChangeToken:
+  """Returns the change token of the pipeline and job lists, in one query.
+
+  Status changes are tracked by the last status event, other changes by the
+  listing revision.
+
+  Args:
+    pipeline_id: Only tracks the status changes of this pipeline, if given.
+  """
+  events = StatusEvent.query
+  if pipeline_id is not None:
+    events = events.filter(StatusEvent.pipeline_id == pipeline_id)
+  revision = Revision.query.filter(Revision.name == Revision.LISTING)
+  aggregates = [
+      events.with_entities(sqlalchemy.func.max(StatusEvent.id)),
+      events.with_entities(sqlalchemy.func.max(StatusEvent.created_at)),
+      revision.with_entities(Revision.value),
+      revision.with_entities(Revision.updated_at),
+  ]
+  row = extensions.db.session.query(
+      *[query.scalar_subquery() for query in aggregates]).one()
+  etag = hashlib.sha1(repr(tuple(row)).encode('utf-8')).hexdigest()
+  # Last event and edit times, see the order of the columns.
+  timestamps = [value for value in row[1::2] if value is not None]
+  return ChangeToken(etag, max(timestamps, default=None))
+
+
+# Models of the records displayed by the pipeline and job lists.
+_LISTED_MODELS = (Pipeline, Job, Param, Schedule, StartCondition)
+
+# Attributes updated while pipelines run, tracked by status events instead of
+# the listing revision.
+_RUN_STATE_ATTRIBUTES = frozenset([
+    'dag_revision',
+    'running_tasks_count',
+    'runtime_value',
+    'status',
+    'status_changed_at',
+    'updated_at',
+    'version',
+])
+
+
+def _is_edited(session: orm.Session, obj: Any) -> bool:
+  if obj in session.new or obj in session.deleted:
+    return True
+  state = sqlalchemy.inspect(obj)
+  return any(
+      state.attrs[key].history.has_changes()
+      for key in state.mapper.column_attrs.keys()
+      if key not in _RUN_STATE_ATTRIBUTES)
+
+
+@sqlalchemy.event.listens_for(orm.Session, 'before_flush')
+def _increment_listing_revision(session, flush_context, instances):
+  """Increments the listing revision if listed records are being edited."""
+  del flush_context, instances  # Unused argument
+  changed_objects = itertools.chain(
+      session.new, session.deleted, session.dirty)
+  if any(isinstance(obj, _LISTED_MODELS) and _is_edited(session, obj)
+         for obj in changed_objects):
+    Revision.increment(Revision.LISTING)
+
+
+@sqlalchemy.event.listens_for(orm.Session, 'do_orm_execute')
+def _increment_listing_revision_on_delete(orm_execute_state):
+  """Increments the listing revision if listed records are bulk deleted."""
+  mapper = orm_execute_state.bind_mapper
+  if (orm_execute_state.is_delete
+      and mapper is not None
+      and issubclass(mapper.class_, _LISTED_MODELS)):
+    Revision.increment(Revision.LISTING)
+
+
+@sqlalchemy.event.listens_for(orm.Session, 'before_flush')
+def _increment_dag_revisions(session, flush_context, instances):
+  """Increments the revision of pipelines whose jobs are being changed."""
+  del flush_context, instances  # Unused argument
+  pipeline_ids = set()
+  job_ids = set()
+  changed_objects = itertools.chain(
+      session.new, session.deleted, session.dirty)
+  for obj in changed_objects:
+    if isinstance(obj, Job):
+      # Loads the attribute if expired, for its unchanged value.
+      history = sqlalchemy.inspect(obj).attrs.pipeline_id.load_history()
+      if obj in session.dirty and not history.has_changes():
+        continue  # Status update.
+      pipeline_ids.update(history.sum())
+    elif isinstance(obj, StartCondition):
+      if obj in session.dirty and not session.is_modified(obj):
+        continue
+      job_ids.update(
+          sqlalchemy.inspect(obj).attrs.job_id.load_history().sum())
+  pipeline_ids.discard(None)
+  job_ids.discard(None)
+  Pipeline.increment_dag_revisions(pipeline_ids, job_ids)
+
+
+@dataclasses.dataclass(frozen=True)
+class GeneralSettingsSnapshot:
+  """Values of all general settings, identified by a version."""
+  version: str
+  values: dict[str, str]
+  loaded_at: float
+
+
+_general_settings_snapshot: Optional[GeneralSettingsSnapshot] = None
+_general_settings_snapshot_lock = threading.Lock()
+
+
 class GeneralSetting(extensions.db.Model):
   """Model to store a general setting."""
   __tablename__ = 'general_settings'
   __repr_attrs__ = ['name']
 
+  # Seconds before the snapshot is reloaded, bounding how long a controller
+  # instance can miss settings updated through another instance.
+  SNAPSHOT_TTL = 60
+
   id = Column(Integer, primary_key=True, autoincrement=True)
   name = Column(String(255))
   value = Column(Text())
 
+  @classmethod
+  def snapshot(cls) -> GeneralSettingsSnapshot:
+    """Returns the cached values of all general settings.
+
+    The version is a hash of the values, identical on all instances.
+    """
+    global _general_settings_snapshot  # pylint: disable=global-statement
+    with _general_settings_snapshot_lock:
+      snapshot = _general_settings_snapshot
+      if (snapshot is None
+          or time.monotonic() - snapshot.loaded_at > cls.SNAPSHOT_TTL):
+        values = {gs.name: gs.value for gs in cls.all()}
+        serialized_values = json.dumps(values, sort_keys=True)
+        version = hashlib.sha1(serialized_values.encode('utf8')).hexdigest()
+        snapshot = GeneralSettingsSnapshot(
+            version=version[:12], values=values, loaded_at=time.monotonic())
+        _general_settings_snapshot = snapshot
+      return snapshot
+
+  @classmethod
+  def invalidate_snapshot(cls) -> None:
+    """Reloads the snapshot on next use, call it after updating settings."""
+    global _general_settings_snapshot  # pylint: disable=global-statement
+    with _general_settings_snapshot_lock:
+      _general_settings_snapshot = None
+
 
 # TODO(dulacp): deprecate the Stage model.
 class Stage(extensions.db.Model):
@@ -24,16 +24,18 @@ import flask
 from flask_restful import abort
 from flask_restful import Api
 from flask_restful import fields
+from flask_restful import inputs
 from flask_restful import marshal_with
 from flask_restful import reqparse
 from flask_restful import Resource
 from google.cloud import logging
 import jinja2
-from sqlalchemy import orm
 import werkzeug
 
 from common import crmint_logging
 from common import insight
+from controller import database
+from controller import mixins
 from controller import models
 
 _LOGS_PAGE_SIZE = 20
@@ -82,7 +84,8 @@ class PipelineSingle(Resource):
 
   @marshal_with(pipeline_fields)
   def get(self, pipeline_id):
-    pipeline = models.Pipeline.find(pipeline_id)
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.LIST)
     abort_if_pipeline_doesnt_exist(pipeline, pipeline_id)
     return pipeline
 
@@ -101,7 +104,8 @@ class PipelineSingle(Resource):
 
   @marshal_with(pipeline_fields)
   def put(self, pipeline_id):
-    pipeline = models.Pipeline.find(pipeline_id)
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.LIST)
     abort_if_pipeline_doesnt_exist(pipeline, pipeline_id)
 
     if pipeline.is_blocked():
@@ -120,15 +124,13 @@ class PipelineSingle(Resource):
 class PipelineList(Resource):
   """Shows a list of all pipelines, and lets you POST to add new pipelines."""
 
+  @database.read_from_replica
+  @database.conditional(models.listing_change_token)
   @marshal_with(pipeline_fields)
   def get(self):
     tracker = insight.GAProvider()
     tracker.track_event(category='pipelines', action='list')
-    pipelines = models.Pipeline.query.options(
-        (orm.defaultload(models.Pipeline.jobs).defaultload(
-            models.Job.params).defer(models.Param.value)),
-        (orm.defaultload(models.Pipeline.jobs).defaultload(
-            models.Job.params).defer(models.Param.runtime_value))).all()
+    pipelines = models.Pipeline.all(profile=mixins.LoadingProfile.LIST)
     return pipelines
 
   @marshal_with(pipeline_fields)
@@ -143,13 +145,20 @@ class PipelineList(Resource):
     return pipeline, 201
 
 
+start_parser = reqparse.RequestParser()
+start_parser.add_argument(
+    'validate_params', type=inputs.boolean, default=False, location='args')
+
+
 class PipelineStart(Resource):
   """Class for run pipeline."""
 
   @marshal_with(pipeline_fields)
   def post(self, pipeline_id):
-    pipeline = models.Pipeline.find(pipeline_id)
-    pipeline.start()
+    args = start_parser.parse_args()
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.STATE_MACHINE)
+    pipeline.start(validate_params=args['validate_params'])
     tracker = insight.GAProvider()
     tracker.track_event(category='pipelines', action='manual_run')
     return pipeline
@@ -160,7 +169,8 @@ class PipelineStop(Resource):
 
   @marshal_with(pipeline_fields)
   def post(self, pipeline_id):
-    pipeline = models.Pipeline.find(pipeline_id)
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.STATE_MACHINE)
     pipeline.stop()
     tracker = insight.GAProvider()
     tracker.track_event(category='pipelines', action='manual_stop')
@@ -173,7 +183,8 @@ class PipelineExport(Resource):
   def get(self, pipeline_id):
     tracker = insight.GAProvider()
     tracker.track_event(category='pipelines', action='export')
-    pipeline = models.Pipeline.find(pipeline_id)
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.DETAIL)
     jobs = self._get_jobs(pipeline)
 
     pipeline_params = []
@@ -262,10 +273,20 @@ class PipelineImport(Resource):
     file_ = args['upload_file']
     data = {}
     if file_:
-      data = json.loads(file_.read())
-      pipeline = models.Pipeline(name=data['name'])
-      pipeline.save()
-      pipeline.import_data(data)
+      try:
+        data = json.loads(file_.read())
+      except ValueError:
+        abort(400, message='Pipeline file is not valid JSON')
+      if not isinstance(data, dict) or not data.get('name'):
+        abort(400, message='Pipeline must have a name')
+      try:
+        # The pipeline is only created along with all of its jobs.
+        with models.Pipeline.unit_of_work():
+          pipeline = models.Pipeline(name=data['name'])
+          pipeline.save()
+          pipeline.import_data(data)
+      except models.InvalidImportError as e:
+        abort(400, message=str(e))
       return pipeline, 201
 
     return data
@@ -276,7 +297,8 @@ class PipelineRunOnSchedule(Resource):
 
   @marshal_with(pipeline_fields)
   def patch(self, pipeline_id):
-    pipeline = models.Pipeline.find(pipeline_id)
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.LIST)
     args = parser.parse_args()
     schedule_pipeline = (args['run_on_schedule'] == 'True')
     pipeline.update(run_on_schedule=schedule_pipeline)
@@ -311,6 +333,7 @@ logs_fields = {
 class PipelineLogs(Resource):
   """Class for retrieving execution logs."""
 
+  @database.read_from_replica
   def get(self, pipeline_id):
     args = log_parser.parse_args()
     entries = []
@@ -0,0 +1,146 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pulls task results in batches, instead of one push request per result.
+
+Alternative to the `/push/task-finished` endpoint when many tasks finish at
+once. Run it with `flask ingest-results`, the `crmint-3-task-finished`
+subscription has to be a pull subscription, see `setup_pubsub.py`.
+"""
+
+import dataclasses
+import os
+import threading
+import time
+from typing import Optional
+
+from google.api_core import exceptions
+from google.cloud import pubsub_v1
+
+from common import crmint_logging
+from common import message
+from common import result
+from controller import extensions
+from controller import metrics
+from controller.result import views
+
+_PROJECT = os.getenv('GOOGLE_CLOUD_PROJECT')
+_SUBSCRIPTION = os.getenv(
+    'TASK_FINISHED_SUBSCRIPTION', 'crmint-3-task-finished-subscription')
+_MAX_MESSAGES = int(os.getenv('RESULTS_BATCH_SIZE', '500'))
+_PULL_TIMEOUT = 30  # Unit in seconds.
+_RETRY_DELAY = 5  # Unit in seconds.
+
+
+@dataclasses.dataclass
+class IngestionStats:
+  """Throughput of the results ingestion."""
+  results: int = 0
+  seconds: float = 0.0
+
+  @property
+  def results_per_second(self) -> float:
+    return self.results / self.seconds if self.seconds else 0.0
+
+
+def ingest_batch(subscriber: pubsub_v1.SubscriberClient,
+                 subscription_path: str,
+                 max_messages: int = _MAX_MESSAGES) -> int:
+  """Pulls a batch of results, applies them and acknowledges them.
+
+  Args:
+    subscriber: Client to pull messages with.
+    subscription_path: Path of the `crmint-3-task-finished` subscription.
+    max_messages: Maximum number of results to pull.
+
+  Returns:
+    Number of messages acknowledged.
+  """
+  try:
+    response = subscriber.pull(
+        request={
+            'subscription': subscription_path,
+            'max_messages': max_messages,
+        },
+        timeout=_PULL_TIMEOUT)
+  except exceptions.DeadlineExceeded:
+    return 0
+  results = []
+  ack_ids = []
+  for received_message in response.received_messages:
+    pubsub_message = received_message.message
+    try:
+      data = message.decode(pubsub_message.data, pubsub_message.attributes)
+    except message.TooEarlyError:
+      continue  # Redelivered once its ack deadline expires.
+    except message.BadRequestError as e:
+      crmint_logging.log_global_message(
+          f'Dropped invalid result {pubsub_message.message_id}: {e.message}',
+          log_level='ERROR')
+    else:
+      results.append(result.Result.from_data(data))
+    ack_ids.append(received_message.ack_id)
+  if results:
+    views.process_results(results)
+  if ack_ids:
+    subscriber.acknowledge(
+        request={'subscription': subscription_path, 'ack_ids': ack_ids})
+  return len(ack_ids)
+
+
+def run(subscriber: pubsub_v1.SubscriberClient,
+        stop_event: Optional[threading.Event] = None) -> IngestionStats:
+  """Ingests results until the stop event is set.
+
+  A batch failing to be pulled or applied is logged and left unacknowledged,
+  Pub/Sub redelivers its messages once their ack deadline expires.
+
+  Args:
+    subscriber: Client to pull messages with.
+    stop_event: Event stopping the ingestion, runs forever if None.
+
+  Returns:
+    Throughput of the ingestion.
+  """
+  stop_event = stop_event or threading.Event()
+  subscription_path = subscriber.subscription_path(_PROJECT, _SUBSCRIPTION)
+  stats = IngestionStats()
+  while not stop_event.is_set():
+    start_time = time.monotonic()
+    try:
+      count = ingest_batch(subscriber, subscription_path)
+    except Exception as e:  # pylint: disable=broad-except
+      extensions.db.session.rollback()
+      crmint_logging.log_global_message(
+          f'Failed to ingest a batch of results, left for redelivery: {e}',
+          log_level='ERROR')
+      stop_event.wait(_RETRY_DELAY)
+      continue
+    if not count:
+      continue
+    batch_stats = IngestionStats(count, time.monotonic() - start_time)
+    stats.results += batch_stats.results
+    stats.seconds += batch_stats.seconds
+    metrics.increment('results_ingested', count)
+    crmint_logging.log_global_message(
+        f'Ingested {count} results in {batch_stats.seconds:.2f}s '
+        f'({batch_stats.results_per_second:.0f} results/s, '
+        f'{stats.results_per_second:.0f} results/s overall)',
+        log_level='INFO')
+  return stats
+
+
+def main() -> None:
+  with pubsub_v1.SubscriberClient() as subscriber:
+    run(subscriber)
@@ -14,18 +14,109 @@
 
 """Task results handler."""
 
+import collections
+
 import flask
 from flask_restful import Api
 from flask_restful import Resource
 
+from common import crmint_logging
+from common import heartbeat
 from common import message
 from common import result
+from controller import metrics
+from controller import mixins
 from controller import models
 
 blueprint = flask.Blueprint('result', __name__)
 api = Api(blueprint)
 
 
+def process_result(res: result.Result) -> None:
+  """Updates the job of a finished task and enqueues follow-up tasks."""
+  process_results([res])
+
+
+def _apply_job_results(job_id: int,
+                       job_results: list[result.Result]) -> int:
+  """Applies the results of a job in a single transaction.
+
+  Returns:
+    Number of results applied, duplicates excluded.
+  """
+  job = models.Job.find(job_id, profile=mixins.LoadingProfile.STATE_MACHINE)
+  if job is None:
+    crmint_logging.log_global_message(
+        f'Ignored {len(job_results)} result(s) of unknown job {job_id}',
+        log_level='WARNING')
+    return 0
+  registered_names = job.registered_task_names(
+      [res.task_name for res in job_results])
+  task_statuses = []
+  attempts = 0
+  queue_wait = 0.0
+  for res in job_results:
+    if res.task_name not in registered_names:
+      # Pub/Sub delivers at least once, the result has already been
+      # processed (or the job has been reset).
+      crmint_logging.log_message(
+          f'Ignored result of unregistered task: {res.task_name}',
+          log_level='DEBUG',
+          worker_class=job.worker_class,
+          pipeline_id=job.pipeline_id,
+          job_id=job.id)
+      metrics.increment('duplicate_results_ignored')
+      continue
+    registered_names.remove(res.task_name)  # Duplicates in the batch.
+    attempts += res.attempts
+    queue_wait += res.queue_wait or 0.0
+    if res.success:
+      for worker_enqueue_agrs in res.workers_to_enqueue:
+        job.enqueue(*worker_enqueue_agrs)
+      task_statuses.append((res.task_name, models.Job.STATUS.SUCCEEDED))
+    else:
+      task_statuses.append((res.task_name, models.Job.STATUS.FAILED))
+  if task_statuses:
+    # Counted before the job finishes, which ends its run.
+    models.JobRun.record_tasks(
+        job.id,
+        succeeded=sum(
+            status == models.Job.STATUS.SUCCEEDED
+            for _, status in task_statuses),
+        failed=sum(
+            status == models.Job.STATUS.FAILED for _, status in task_statuses),
+        attempts=attempts,
+        queue_wait=queue_wait)
+    job.tasks_finished(task_statuses)
+  return len(task_statuses)
+
+
+def process_results(results: list[result.Result]) -> int:
+  """Applies many task results, grouped per job.
+
+  Results of a job are applied together: running tasks are looked up and
+  deleted with one query each, and the job status is evaluated once. They
+  are applied again if another controller instance updated the job or its
+  pipeline concurrently.
+
+  Args:
+    results: Results to apply, in order of reception.
+
+  Returns:
+    Number of results applied, duplicates excluded.
+  """
+  results_per_job = collections.defaultdict(list)
+  for res in results:
+    results_per_job[res.job_id].append(res)
+  applied_count = 0
+  with message.batch():
+    for job_id, job_results in results_per_job.items():
+      applied_count += models.Job.run_with_retries(
+          _apply_job_results, job_id, job_results)
+    models.DelayedTask.enqueue_due_tasks()
+  return applied_count
+
+
 class ResultResource(Resource):
   """Processes PubSub POST requests with task results."""
 
@@ -34,15 +125,26 @@ class ResultResource(Resource):
       res = result.Result.from_request(flask.request)
     except message.BadRequestError as e:
       return e.message, e.code
-    if res.success:
-      job = models.Job.find(res.job_id)
-      for worker_enqueue_agrs in res.workers_to_enqueue:
-        job.enqueue(*worker_enqueue_agrs)
-      job.task_succeeded(res.task_name)
-    else:
-      job = models.Job.find(res.job_id)
-      job.task_failed(res.task_name)
+    process_result(res)
+    return 'OK', 200
+
+
+def process_heartbeat(hb: heartbeat.Heartbeat) -> None:
+  """Records the heartbeat of a running task."""
+  models.TaskEnqueued.record_heartbeat(hb.task_name)
+
+
+class HeartbeatResource(Resource):
+  """Processes PubSub POST requests with heartbeats of running tasks."""
+
+  def post(self):
+    try:
+      hb = heartbeat.Heartbeat.from_request(flask.request)
+    except message.BadRequestError as e:
+      return e.message, e.code
+    process_heartbeat(hb)
     return 'OK', 200
 
 
 api.add_resource(ResultResource, '/push/task-finished')
+api.add_resource(HeartbeatResource, '/push/task-heartbeat')
@@ -0,0 +1,126 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run history section."""
+
+import flask
+from flask_restful import abort
+from flask_restful import Api
+from flask_restful import fields
+from flask_restful import inputs
+from flask_restful import marshal_with
+from flask_restful import reqparse
+from flask_restful import Resource
+
+from controller import database
+from controller import models
+
+_DEFAULT_PER_PAGE = 20
+_MAX_PER_PAGE = 100
+
+blueprint = flask.Blueprint('run', __name__)
+api = Api(blueprint)
+
+page_parser = reqparse.RequestParser()
+page_parser.add_argument(
+    'page', type=inputs.positive, default=1, location='args')
+page_parser.add_argument(
+    'per_page', type=inputs.int_range(1, _MAX_PER_PAGE),
+    default=_DEFAULT_PER_PAGE, location='args')
+
+job_run_fields = {
+    'id': fields.Integer,
+    'pipeline_run_id': fields.Integer,
+    'job_id': fields.Integer,
+    'name': fields.String,
+    'worker_class': fields.String,
+    'status': fields.String,
+    'started_at': fields.String,
+    'finished_at': fields.String,
+    'duration': fields.Float,
+    'tasks_count': fields.Integer,
+    'tasks_succeeded': fields.Integer,
+    'tasks_failed': fields.Integer,
+    'task_attempts': fields.Integer,
+    'queue_wait': fields.Float,
+    'average_queue_wait': fields.Float,
+}
+pipeline_run_fields = {
+    'id': fields.Integer,
+    'pipeline_id': fields.Integer,
+    'status': fields.String,
+    'started_at': fields.String,
+    'finished_at': fields.String,
+    'duration': fields.Float,
+}
+pipeline_run_with_jobs_fields = dict(
+    pipeline_run_fields,
+    job_runs=fields.List(fields.Nested(job_run_fields)))
+
+
+def _page_fields(item_fields):
+  return {
+      'runs': fields.List(fields.Nested(item_fields), attribute='items'),
+      'page': fields.Integer,
+      'per_page': fields.Integer,
+      'total': fields.Integer,
+      'pages': fields.Integer,
+  }
+
+
+def _paginate(query):
+  """Returns a page of the query, most recent runs first."""
+  args = page_parser.parse_args()
+  return query.paginate(
+      page=args['page'], per_page=args['per_page'], error_out=False)
+
+
+class PipelineRunList(Resource):
+  """Shows the runs of a pipeline."""
+
+  @database.read_from_replica
+  @marshal_with(_page_fields(pipeline_run_fields))
+  def get(self, pipeline_id):
+    query = models.PipelineRun.query.filter(
+        models.PipelineRun.pipeline_id == pipeline_id).order_by(
+            models.PipelineRun.id.desc())
+    return _paginate(query)
+
+
+class PipelineRunSingle(Resource):
+  """Shows a run of a pipeline with the runs of its jobs."""
+
+  @database.read_from_replica
+  @marshal_with(pipeline_run_with_jobs_fields)
+  def get(self, pipeline_id, run_id):
+    pipeline_run = models.PipelineRun.find(run_id)
+    if pipeline_run is None or str(pipeline_run.pipeline_id) != pipeline_id:
+      abort(404, message="Pipeline run {} doesn't exist".format(run_id))
+    return pipeline_run
+
+
+class JobRunList(Resource):
+  """Shows the runs of a job."""
+
+  @database.read_from_replica
+  @marshal_with(_page_fields(job_run_fields))
+  def get(self, job_id):
+    query = models.JobRun.query.filter(
+        models.JobRun.job_id == job_id).order_by(models.JobRun.id.desc())
+    return _paginate(query)
+
+
+api.add_resource(PipelineRunList, '/pipelines/<pipeline_id>/runs')
+api.add_resource(PipelineRunSingle, '/pipelines/<pipeline_id>/runs/<run_id>')
+api.add_resource(JobRunList, '/jobs/<job_id>/runs')
@@ -20,11 +20,13 @@ from flask import Blueprint
 from flask import request
 from flask_restful import Api
 from flask_restful import Resource
+from sqlalchemy import orm
 
 from common import crmint_logging
 from common import insight
 from common import message
 from controller import cron_utils
+from controller import mixins
 from controller import models
 
 blueprint = Blueprint('starter', __name__)
@@ -37,7 +39,11 @@ class StarterResource(Resource):
   def _start_scheduled_pipelines(self):
     """Finds and tries starting the pipelines scheduled to be executed now."""
     now_dt = datetime.datetime.utcnow()
-    for pipeline in models.Pipeline.where(run_on_schedule=True).all():
+    query = models.Pipeline.query_for(mixins.LoadingProfile.STATE_MACHINE)
+    scheduled_pipelines = query.options(
+        orm.selectinload(models.Pipeline.schedules)).filter_by(
+            run_on_schedule=True)
+    for pipeline in scheduled_pipelines:
       for schedule in pipeline.schedules:
         cron_match_result = cron_utils.cron_match(schedule.cron, now_dt)
         crmint_logging.log_message(
@@ -48,7 +54,18 @@ class StarterResource(Resource):
             pipeline_id=pipeline.id,
             job_id=0)
         if cron_match_result:
-          pipeline.start()
+          try:
+            pipeline.start()
+          except mixins.ConflictError as e:
+            # Still updated concurrently after retries, the other pipelines
+            # due in this tick are started anyway.
+            crmint_logging.log_message(
+                f'Failed to start scheduled pipeline: {e}',
+                log_level='ERROR',
+                worker_class='N/A',
+                pipeline_id=pipeline.id,
+                job_id=0)
+            break
           tracker = insight.GAProvider()
           tracker.track_event(category='pipelines', action='scheduled_run')
           break
@@ -56,7 +73,8 @@ class StarterResource(Resource):
   def _start_pipelines(self, pipeline_ids):
     """Tries finding and starting pipelines with IDs specified."""
     for pipeline_id in pipeline_ids:
-      pipeline = models.Pipeline.find(pipeline_id)
+      pipeline = models.Pipeline.find(
+          pipeline_id, profile=mixins.LoadingProfile.STATE_MACHINE)
       if pipeline is not None:
         pipeline.start()
         tracker = insight.GAProvider()
@@ -69,12 +87,15 @@ class StarterResource(Resource):
         pipeline_ids = data['pipeline_ids']
       except KeyError as e:
         raise message.BadRequestError() from e
-      if pipeline_ids == 'scheduled':
-        self._start_scheduled_pipelines()
-      elif isinstance(pipeline_ids, list):
-        self._start_pipelines(pipeline_ids)
-      else:
-        raise message.BadRequestError()
+      with message.batch():
+        if pipeline_ids == 'scheduled':
+          self._start_scheduled_pipelines()
+        elif isinstance(pipeline_ids, list):
+          self._start_pipelines(pipeline_ids)
+        else:
+          raise message.BadRequestError()
+        models.DelayedTask.enqueue_due_tasks()
+        models.StatusEvent.prune()
     except message.BadRequestError as e:
       return e.message, e.code
     return 'OK', 200
@@ -16,6 +16,7 @@
 
 import os
 
+import flask
 from flask import Blueprint
 from flask_restful import Api
 from flask_restful import fields
@@ -26,6 +27,8 @@ from flask_restful import Resource
 from common import insight
 from controller import ads_auth_code
 from controller import database
+from controller import inline
+from controller import metrics
 from controller import models
 
 # from google.appengine.api import urlfetch
@@ -39,6 +42,9 @@ parser.add_argument('variables', type=list, location='json')
 settings_parser = reqparse.RequestParser()
 settings_parser.add_argument('settings', type=list, location='json')
 
+inline_cache_parser = reqparse.RequestParser()
+inline_cache_parser.add_argument('table_id', location='args')
+
 param_fields = {
     'id': fields.Integer,
     'name': fields.String,
@@ -72,6 +78,7 @@ global_variables_fields = {
 class Configuration(Resource):
   """Fetches configuration parameters."""
 
+  @database.read_from_replica
   @marshal_with(configuration_fields)
   def get(self):
     # urlfetch.set_default_fetch_deadline(300)
@@ -137,6 +144,7 @@ class GeneralSettingsRoute(Resource):
         else:
           setting.update(value=arg['value'])
       settings.append(setting)
+    models.GeneralSetting.invalidate_snapshot()
     return settings
 
 
@@ -150,7 +158,28 @@ class ResetStatuses(Resource):
     return '', 200
 
 
+class ResetInlineCache(Resource):
+  """Endpoint to fetch BigQuery tables read by params again."""
+
+  def post(self):
+    args = inline_cache_parser.parse_args()
+    inline.invalidate_bigquery_cache(args['table_id'])
+    return '', 200
+
+
+class Metrics(Resource):
+  """Returns the counters of this controller instance."""
+
+  def get(self):
+    counters = metrics.get_all()
+    counters['delayed_tasks_pending'] = models.DelayedTask.query.count()
+    counters.update(database.pool_metrics(flask.current_app))
+    return counters
+
+
 api.add_resource(Configuration, '/configuration')
 api.add_resource(GlobalVariable, '/global_variables')
 api.add_resource(GeneralSettingsRoute, '/general_settings')
 api.add_resource(ResetStatuses, '/reset/statuses')
+api.add_resource(ResetInlineCache, '/reset/inline_cache')
+api.add_resource(Metrics, '/metrics')
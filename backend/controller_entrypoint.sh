@@ -5,5 +5,6 @@ python -m flask db upgrade
 python -m flask db-seeds
 
 # Starts the production server
-gunicorn -b :$PORT -w 3 controller_app:app
+# Threads serve the long-lived requests following status events.
+gunicorn -b :$PORT -w 3 --threads 8 controller_app:app
 
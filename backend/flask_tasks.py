@@ -16,6 +16,7 @@ import click
 from flask.app import Flask
 
 from controller import database
+from controller.result import ingestor
 
 
 def add(app: Flask) -> None:
@@ -25,3 +26,8 @@ def add(app: Flask) -> None:
   def db_seeds():
     """Initialize the database."""
     database.load_fixtures(logger_func=click.echo)
+
+  @app.cli.command()
+  def ingest_results():
+    """Pulls task results in batches from Pub/Sub and applies them."""
+    ingestor.main()
@@ -0,0 +1,159 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content-addressed store for large worker parameters.
+
+Workers fanning out pass the same parameters to each task they enqueue, e.g.
+the Measurement Protocol JSON template. Large values are stored once, keyed
+by the hash of their content, and tasks only carry a reference to them.
+
+The store is configured with `PARAMS_STORE_URI`, either a Cloud Storage
+location (`gs://bucket/prefix`) or a local directory for single node
+deployments (`file:///path/to/dir`). Parameters are sent inline when unset.
+"""
+
+import functools
+import hashlib
+import os
+import pathlib
+from typing import Any, Optional, Union
+import urllib.parse
+
+from google.api_core import exceptions
+from google.cloud import storage
+
+_STORE_URI = os.getenv('PARAMS_STORE_URI', '')
+
+# Values shorter than this are sent inline. Unit in bytes.
+_MIN_SIZE = int(os.getenv('PARAMS_STORE_MIN_SIZE', '4096'))
+
+# Key marking a parameter value as a reference to the store.
+_REF_KEY = '__crmint_params_ref__'
+
+
+class LocalStore:
+  """Stores values as files in a local directory."""
+
+  def __init__(self, directory: Union[str, pathlib.Path]):
+    self._directory = pathlib.Path(directory)
+    self._directory.mkdir(parents=True, exist_ok=True)
+
+  def put(self, key: str, value: bytes) -> None:
+    path = self._directory / key
+    if path.exists():
+      return
+    # Writes then renames, so that readers never see a partial value.
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_path.write_bytes(value)
+    tmp_path.replace(path)
+
+  def get(self, key: str) -> bytes:
+    return (self._directory / key).read_bytes()
+
+
+class GcsStore:
+  """Stores values as objects in a Cloud Storage bucket."""
+
+  def __init__(self, bucket_name: str, prefix: str = ''):
+    self._bucket = storage.Client().bucket(bucket_name)
+    self._prefix = prefix.strip('/')
+
+  def _blob(self, key: str) -> storage.Blob:
+    name = f'{self._prefix}/{key}' if self._prefix else key
+    return self._bucket.blob(name)
+
+  def put(self, key: str, value: bytes) -> None:
+    try:
+      # Uploads only if absent, identical keys have identical content.
+      self._blob(key).upload_from_string(value, if_generation_match=0)
+    except exceptions.PreconditionFailed:
+      pass
+
+  def get(self, key: str) -> bytes:
+    return self._blob(key).download_as_bytes()
+
+
+Store = Union[LocalStore, GcsStore]
+
+
+@functools.cache
+def get_store() -> Optional[Store]:
+  """Returns the store configured with `PARAMS_STORE_URI`, if any."""
+  if not _STORE_URI:
+    return None
+  uri = urllib.parse.urlparse(_STORE_URI)
+  if uri.scheme == 'gs':
+    return GcsStore(uri.netloc, uri.path)
+  if uri.scheme == 'file':
+    return LocalStore(uri.path)
+  raise ValueError(f'Unsupported params store URI: {_STORE_URI}')
+
+
+def _is_ref(value: Any) -> bool:
+  return isinstance(value, dict) and _REF_KEY in value
+
+
+def pack(params: dict[str, Any],
+         store: Optional[Store] = None) -> dict[str, Any]:
+  """Returns parameters with large string values replaced by references.
+
+  Args:
+    params: Worker parameters.
+    store: Store to put values in, defaults to the configured store.
+  """
+  store = store or get_store()
+  if store is None:
+    return params
+  packed_params = {}
+  for name, value in params.items():
+    if isinstance(value, str) and len(value) >= _MIN_SIZE:
+      packed_params[name] = {_REF_KEY: _put(store, value)}
+    else:
+      packed_params[name] = value
+  return packed_params
+
+
+def unpack(params: dict[str, Any],
+           store: Optional[Store] = None) -> dict[str, Any]:
+  """Returns parameters with references replaced by their values.
+
+  Args:
+    params: Worker parameters, possibly containing references.
+    store: Store to get values from, defaults to the configured store.
+
+  Raises:
+    ValueError: if parameters contain references but no store is configured.
+  """
+  if not any(_is_ref(value) for value in params.values()):
+    return params
+  store = store or get_store()
+  if store is None:
+    raise ValueError('Parameters contain references, set PARAMS_STORE_URI.')
+  return {
+      name: _get(store, value[_REF_KEY]) if _is_ref(value) else value
+      for name, value in params.items()
+  }
+
+
+# Values are immutable, so that keys already stored or fetched are cached.
+@functools.lru_cache(maxsize=64)
+def _put(store: Store, value: str) -> str:
+  key = hashlib.sha256(value.encode('utf-8')).hexdigest()
+  store.put(key, value.encode('utf-8'))
+  return key
+
+
+@functools.lru_cache(maxsize=64)
+def _get(store: Store, key: str) -> str:
+  return store.get(key).decode('utf-8')
@@ -0,0 +1,220 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ledger of task executions, to run each task attempt once.
+
+Pub/Sub delivers messages at least once. Before running a task, its attempt
+is claimed in the ledger, then its result is recorded. A duplicate delivery
+finds the claim and is either postponed while the task runs, or answered
+with the recorded result.
+
+The ledger is kept in memory, which covers redeliveries to the same instance,
+unless `TASK_LEDGER_URI` points to a Cloud Storage location
+(`gs://bucket/prefix`) shared by all instances. Add a lifecycle rule to the
+bucket to delete old records.
+"""
+
+import collections
+import dataclasses
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Optional, Union
+import urllib.parse
+
+from google.api_core import exceptions
+from google.cloud import storage
+
+from common import task
+
+_LEDGER_URI = os.getenv('TASK_LEDGER_URI', '')
+
+# Claims older than this are considered abandoned, e.g. after a crash, and
+# can be taken over. Unit in seconds.
+_STALE_AFTER = int(os.getenv('TASK_LEDGER_STALE_AFTER', str(2 * 3600)))
+
+# Maximum number of records kept by the in-memory ledger.
+_MAX_MEMORY_RECORDS = 10000
+
+
+class TaskInProgressError(Exception):
+  """Raised when another delivery of the same task attempt is running."""
+
+
+@dataclasses.dataclass
+class Record:
+  """State of a task attempt."""
+  finished: bool
+  updated_at: float
+  # Data of the reported `common.result.Result`, None if nothing was reported
+  # (e.g. the task has been re-enqueued for another attempt).
+  result: Optional[dict[str, Any]] = None
+
+  def to_json(self) -> str:
+    return json.dumps(dataclasses.asdict(self))
+
+  @classmethod
+  def from_json(cls, value: Union[str, bytes]) -> 'Record':
+    return cls(**json.loads(value))
+
+
+class MemoryLedger:
+  """Keeps records in memory, evicting the oldest ones."""
+
+  def __init__(self, max_records: int = _MAX_MEMORY_RECORDS):
+    self._records = collections.OrderedDict()
+    self._max_records = max_records
+    self._lock = threading.Lock()
+
+  def get(self, key: str) -> Optional[tuple[Record, int]]:
+    with self._lock:
+      return self._records.get(key)
+
+  def create(self, key: str, record: Record) -> bool:
+    return self.replace(key, record, generation=0)
+
+  def replace(self, key: str, record: Record, generation: int) -> bool:
+    """Stores the record if the current record is at the given generation."""
+    with self._lock:
+      current_generation = self._records.get(key, (None, 0))[1]
+      if current_generation != generation:
+        return False
+      self._records[key] = (record, generation + 1)
+      self._records.move_to_end(key)
+      while len(self._records) > self._max_records:
+        self._records.popitem(last=False)
+      return True
+
+  def delete(self, key: str) -> None:
+    with self._lock:
+      self._records.pop(key, None)
+
+
+class GcsLedger:
+  """Keeps records as objects of a Cloud Storage bucket.
+
+  Uses object generations as preconditions, so that a single instance claims
+  a task attempt.
+  """
+
+  def __init__(self, bucket_name: str, prefix: str = ''):
+    self._bucket = storage.Client().bucket(bucket_name)
+    self._prefix = prefix.strip('/')
+
+  def _name(self, key: str) -> str:
+    return f'{self._prefix}/{key}' if self._prefix else key
+
+  def get(self, key: str) -> Optional[tuple[Record, int]]:
+    blob = self._bucket.get_blob(self._name(key))
+    if blob is None:
+      return None
+    try:
+      value = blob.download_as_bytes(if_generation_match=blob.generation)
+    except (exceptions.NotFound, exceptions.PreconditionFailed):
+      return self.get(key)  # Updated in the meantime.
+    return Record.from_json(value), blob.generation
+
+  def create(self, key: str, record: Record) -> bool:
+    return self.replace(key, record, generation=0)
+
+  def replace(self, key: str, record: Record, generation: int) -> bool:
+    """Stores the record if the current object is at the given generation."""
+    blob = self._bucket.blob(self._name(key))
+    try:
+      blob.upload_from_string(
+          record.to_json(),
+          content_type='application/json',
+          if_generation_match=generation)
+    except exceptions.PreconditionFailed:
+      return False
+    return True
+
+  def delete(self, key: str) -> None:
+    try:
+      self._bucket.blob(self._name(key)).delete()
+    except exceptions.NotFound:
+      pass
+
+
+Ledger = Union[MemoryLedger, GcsLedger]
+
+
+@functools.cache
+def get_ledger() -> Ledger:
+  """Returns the ledger configured with `TASK_LEDGER_URI`."""
+  if not _LEDGER_URI:
+    return MemoryLedger()
+  uri = urllib.parse.urlparse(_LEDGER_URI)
+  if uri.scheme == 'gs':
+    return GcsLedger(uri.netloc, uri.path)
+  raise ValueError(f'Unsupported task ledger URI: {_LEDGER_URI}')
+
+
+def key_for(task_inst: task.Task) -> str:
+  """Returns the key of a task attempt in the ledger."""
+  # Re-enqueued tasks keep their name, each attempt runs once.
+  return f'{task_inst.name}-{task_inst.attempts}'
+
+
+def claim(key: str) -> Optional[Record]:
+  """Claims the execution of a task attempt.
+
+  Args:
+    key: Key of the task attempt about to be executed, see `key_for`.
+
+  Returns:
+    None if the task attempt has been claimed and should be executed, or the
+    record of its previous execution if it has already finished.
+
+  Raises:
+    TaskInProgressError: if another delivery of the task attempt is running.
+  """
+  ledger = get_ledger()
+  started = Record(finished=False, updated_at=time.time())
+  if ledger.create(key, started):
+    return None
+  current = ledger.get(key)
+  if current is None:
+    # Released in the meantime, e.g. after a failed execution.
+    return claim(key)
+  record, generation = current
+  if record.finished:
+    return record
+  if time.time() - record.updated_at < _STALE_AFTER:
+    raise TaskInProgressError(f'Task {key} is already running')
+  if ledger.replace(key, started, generation):
+    return None
+  raise TaskInProgressError(f'Task {key} has been taken over')
+
+
+def finish(key: str, result_data: Optional[dict[str, Any]]) -> None:
+  """Records the result of a task attempt.
+
+  Args:
+    key: Key of the task attempt executed.
+    result_data: Data of the result reported for the task, None if nothing
+      is reported.
+  """
+  ledger = get_ledger()
+  finished = Record(finished=True, updated_at=time.time(), result=result_data)
+  current = ledger.get(key)
+  generation = current[1] if current else 0
+  ledger.replace(key, finished, generation)
+
+
+def release(key: str) -> None:
+  """Releases the claim of a task attempt, so that it can run again."""
+  get_ledger().delete(key)
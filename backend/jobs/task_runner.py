@@ -0,0 +1,190 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Executes tasks and reports their results to the controller.
+
+Shared by all the ways the jobs service receives tasks, e.g. Pub/Sub push
+requests or a streaming pull subscriber.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+import traceback
+from typing import Any, Iterator, Optional
+
+from common import crmint_logging
+from common import heartbeat
+from common import result
+from common import task
+from jobs import params_store
+from jobs import task_ledger
+from jobs.workers import finder
+from jobs.workers import worker
+
+# Seconds between heartbeats sent while a task is running, 0 to disable.
+_HEARTBEAT_INTERVAL = float(os.getenv('TASK_HEARTBEAT_INTERVAL', '60'))
+
+# Maximum number of general settings snapshots kept in memory.
+_MAX_SNAPSHOTS = 16
+
+# General settings received with tasks, keyed by snapshot version.
+_snapshots: collections.OrderedDict[str, dict[str, Any]] = (
+    collections.OrderedDict())
+_snapshots_lock = threading.Lock()
+
+
+def resolve_general_settings(task_inst: task.Task) -> dict[str, Any]:
+  """Returns the general settings of a task snapshot.
+
+  Tasks only carry the settings needed by their worker, merged here with the
+  settings of previous tasks sharing the same snapshot version.
+
+  Args:
+    task_inst: Task to resolve the general settings of.
+  """
+  version = task_inst.general_settings_version
+  if version is None:
+    return task_inst.general_settings
+  with _snapshots_lock:
+    settings = _snapshots.setdefault(version, {})
+    settings.update(task_inst.general_settings)
+    _snapshots.move_to_end(version)
+    while len(_snapshots) > _MAX_SNAPSHOTS:
+      _snapshots.popitem(last=False)
+    return dict(settings)
+
+
+@contextlib.contextmanager
+def _heartbeats(task_inst: task.Task) -> Iterator[None]:
+  """Sends heartbeats for the task in a background thread within the block."""
+  if _HEARTBEAT_INTERVAL <= 0:
+    yield
+    return
+  stopped = threading.Event()
+
+  def send_heartbeats():
+    while not stopped.wait(_HEARTBEAT_INTERVAL):
+      try:
+        heartbeat.Heartbeat(task_inst.name, task_inst.job_id).send()
+      except Exception as e:  # pylint: disable=broad-except
+        crmint_logging.log_message(
+            f'Failed to send heartbeat: {e}',
+            log_level='WARNING',
+            worker_class=task_inst.worker_class,
+            pipeline_id=task_inst.pipeline_id,
+            job_id=task_inst.job_id)
+
+  thread = threading.Thread(
+      target=send_heartbeats, name='crmint-heartbeat', daemon=True)
+  thread.start()
+  try:
+    yield
+  finally:
+    stopped.set()
+    thread.join()
+
+
+def run(task_inst: task.Task) -> None:
+  """Runs the worker of a task and reports the result.
+
+  A duplicate delivery of a finished task reports the recorded result again,
+  without running the worker.
+
+  Args:
+    task_inst: Task to execute.
+
+  Raises:
+    task_ledger.TaskInProgressError: if the task is already running.
+  """
+  ledger_key = task_ledger.key_for(task_inst)
+  previous_record = task_ledger.claim(ledger_key)
+  if previous_record is not None:
+    crmint_logging.log_message(
+        f'Skipped duplicate of finished task for name: {task_inst.name}',
+        log_level='DEBUG',
+        worker_class=task_inst.worker_class,
+        pipeline_id=task_inst.pipeline_id,
+        job_id=task_inst.job_id)
+    if previous_record.result is not None:
+      result.Result.from_data(previous_record.result).report()
+    return
+
+  try:
+    result_inst = _execute(task_inst)
+  except BaseException:
+    task_ledger.release(ledger_key)
+    raise
+  # Recorded first, a failed report is retried by the next delivery.
+  task_ledger.finish(
+      ledger_key, result_inst.to_data() if result_inst else None)
+  if result_inst is not None:
+    result_inst.report()
+
+
+def _execute(task_inst: task.Task) -> Optional[result.Result]:
+  """Runs the worker of a task, returns the result to report if any."""
+  queue_wait = None
+  if task_inst.enqueued_at is not None:
+    queue_wait = max(0.0, time.time() - task_inst.enqueued_at)
+  crmint_logging.log_message(
+      f'Starting task for name: {task_inst.name}',
+      log_level='DEBUG',
+      worker_class=task_inst.worker_class,
+      pipeline_id=task_inst.pipeline_id,
+      job_id=task_inst.job_id)
+
+  worker_class = finder.get_worker_class(task_inst.worker_class)
+  worker_params = params_store.unpack(task_inst.worker_params).copy()
+  general_settings = resolve_general_settings(task_inst)
+  for setting in worker_class.GLOBAL_SETTINGS:
+    worker_params[setting] = general_settings[setting]
+  worker_inst = worker_class(
+      worker_params, task_inst.pipeline_id, task_inst.job_id)
+
+  try:
+    with _heartbeats(task_inst):
+      workers_to_enqueue = worker_inst.execute()
+    crmint_logging.log_message(
+        f'Executed task for name: {task_inst.name}',
+        log_level='DEBUG',
+        worker_class=task_inst.worker_class,
+        pipeline_id=task_inst.pipeline_id,
+        job_id=task_inst.job_id)
+  except worker.WorkerException as e:
+    class_name = e.__class__.__name__
+    worker_inst.log_error(f'Execution failed: {class_name}: {e}')
+    return result.Result(
+        task_inst.name, task_inst.job_id, False,
+        attempts=task_inst.attempts, queue_wait=queue_wait)
+  except Exception:  # pylint: disable=broad-except
+    formatted_exception = traceback.format_exc()
+    worker_inst.log_error(f'Unexpected error {formatted_exception}')
+    if task_inst.attempts < worker_inst.MAX_ATTEMPTS:
+      task_inst.reenqueue()
+      return None
+    worker_inst.log_error(f'Giving up after {task_inst.attempts} attempt(s)')
+    return result.Result(
+        task_inst.name, task_inst.job_id, False,
+        attempts=task_inst.attempts, queue_wait=queue_wait)
+  # Fan-outs share large parameters, only stored once.
+  workers_to_enqueue = [
+      (worker_class_name, params_store.pack(params), delay)
+      for worker_class_name, params, delay in workers_to_enqueue
+  ]
+  return result.Result(
+      task_inst.name, task_inst.job_id, True, workers_to_enqueue,
+      attempts=task_inst.attempts, queue_wait=queue_wait)
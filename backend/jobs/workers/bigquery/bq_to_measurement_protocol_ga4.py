@@ -27,6 +27,7 @@ import urllib
 from google.api_core import page_iterator
 import requests
 
+from jobs.workers import rate_limiter
 from jobs.workers import worker
 from jobs.workers.bigquery import bq_worker
 from jobs.workers.ga import ga_utils
@@ -118,6 +119,8 @@ class BQToMeasurementProtocolProcessorGA4(bq_worker.BQWorker):
         url_param: self._params['measurement_id'],
         'api_secret': self._params['api_secret'],
     })
+    rate_limiter.acquire('ga4_measurement_protocol',
+                         self._params['measurement_id'])
     response = requests.post(f'{domain}?{querystring}',
                              data=json.dumps(payload),
                              headers={'content-type': 'application/json'})
@@ -5,7 +5,6 @@ import enum
 import json
 import re
 import string
-import time
 from typing import Callable, Mapping, NewType, Optional, Type, TypeVar, Union
 
 from google.api_core import retry
@@ -17,6 +16,7 @@ import httplib2
 
 from common import crmint_logging
 from common import utils
+from jobs.workers import rate_limiter
 
 _MAX_RESULTS_PER_CALL = 100
 _NUMBER_OF_RETRIES = 3
@@ -43,6 +43,23 @@ def _null_progress_callback(unused_msg: str) -> None:
   """Default progress callback. Used to simplify the tests."""
 
 
+def _execute(request: api_httplib.HttpRequest, api: str, key: str) -> dict:
+  """Executes an API request within the rate limit of the API.
+
+  Args:
+    request: Request to execute.
+    api: Name of the API in the rate limiter, e.g. `ga4_admin`.
+    key: Identifier of the resource the quota applies to, e.g. a property ID.
+  """
+
+  def execute():
+    # Acquired on each attempt, retries count against the quota too.
+    rate_limiter.acquire(api, key)
+    return request.execute()
+
+  return retry.Retry()(execute)()
+
+
 def get_client(
     service: str,
     version: str,
@@ -251,13 +268,13 @@ def fetch_audiences(ga_client: discovery.Resource,
       webPropertyId=property_id,
       start_index=None,
       max_results=_MAX_RESULTS_PER_CALL)
-  result = retry.Retry()(request.execute)()
+  result = _execute(request, 'ga_management', property_id)
   items = result['items']
   # If there are more results than could be returned by a single call,
   # continue requesting results until they've all been retrieved.
   while result.get('nextLink', None):
     request.uri = result['nextLink']
-    result = retry.Retry()(request.execute)()
+    result = _execute(request, 'ga_management', property_id)
     items += result['items']
   return dict((item['name'], Audience(item)) for item in items)
 
@@ -318,7 +335,7 @@ def run_audience_operations(
       progress_callback(f'Updating existing audience for id: {op.id}')
     else:
       raise ValueError(f'Unsupported operation type: {op}')
-    retry.Retry()(request.execute)()
+    _execute(request, 'ga_management', property_id)
 
 
 def fetch_audiences_ga4(
@@ -334,7 +351,7 @@ def fetch_audiences_ga4(
   request = ga_client.properties().audiences().list(
       parent=f'properties/{ga_property_id}',
       pageSize=_MAX_RESULTS_PER_CALL)
-  result = retry.Retry()(request.execute)()
+  result = _execute(request, 'ga4_admin', ga_property_id)
   items = result['audiences']
   # If there are more results than could be returned by a single call,
   # continue requesting results until they've all been retrieved.
@@ -343,7 +360,7 @@ def fetch_audiences_ga4(
         parent=f'properties/{ga_property_id}',
         pageSize=_MAX_RESULTS_PER_CALL,
         pageToken=result['nextPageToken'])
-    result = retry.Retry()(request.execute)()
+    result = _execute(request, 'ga4_admin', ga_property_id)
     items += result['audiences']
   return dict((item['displayName'], Audience(item)) for item in items)
 
@@ -414,9 +431,6 @@ def run_audience_operations_ga4(
   """
   progress_callback = progress_callback or _null_progress_callback
   for op in operations:
-    # Wait 1 second between operations to stay within Analytics Admin API quota.
-    # https://developers.google.com/analytics/devguides/config/admin/v1/quotas
-    time.sleep(1)
     if isinstance(op, AudienceOperationInsert):
       request = ga_client.properties().audiences().create(
           parent=f'properties/{ga_property_id}',
@@ -433,7 +447,7 @@ def run_audience_operations_ga4(
                         f'resource: {op.id}')
     else:
       raise ValueError(f'Unsupported operation type: {op}')
-    retry.Retry()(request.execute)()
+    _execute(request, 'ga4_admin', ga_property_id)
 
 
 def create_custom_dimension_ga4(
@@ -489,7 +503,7 @@ def create_custom_dimension_ga4(
         parent=f'properties/{ga_property_id}',
         body=fields)
     progress_callback('Inserting new custom dimension.')
-    retry.Retry()(request.execute)()
+    _execute(request, 'ga4_admin', ga_property_id)
   except errors.HttpError as e:
     if e.resp.status == 409:
       progress_callback('Requested parameter name already exists. '
@@ -521,7 +535,7 @@ def create_conversion_event_ga4(
         parent=f'properties/{ga_property_id}',
         body=fields)
     progress_callback(f'Creating new conversion event named {event_name}.')
-    retry.Retry()(request.execute)()
+    _execute(request, 'ga4_admin', ga_property_id)
   except errors.HttpError as e:
     if e.resp.status == 409:
       progress_callback('Requested conversion event already exists. '
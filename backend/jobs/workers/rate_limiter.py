@@ -0,0 +1,225 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Token buckets limiting the rate of calls made by workers to external APIs.
+
+Workers acquire a permit before each call to a quota-limited API. Buckets are
+keyed by API and by the resource the quota applies to, e.g. the GA4 property
+or the Measurement Protocol measurement ID, so that tasks calling the same
+resource share a bucket.
+
+Rates are set per API in permits per second with `RATE_LIMITS`, e.g.
+`ga4_admin=1,ga4_measurement_protocol=50`. A rate of zero disables limiting.
+
+Buckets are kept in memory, which limits calls made by this instance, unless
+`RATE_LIMITER_URI` points to a Cloud Storage location (`gs://bucket/prefix`)
+shared by all instances. Shared buckets are leased by blocks of permits, to
+update their object about once per `RATE_LIMITER_LEASE_SECONDS`.
+"""
+
+import dataclasses
+import functools
+import json
+import os
+import random
+import threading
+import time
+from typing import Union
+import urllib.parse
+
+from google.api_core import exceptions
+from google.cloud import storage
+
+# Maximum number of permits per second, per API.
+_DEFAULT_RATES = {
+    # https://developers.google.com/analytics/devguides/config/admin/v1/quotas
+    'ga4_admin': 1.0,
+    # https://developers.google.com/analytics/devguides/config/mgmt/v3/limits-quotas
+    'ga_management': 10.0,
+    'ga4_measurement_protocol': 100.0,
+}
+
+_LIMITER_URI = os.getenv('RATE_LIMITER_URI', '')
+
+# Duration covered by a lease of permits from a shared bucket. Unit in seconds.
+_LEASE_SECONDS = float(os.getenv('RATE_LIMITER_LEASE_SECONDS', '1'))
+
+# Retry policy of updates to a shared bucket modified concurrently, or updated
+# more often than Cloud Storage allows: attempts are spaced by a random delay,
+# up to an exponentially growing bound in seconds.
+_MAX_UPDATE_ATTEMPTS = 10
+_UPDATE_BACKOFF_BASE = 0.1
+_UPDATE_BACKOFF_MAX = 5.0
+
+# Errors of an update which can succeed once retried.
+_RETRYABLE_ERRORS = (exceptions.PreconditionFailed, exceptions.TooManyRequests)
+
+
+def _parse_rates(value: str) -> dict[str, float]:
+  rates = {}
+  for item in filter(None, value.split(',')):
+    api, rate = item.split('=')
+    rates[api.strip()] = float(rate)
+  return rates
+
+
+_RATES = {**_DEFAULT_RATES, **_parse_rates(os.getenv('RATE_LIMITS', ''))}
+
+
+@dataclasses.dataclass
+class Bucket:
+  """State of a token bucket.
+
+  Tokens go negative when permits are reserved ahead of time, callers then
+  wait until the bucket has refilled.
+  """
+  tokens: float
+  updated_at: float
+
+  def reserve(self, permits: float, rate: float, capacity: float) -> float:
+    """Takes permits from the bucket.
+
+    Args:
+      permits: Number of permits to take.
+      rate: Number of permits added to the bucket per second.
+      capacity: Maximum number of permits in the bucket.
+
+    Returns:
+      Number of seconds to wait before using the permits.
+    """
+    now = time.time()
+    elapsed = max(0.0, now - self.updated_at)
+    self.tokens = min(capacity, self.tokens + elapsed * rate) - permits
+    self.updated_at = now
+    return max(0.0, -self.tokens / rate)
+
+  def to_json(self) -> str:
+    return json.dumps(dataclasses.asdict(self))
+
+  @classmethod
+  def from_json(cls, value: Union[str, bytes]) -> 'Bucket':
+    return cls(**json.loads(value))
+
+
+class MemoryBuckets:
+  """Keeps buckets in memory, shared by the threads of this instance."""
+
+  def __init__(self):
+    self._buckets: dict[str, Bucket] = {}
+    self._lock = threading.Lock()
+
+  def reserve(self, key: str, permits: float, rate: float,
+              capacity: float) -> float:
+    with self._lock:
+      bucket = self._buckets.setdefault(key, Bucket(capacity, time.time()))
+      return bucket.reserve(permits, rate, capacity)
+
+
+class GcsBuckets:
+  """Keeps buckets as objects of a Cloud Storage bucket.
+
+  Uses object generations as preconditions, so that concurrent reservations
+  are not lost. Permits are leased by blocks and handed out locally, as an
+  object cannot be updated more than once per second.
+  """
+
+  def __init__(self, bucket_name: str, prefix: str = ''):
+    self._bucket = storage.Client().bucket(bucket_name)
+    self._prefix = prefix.strip('/')
+    # Leased permits by key, as (number of permits, time they can be used).
+    self._leases: dict[str, tuple[float, float]] = {}
+    self._lock = threading.Lock()
+
+  def _name(self, key: str) -> str:
+    return f'{self._prefix}/{key}' if self._prefix else key
+
+  def reserve(self, key: str, permits: float, rate: float,
+              capacity: float) -> float:
+    with self._lock:
+      available, usable_at = self._leases.get(key, (0.0, 0.0))
+      if available < permits:
+        lease = max(permits, rate * _LEASE_SECONDS)
+        wait = self._reserve_shared(key, lease, rate, max(capacity, lease))
+        available, usable_at = lease, time.time() + wait
+      self._leases[key] = (available - permits, usable_at)
+      return max(0.0, usable_at - time.time())
+
+  def _reserve_shared(self, key: str, permits: float, rate: float,
+                      capacity: float) -> float:
+    blob_name = self._name(key)
+    for attempt in range(_MAX_UPDATE_ATTEMPTS):
+      if attempt:
+        backoff = min(_UPDATE_BACKOFF_MAX, _UPDATE_BACKOFF_BASE * 2**attempt)
+        time.sleep(random.uniform(0, backoff))
+      try:
+        blob = self._bucket.get_blob(blob_name)
+        if blob is None:
+          bucket, generation = Bucket(capacity, time.time()), 0
+        else:
+          try:
+            value = blob.download_as_bytes(
+                if_generation_match=blob.generation)
+          except exceptions.NotFound:
+            continue  # Deleted in the meantime.
+          bucket, generation = Bucket.from_json(value), blob.generation
+        wait = bucket.reserve(permits, rate, capacity)
+        self._bucket.blob(blob_name).upload_from_string(
+            bucket.to_json(),
+            content_type='application/json',
+            if_generation_match=generation)
+      except _RETRYABLE_ERRORS:
+        continue  # Updated in the meantime, or too often.
+      return wait
+    raise RuntimeError(f'Too much contention on rate limiter bucket {key}')
+
+
+Buckets = Union[MemoryBuckets, GcsBuckets]
+
+
+@functools.cache
+def get_buckets() -> Buckets:
+  """Returns the buckets configured with `RATE_LIMITER_URI`."""
+  if not _LIMITER_URI:
+    return MemoryBuckets()
+  uri = urllib.parse.urlparse(_LIMITER_URI)
+  if uri.scheme == 'gs':
+    return GcsBuckets(uri.netloc, uri.path)
+  raise ValueError(f'Unsupported rate limiter URI: {_LIMITER_URI}')
+
+
+def get_rate(api: str) -> float:
+  """Returns the maximum number of calls per second to an API, 0 if unset."""
+  return _RATES.get(api, 0.0)
+
+
+def acquire(api: str, key: str, permits: int = 1) -> float:
+  """Blocks until calls to an API can be made without exceeding its rate.
+
+  Args:
+    api: Name of the API, e.g. `ga4_admin`.
+    key: Identifier of the resource the quota applies to, e.g. a property ID.
+    permits: Number of calls about to be made.
+
+  Returns:
+    Number of seconds waited.
+  """
+  rate = get_rate(api)
+  if rate <= 0:
+    return 0.0
+  # Allows bursts of up to one second of calls.
+  capacity = max(rate, float(permits))
+  wait = get_buckets().reserve(f'{api}-{key}', permits, rate, capacity)
+  if wait > 0:
+    time.sleep(wait)
+  return wait
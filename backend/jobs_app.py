@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent import futures
+import os
 import signal
 import sys
-import traceback
+import threading
 import types
 
 from flask import json
@@ -24,10 +26,22 @@ from flask.globals import request
 from common import auth_filter
 from common import crmint_logging
 from common import message
-from common import result
 from common import task
+from jobs import task_ledger
+from jobs import task_runner
 from jobs.workers import finder
-from jobs.workers import worker
+
+# Runs tasks after acknowledging their message, instead of holding the push
+# request open while workers wait. Requires CPU to be allocated outside of
+# requests on Cloud Run.
+_BACKGROUND_EXECUTION = os.getenv('JOBS_BACKGROUND_EXECUTION', '0') == '1'
+_BACKGROUND_MAX_WORKERS = int(os.getenv('JOBS_BACKGROUND_MAX_WORKERS', '10'))
+
+_executor = futures.ThreadPoolExecutor(
+    max_workers=_BACKGROUND_MAX_WORKERS, thread_name_prefix='crmint-worker')
+# Tasks are only accepted when a worker thread is free, so that no
+# acknowledged task waits in the executor queue.
+_free_workers = threading.BoundedSemaphore(_BACKGROUND_MAX_WORKERS)
 
 app = Flask(__name__)
 auth_filter.add(app)
@@ -64,48 +78,44 @@ def start_task():
     task_inst = task.Task.from_request(request)
   except (message.BadRequestError, message.TooEarlyError) as e:
     return e.message, e.code
+  if _BACKGROUND_EXECUTION:
+    return _start_task_in_background(task_inst)
+  try:
+    task_runner.run(task_inst)
+  except task_ledger.TaskInProgressError as e:
+    # Redelivered by Pub/Sub once the retry policy backoff has passed.
+    return str(e), 409
+  return 'OK', 200
 
-  crmint_logging.log_message(
-      f'Starting task for name: {task_inst.name}',
-      log_level='DEBUG',
-      worker_class=task_inst.worker_class,
-      pipeline_id=task_inst.pipeline_id,
-      job_id=task_inst.job_id)
 
-  worker_class = finder.get_worker_class(task_inst.worker_class)
-  worker_params = task_inst.worker_params.copy()
-  for setting in worker_class.GLOBAL_SETTINGS:
-    worker_params[setting] = task_inst.general_settings[setting]
-  worker_inst = worker_class(
-      worker_params, task_inst.pipeline_id, task_inst.job_id)
+def _start_task_in_background(task_inst: task.Task):
+  """Acknowledges the task message and runs the task on the executor."""
+  if not _free_workers.acquire(blocking=False):
+    # Redelivered by Pub/Sub, possibly to another instance.
+    return 'All workers are busy', 429
+  try:
+    _executor.submit(_run_in_background, task_inst)
+  except RuntimeError:
+    _free_workers.release()  # Executor shut down.
+    return 'Shutting down', 503
+  return 'Accepted', 202
 
+
+def _run_in_background(task_inst: task.Task) -> None:
   try:
-    workers_to_enqueue = worker_inst.execute()
+    task_runner.run(task_inst)
+  except task_ledger.TaskInProgressError:
+    pass  # Another delivery runs the task and reports its result.
+  except Exception as e:  # pylint: disable=broad-except
+    # The message is acknowledged already, the task will not be retried.
     crmint_logging.log_message(
-        f'Executed task for name: {task_inst.name}',
-        log_level='DEBUG',
+        f'Failed to run task {task_inst.name}: {e}',
+        log_level='ERROR',
         worker_class=task_inst.worker_class,
         pipeline_id=task_inst.pipeline_id,
         job_id=task_inst.job_id)
-  except worker.WorkerException as e:
-    class_name = e.__class__.__name__
-    worker_inst.log_error(f'Execution failed: {class_name}: {e}')
-    result_inst = result.Result(task_inst.name, task_inst.job_id, False)
-    result_inst.report()
-  except Exception as e:  # pylint: disable=broad-except
-    formatted_exception = traceback.format_exc()
-    worker_inst.log_error(f'Unexpected error {formatted_exception}')
-    if task_inst.attempts < worker_inst.MAX_ATTEMPTS:
-      task_inst.reenqueue()
-    else:
-      worker_inst.log_error(f'Giving up after {task_inst.attempts} attempt(s)')
-      result_inst = result.Result(task_inst.name, task_inst.job_id, False)
-      result_inst.report()
-  else:
-    result_inst = result.Result(
-        task_inst.name, task_inst.job_id, True, workers_to_enqueue)
-    result_inst.report()
-  return 'OK', 200
+  finally:
+    _free_workers.release()
 
 
 def shutdown_handler(sig: int, frame: types.FrameType) -> None:
@@ -125,6 +135,9 @@ def shutdown_handler(sig: int, frame: types.FrameType) -> None:
   crmint_logging.log_global_message(
       'Signal received, safely shutting down.',
       log_level='WARNING')
+  # Background tasks still running are lost, their jobs keep waiting for them
+  # and their heartbeats stop.
+  _executor.shutdown(wait=False)
   message.shutdown()
   sys.exit(0)
 
@@ -0,0 +1,142 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs workers from a streaming pull subscription to `crmint-3-start-task`.
+
+Alternative to the `/push/start-task` endpoint of `jobs_app`. A single
+instance keeps up to `SUBSCRIBER_MAX_WORKERS` tasks in flight and the client
+library extends the ack deadline of each message while its worker runs, so
+long running tasks are not redelivered.
+
+The subscription has to be a pull subscription, see `setup_pubsub.py`.
+"""
+
+from concurrent import futures
+import os
+import signal
+import sys
+import types
+
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber import scheduler
+
+from common import crmint_logging
+from common import message
+from common import task
+from jobs import task_ledger
+from jobs import task_runner
+
+_PROJECT = os.getenv('GOOGLE_CLOUD_PROJECT')
+_SUBSCRIPTION = os.getenv(
+    'START_TASK_SUBSCRIPTION', 'crmint-3-start-task-subscription')
+_MAX_WORKERS = int(os.getenv('SUBSCRIBER_MAX_WORKERS', '10'))
+_MAX_MESSAGES = int(os.getenv('SUBSCRIBER_MAX_MESSAGES', str(_MAX_WORKERS)))
+_MAX_BYTES = int(os.getenv('SUBSCRIBER_MAX_BYTES', str(10 * 1024 * 1024)))
+_MAX_LEASE_DURATION = int(  # Unit in seconds.
+    os.getenv('SUBSCRIBER_MAX_LEASE_DURATION', str(2 * 3600)))
+
+_streaming_pull_future = None
+
+
+def handle_message(pubsub_message: pubsub_v1.subscriber.message.Message
+                   ) -> None:
+  """Executes the task of a pulled message, then acknowledges it.
+
+  Args:
+    pubsub_message: Message received from the subscription.
+  """
+  try:
+    task_inst = task.Task.from_pubsub_message(pubsub_message)
+  except message.TooEarlyError:
+    # Redelivered once the subscription retry policy backoff has passed.
+    pubsub_message.nack()
+    return
+  except message.BadRequestError as e:
+    # Dropped, retrying would not make the message valid.
+    crmint_logging.log_global_message(
+        f'Dropped invalid message {pubsub_message.message_id}: {e.message}',
+        log_level='ERROR')
+    pubsub_message.ack()
+    return
+  try:
+    task_runner.run(task_inst)
+  except task_ledger.TaskInProgressError:
+    # Another delivery of this task is running, checked again later.
+    pubsub_message.nack()
+  except Exception as e:  # pylint: disable=broad-except
+    crmint_logging.log_global_message(
+        f'Failed to run task {task_inst.name}: {e}', log_level='ERROR')
+    pubsub_message.nack()
+  else:
+    pubsub_message.ack()
+
+
+def subscribe(
+    subscriber: pubsub_v1.SubscriberClient
+) -> pubsub_v1.subscriber.futures.StreamingPullFuture:
+  """Starts pulling messages in background threads.
+
+  Args:
+    subscriber: Client to open the streaming pull with.
+
+  Returns:
+    Future of the streaming pull, cancel it to stop pulling messages.
+  """
+  subscription_path = subscriber.subscription_path(_PROJECT, _SUBSCRIPTION)
+  flow_control = pubsub_v1.types.FlowControl(
+      max_messages=_MAX_MESSAGES,
+      max_bytes=_MAX_BYTES,
+      max_lease_duration=_MAX_LEASE_DURATION)
+  executor = futures.ThreadPoolExecutor(
+      max_workers=_MAX_WORKERS, thread_name_prefix='crmint-worker')
+  return subscriber.subscribe(
+      subscription_path,
+      callback=handle_message,
+      flow_control=flow_control,
+      scheduler=scheduler.ThreadScheduler(executor=executor),
+      await_callbacks_on_shutdown=True)
+
+
+def shutdown_handler(sig: int, frame: types.FrameType) -> None:
+  """Stops pulling new messages and waits for running tasks.
+
+  Args:
+    sig: Signal intercepted.
+    frame: Frame object such as `tb.tb_frame` if `tb` is a traceback object.
+  """
+  del sig, frame  # Unused argument
+  crmint_logging.log_global_message(
+      'Signal received, safely shutting down.',
+      log_level='WARNING')
+  if _streaming_pull_future is not None:
+    _streaming_pull_future.cancel()
+
+
+def main() -> None:
+  global _streaming_pull_future  # pylint: disable=global-statement
+  signal.signal(signal.SIGINT, shutdown_handler)
+  signal.signal(signal.SIGTERM, shutdown_handler)
+  with pubsub_v1.SubscriberClient() as subscriber:
+    _streaming_pull_future = subscribe(subscriber)
+    crmint_logging.log_global_message(
+        f'Pulling messages from {_SUBSCRIPTION} with {_MAX_WORKERS} workers.',
+        log_level='INFO')
+    # Blocks until the streaming pull is cancelled and running tasks are done.
+    _streaming_pull_future.result()
+  message.shutdown()
+  sys.exit(0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,70 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the controller and the workers in a single process, without Pub/Sub.
+
+Tasks and results are exchanged through an in-process broker, which calls
+the jobs and controller handlers directly. Useful for small single-node
+deployments, local runs and benchmarks.
+"""
+
+import flask
+
+from common import heartbeat
+from common import local_broker
+from common import message
+from common import result
+from common import task
+from controller.result import views as result_views
+from controller_app import app
+from jobs import task_runner
+
+
+def register_handlers(broker: local_broker.Broker, flask_app: flask.Flask):
+  """Subscribes the jobs and controller handlers to the broker topics.
+
+  Args:
+    broker: Broker delivering the messages.
+    flask_app: Controller app, providing the database session to handlers.
+  """
+
+  def handle_task(data):
+    task_runner.run(task.Task.from_data(data))
+
+  def handle_result(data):
+    with flask_app.app_context():
+      result_views.process_result(result.Result.from_data(data))
+
+  def handle_heartbeat(data):
+    with flask_app.app_context():
+      result_views.process_heartbeat(heartbeat.Heartbeat.from_data(data))
+
+  # Workers can wait for minutes, e.g. for a BigQuery job, they must not delay
+  # the delivery of results and heartbeats.
+  broker.subscribe('crmint-3-start-task', handle_task, concurrent=True)
+  broker.subscribe('crmint-3-task-finished', handle_result)
+  broker.subscribe('crmint-3-task-heartbeat', handle_heartbeat)
+
+
+def main() -> None:
+  broker = local_broker.Broker()
+  register_handlers(broker, app)
+  message.set_transport(broker)
+  broker.start()
+  # NB: the reloader would start a second broker in a child process.
+  app.run(host='0.0.0.0', port=8080, threaded=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+  main()
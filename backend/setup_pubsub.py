@@ -30,6 +30,11 @@ def setup_pubsub():  # pylint: disable=too-many-locals
           'ack_deadline_seconds': 60,
           'minimum_backoff': 10,  # seconds
       },
+      'crmint-3-task-heartbeat': {
+          'push_endpoint': 'http://controller:8080/push/task-heartbeat',
+          'ack_deadline_seconds': 60,
+          'minimum_backoff': 10,  # seconds
+      },
       'crmint-3-start-pipeline': {
           'push_endpoint': 'http://controller:8080/push/start-pipeline',
           'ack_deadline_seconds': 60,
@@ -37,6 +42,12 @@ def setup_pubsub():  # pylint: disable=too-many-locals
       },
       'crmint-3-pipeline-finished': None,
   }
+  if os.getenv('JOBS_STREAMING_PULL', '0') == '1':
+    # Tasks are pulled by `jobs_subscriber.py` instead of pushed to jobs.
+    crmint_subscriptions['crmint-3-start-task']['push_endpoint'] = None
+  if os.getenv('CONTROLLER_RESULTS_PULL', '0') == '1':
+    # Results are pulled in batches by `flask ingest-results`.
+    crmint_subscriptions['crmint-3-task-finished']['push_endpoint'] = None
   project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
   publisher = pubsub_v1.PublisherClient()
   subscriber = pubsub_v1.SubscriberClient()
@@ -57,8 +68,10 @@ def setup_pubsub():  # pylint: disable=too-many-locals
         subscription_path = subscriber.subscription_path(
             project_id, subscription_id)
         if subscription_path not in subscription_paths:
-          push_config = pubsub_v1.types.PushConfig(
-              push_endpoint=subscription['push_endpoint'])
+          push_config = None
+          if subscription['push_endpoint'] is not None:
+            push_config = pubsub_v1.types.PushConfig(
+                push_endpoint=subscription['push_endpoint'])
           minimum_backoff = pubsub_v1.types.Duration(
               seconds=subscription['minimum_backoff'])
           retry_policy = pubsub_v1.types.RetryPolicy(
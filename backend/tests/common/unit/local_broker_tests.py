@@ -0,0 +1,97 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for common.local_broker."""
+
+import threading
+
+from absl.testing import absltest
+
+from common import local_broker
+from common import message
+
+
+class LocalBrokerTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.broker = local_broker.Broker()
+    message.set_transport(self.broker)
+    self.addCleanup(message.set_transport, None)
+    self.received = []
+    self.broker.subscribe('TOPIC', self.received.append)
+
+  def test_delivers_message_to_subscribed_handler(self):
+    message.send({'foo': 'bar'}, 'TOPIC')
+    self.broker.drain()
+    self.assertEqual(self.received, [{'foo': 'bar'}])
+
+  def test_delivers_messages_in_due_order(self):
+    message.send({'order': 2}, 'TOPIC', delay=1)
+    message.send({'order': 1}, 'TOPIC')
+    self.broker.drain()
+    self.assertEqual(self.received, [{'order': 1}, {'order': 2}])
+
+  def test_handlers_can_publish_messages(self):
+    def forward(data):
+      message.send(data, 'OTHER_TOPIC')
+    self.broker.subscribe('FORWARD_TOPIC', forward)
+    self.broker.subscribe('OTHER_TOPIC', self.received.append)
+    message.send({'foo': 'bar'}, 'FORWARD_TOPIC')
+    self.broker.drain()
+    self.assertEqual(self.received, [{'foo': 'bar'}])
+
+  def test_failing_handler_does_not_stop_delivery(self):
+    def fail(data):
+      raise ValueError(data)
+    self.broker.subscribe('FAILING_TOPIC', fail)
+    message.send({'foo': 'bar'}, 'FAILING_TOPIC')
+    message.send({'foo': 'baz'}, 'TOPIC')
+    with self.assertLogs(local_broker.__name__, level='ERROR'):
+      self.broker.drain()
+    self.assertEqual(self.received, [{'foo': 'baz'}])
+
+  def test_delivers_in_background_thread(self):
+    self.broker.start()
+    self.addCleanup(self.broker.stop)
+    message.send_many([{'foo': 'bar'}, {'foo': 'baz'}], 'TOPIC')
+    self.assertTrue(self.broker.wait_until_idle(timeout=5))
+    self.assertEqual(self.received, [{'foo': 'bar'}, {'foo': 'baz'}])
+
+  def test_concurrent_handler_does_not_delay_other_topics(self):
+    release = threading.Event()
+    self.broker.subscribe('SLOW_TOPIC', lambda data: release.wait(5),
+                          concurrent=True)
+    self.broker.start()
+    self.addCleanup(self.broker.stop)
+    message.send({'foo': 'bar'}, 'SLOW_TOPIC')
+    message.send({'foo': 'baz'}, 'TOPIC')
+    self.assertFalse(self.broker.wait_until_idle(timeout=0.5))
+    self.assertEqual(self.received, [{'foo': 'baz'}])
+    release.set()
+    self.assertTrue(self.broker.wait_until_idle(timeout=5))
+
+  def test_drain_runs_concurrent_handlers_in_calling_thread(self):
+    threads = []
+    self.broker.subscribe(
+        'CONCURRENT_TOPIC',
+        lambda data: threads.append(threading.current_thread()),
+        concurrent=True)
+    message.send({'foo': 'bar'}, 'CONCURRENT_TOPIC')
+    self.broker.drain()
+    self.assertEqual(threads, [threading.current_thread()])
+
+
+if __name__ == '__main__':
+  absltest.main()
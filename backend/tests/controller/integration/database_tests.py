@@ -0,0 +1,174 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import flask
+import sqlalchemy
+
+from controller import app
+from controller import database
+from controller import extensions
+from controller import metrics
+from controller import models
+from tests import controller_utils
+
+
+class TestEngineOptions(parameterized.TestCase):
+
+  def test_default_options(self):
+    options = app.engine_options()
+    self.assertEqual(
+        options,
+        {
+            'pool_pre_ping': True,
+            'pool_recycle': 300,
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+        })
+
+  def test_sqlite_ignores_pool_size(self):
+    test_app = flask.Flask(__name__)
+    test_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    test_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    test_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = app.engine_options()
+    extensions.db.init_app(test_app)
+    with test_app.app_context():
+      engine = extensions.db.get_engine(test_app)
+    self.assertIsInstance(engine.pool, sqlalchemy.pool.StaticPool)
+
+  @mock.patch.dict(os.environ, {
+      'DATABASE_POOL_SIZE': '3',
+      'DATABASE_MAX_OVERFLOW': '0',
+      'DATABASE_POOL_RECYCLE': '60',
+      'DATABASE_POOL_PRE_PING': '0',
+  })
+  def test_options_are_read_from_environment(self):
+    options = app.engine_options()
+    self.assertEqual(
+        options,
+        {
+            'pool_pre_ping': False,
+            'pool_recycle': 60,
+            'pool_size': 3,
+            'max_overflow': 0,
+            'pool_timeout': 30,
+        })
+
+
+class TestReadReplica(controller_utils.ControllerAppTest):
+
+  @mock.patch.dict(os.environ, {
+      'DATABASE_URI': 'sqlite:///:memory:',
+      'DATABASE_REPLICA_URI': 'sqlite:///:memory:',
+  })
+  def create_app(self) -> flask.Flask:
+    return app.create_app({
+        'TESTING': True,
+        'PRESERVE_CONTEXT_ON_EXCEPTION': False,
+    })
+
+  def setUp(self):
+    super().setUp()
+    self.replica_engine = extensions.db.get_engine(
+        bind=extensions.REPLICA_BIND)
+    extensions.db.Model.metadata.create_all(self.replica_engine)
+    with self.replica_engine.begin() as connection:
+      connection.execute(models.Pipeline.__table__.insert(), [
+          {'id': 1, 'name': 'replicated', 'status': 'idle',
+           'run_on_schedule': False}])
+
+  def test_listing_reads_from_replica(self):
+    response = self.client.get('/api/pipelines')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual([p['name'] for p in response.json], ['replicated'])
+
+  def test_pipeline_run_reads_from_replica(self):
+    with self.replica_engine.begin() as connection:
+      connection.execute(models.PipelineRun.__table__.insert(), [
+          {'id': 1, 'pipeline_id': 1, 'status': 'succeeded',
+           'started_at': datetime.datetime(2023, 6, 1),
+           'created_at': datetime.datetime(2023, 6, 1),
+           'updated_at': datetime.datetime(2023, 6, 1)}])
+    response = self.client.get('/api/pipelines/1/runs/1')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json['status'], 'succeeded')
+
+  def test_other_views_use_primary_database(self):
+    response = self.client.post(
+        '/api/pipelines', json={'name': 'new', 'schedules': [], 'params': []})
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual([p.name for p in models.Pipeline.all()], ['new'])
+
+  def test_flushes_go_to_primary_database(self):
+    @database.read_from_replica
+    def create_pipeline():
+      self.assertLen(models.Pipeline.all(), 1)
+      return models.Pipeline.create(name='new')
+
+    create_pipeline()
+    self.assertEqual([p.name for p in models.Pipeline.all()], ['new'])
+
+
+class TestPoolMetrics(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    metrics.reset()
+    database_dir = self.enter_context(tempfile.TemporaryDirectory())
+    test_app = flask.Flask(__name__)
+    test_app.config['SQLALCHEMY_DATABASE_URI'] = (
+        f'sqlite:///{database_dir}/crmint.db')
+    test_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    test_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'poolclass': sqlalchemy.pool.QueuePool,
+        'pool_size': 2,
+        'max_overflow': 1,
+    }
+    extensions.db.init_app(test_app)
+    database.listen_to_pool_events()
+    self.app = test_app
+    self.enter_context(test_app.app_context())
+
+  def test_reports_pool_utilization(self):
+    engine = extensions.db.get_engine(self.app)
+    connections = [engine.connect() for _ in range(3)]
+    self.assertEqual(
+        database.pool_metrics(self.app),
+        {
+            'db_pool_size': 2,
+            'db_pool_checked_out': 3,
+            'db_pool_overflow': 1,
+            'db_pool_utilization': 1.5,
+        })
+    for connection in connections:
+      connection.close()
+    self.assertEqual(database.pool_metrics(self.app)['db_pool_checked_out'], 0)
+    self.assertEqual(metrics.get_all()['db_connections_opened'], 3)
+
+  def test_counts_invalidated_connections(self):
+    engine = extensions.db.get_engine(self.app)
+    with engine.connect() as connection:
+      connection.invalidate()
+    self.assertEqual(metrics.get_all()['db_connections_invalidated'], 1)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,147 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from unittest import mock
+
+from absl.testing import absltest
+
+from controller import models
+from controller.event import views
+from tests import controller_utils
+
+
+class TestEventViews(controller_utils.ControllerAppTest):
+
+  def setUp(self):
+    super().setUp()
+    self.enter_context(mock.patch.object(views, '_POLL_INTERVAL', 0))
+    self.pipeline = models.Pipeline.create(name='pipeline1')
+    self.job = models.Job.create(name='job1', pipeline_id=self.pipeline.id)
+
+  def _set_statuses(self):
+    self.pipeline.set_status(models.Pipeline.STATUS.RUNNING)
+    self.job.set_status(models.Job.STATUS.RUNNING)
+    models.Pipeline.commit()
+
+  def test_without_cursor_returns_last_cursor(self):
+    self._set_statuses()
+    response = self.client.get('/api/events')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json['events'], [])
+    self.assertEqual(response.json['cursor'], models.StatusEvent.last_id())
+
+  def test_returns_events_following_cursor(self):
+    cursor = self.client.get('/api/events').json['cursor']
+    self._set_statuses()
+    response = self.client.get(f'/api/events?cursor={cursor}&timeout=0')
+    self.assertEqual(response.status_code, 200)
+    events = response.json['events']
+    self.assertEqual(
+        [(event['job_id'], event['status']) for event in events],
+        [(None, 'running'), (self.job.id, 'running')])
+    self.assertEqual(response.json['cursor'], events[-1]['id'])
+
+  def test_filters_events_by_pipeline(self):
+    self._set_statuses()
+    pipeline2 = models.Pipeline.create(name='pipeline2')
+    pipeline2.set_status(models.Pipeline.STATUS.RUNNING)
+    models.Pipeline.commit()
+    response = self.client.get(
+        f'/api/events?cursor=0&pipeline_id={pipeline2.id}&timeout=0')
+    self.assertEqual(
+        [event['pipeline_id'] for event in response.json['events']],
+        [pipeline2.id])
+
+  def test_advances_cursor_past_events_of_other_pipelines(self):
+    pipeline2 = models.Pipeline.create(name='pipeline2')
+    pipeline2.set_status(models.Pipeline.STATUS.RUNNING)
+    models.Pipeline.commit()
+    response = self.client.get(
+        f'/api/events?cursor=0&pipeline_id={self.pipeline.id}&timeout=0')
+    self.assertEqual(response.json['events'], [])
+    self.assertEqual(
+        response.json['cursor'], models.StatusEvent.since(0)[-1].id)
+
+  def test_holds_back_events_following_a_missing_id(self):
+    self._set_statuses()
+    first_event, second_event = models.StatusEvent.since(0)
+    # Simulates the first event being committed after the second one.
+    models.StatusEvent.query.filter_by(id=first_event.id).delete()
+    models.StatusEvent.commit()
+    response = self.client.get('/api/events?cursor=0&timeout=0')
+    self.assertEqual(response.json, {'events': [], 'cursor': 0})
+    models.StatusEvent.create(
+        id=first_event.id, pipeline_id=self.pipeline.id, status='running')
+    response = self.client.get('/api/events?cursor=0&timeout=0')
+    self.assertEqual(
+        [event['id'] for event in response.json['events']],
+        [first_event.id, second_event.id])
+
+  def test_returns_events_of_reset_statuses(self):
+    cursor = self.client.get('/api/events').json['cursor']
+    self._set_statuses()
+    self.client.post('/api/reset/statuses')
+    response = self.client.get(f'/api/events?cursor={cursor}&timeout=0')
+    self.assertEqual(
+        [(event['job_id'], event['status'])
+         for event in response.json['events']][-2:],
+        [(self.job.id, 'idle'), (None, 'idle')])
+
+  def test_times_out_without_events(self):
+    response = self.client.get('/api/events?cursor=0&timeout=0')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json, {'events': [], 'cursor': 0})
+
+  def test_rejects_invalid_timeout(self):
+    response = self.client.get('/api/events?cursor=0&timeout=3600')
+    self.assertEqual(response.status_code, 400)
+
+  def test_streams_events_from_last_event_id(self):
+    self.enter_context(mock.patch.object(views, '_STREAM_DURATION', 0))
+    self._set_statuses()
+    first_event_id = models.StatusEvent.since(0)[0].id
+    response = self.client.get(
+        '/api/events/stream', headers={'Last-Event-ID': str(first_event_id)})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.mimetype, 'text/event-stream')
+    messages = response.get_data(as_text=True).split('\n\n')
+    self.assertEqual(messages[0], 'retry: 1000')
+    event_id, event_type, data = messages[1].split('\n')
+    self.assertEqual(event_id, f'id: {first_event_id + 1}')
+    self.assertEqual(event_type, 'event: status')
+    self.assertEqual(
+        json.loads(data.removeprefix('data: '))['job_id'], self.job.id)
+    self.assertEqual(messages[2:], [''])
+
+  def test_streams_cursor_past_events_of_other_pipelines(self):
+    self.enter_context(mock.patch.object(views, '_STREAM_DURATION', 0))
+    self._set_statuses()
+    pipeline2 = models.Pipeline.create(name='pipeline2')
+    response = self.client.get(
+        f'/api/events/stream?cursor=0&pipeline_id={pipeline2.id}')
+    last_event_id = models.StatusEvent.since(0)[-1].id
+    self.assertEqual(
+        response.get_data(as_text=True),
+        f'retry: 1000\n\nid: {last_event_id}\n\n')
+
+  def test_streams_keep_alive_without_events(self):
+    self.enter_context(mock.patch.object(views, '_STREAM_DURATION', 0))
+    response = self.client.get('/api/events/stream')
+    self.assertEqual(
+        response.get_data(as_text=True), 'retry: 1000\n\n: keep-alive\n\n')
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -25,6 +25,26 @@ class TestJobViews(controller_utils.ControllerAppTest):
     response = self.client.get('/api/jobs?pipeline_id=%d' % pipeline.id)
     self.assertEqual(response.status_code, 200)
 
+  def test_list_not_modified_until_pipeline_jobs_change(self):
+    pipeline = models.Pipeline.create()
+    job = models.Job.create(pipeline_id=pipeline.id)
+    url = '/api/jobs?pipeline_id=%d' % pipeline.id
+    etag = self.client.get(url).headers['ETag']
+    response = self.client.get(url, headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 304)
+    # Status changes of other pipelines are not tracked.
+    other_pipeline = models.Pipeline.create()
+    other_pipeline.set_status(models.Pipeline.STATUS.RUNNING)
+    models.Pipeline.commit()
+    etag = self.client.get(url).headers['ETag']
+    response = self.client.get(url, headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 304)
+    job.set_status(models.Job.STATUS.RUNNING)
+    models.Job.commit()
+    response = self.client.get(url, headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json[0]['status'], 'running')
+
   def test_missing_job(self):
     response = self.client.get('/api/jobs/1')
     self.assertEqual(response.status_code, 404)
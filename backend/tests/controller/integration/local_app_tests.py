@@ -0,0 +1,94 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs pipelines end-to-end through the in-process broker."""
+
+from unittest import mock
+
+from absl.testing import absltest
+import pytest
+
+from common import crmint_logging
+from common import local_broker
+from common import message
+from controller import models
+from tests import controller_utils
+
+# The workers run by the local app need the jobs requirements, which are not
+# installed to run the controller tests alone.
+for _module_name in ('google.analytics.admin', 'google.cloud.aiplatform',
+                     'google.cloud.storage', 'googleapiclient'):
+  pytest.importorskip(_module_name)
+
+import local_app  # pylint: disable=g-import-not-at-top,wrong-import-position
+
+
+class TestLocalApp(controller_utils.ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_message', autospec=True))
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_pipeline_status', autospec=True))
+    self.broker = local_broker.Broker()
+    local_app.register_handlers(self.broker, self.ctx.app)
+    message.set_transport(self.broker)
+    self.addCleanup(message.set_transport, None)
+
+  def _create_job(self, pipeline, success, preceding_job=None):
+    job = models.Job.create(
+        name=f'Job {success}', pipeline_id=pipeline.id,
+        worker_class='Commenter')
+    models.Param.update_list([
+        {'name': 'comment', 'type': 'text', 'value': ''},
+        {'name': 'success', 'type': 'boolean', 'value': '1' if success else ''},
+    ], job)
+    if preceding_job:
+      models.StartCondition.create(
+          job_id=job.id, preceding_job_id=preceding_job.id,
+          condition=models.StartCondition.CONDITION.SUCCESS)
+    return job
+
+  def test_runs_pipeline_with_dependent_jobs(self):
+    pipeline = models.Pipeline.create(name='Pipeline')
+    job1 = self._create_job(pipeline, success=True)
+    job2 = self._create_job(pipeline, success=True, preceding_job=job1)
+    job1_id, job2_id, pipeline_id = job1.id, job2.id, pipeline.id
+    self.assertTrue(pipeline.start())
+    self.broker.drain()
+    self.assertEqual(models.Job.find(job1_id).status,
+                     models.Job.STATUS.SUCCEEDED)
+    self.assertEqual(models.Job.find(job2_id).status,
+                     models.Job.STATUS.SUCCEEDED)
+    self.assertEqual(models.Pipeline.find(pipeline_id).status,
+                     models.Pipeline.STATUS.SUCCEEDED)
+
+  def test_runs_pipeline_with_failing_job(self):
+    pipeline = models.Pipeline.create(name='Pipeline')
+    job1 = self._create_job(pipeline, success=False)
+    job2 = self._create_job(pipeline, success=True, preceding_job=job1)
+    job1_id, job2_id, pipeline_id = job1.id, job2.id, pipeline.id
+    self.assertTrue(pipeline.start())
+    self.broker.drain()
+    self.assertEqual(models.Job.find(job1_id).status,
+                     models.Job.STATUS.FAILED)
+    self.assertEqual(models.Job.find(job2_id).status,
+                     models.Job.STATUS.IDLE)
+    self.assertEqual(models.Pipeline.find(pipeline_id).status,
+                     models.Pipeline.STATUS.FAILED)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -12,13 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent import futures
+import datetime
+import os
+import tempfile
+import time
 from unittest import mock
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import jinja2
+import sqlalchemy
 
 from common import crmint_logging
+from common import global_settings
+from common import message
 from common import task
+from controller import dag
+from controller import extensions
+from controller import inline
+from controller import metrics
+from controller import mixins
 from controller import models
 from tests import controller_utils
 
@@ -66,6 +80,27 @@ class TestPipelineWithJobs(ModelTestCase):
     self.assertEqual(pipeline.status, models.Pipeline.STATUS.RUNNING)
     self.assertEqual(job1.status, models.Job.STATUS.RUNNING)
 
+  def _record_batching_of_enqueued_tasks(self) -> list[bool]:
+    in_batch = []
+    self.patched_task_enqueue.side_effect = lambda *args, **kwargs: (
+        in_batch.append(message._pending.futures is not None))
+    return in_batch
+
+  def test_start_enqueues_tasks_in_a_batch(self):
+    pipeline = models.Pipeline.create()
+    for _ in range(3):
+      models.Job.create(pipeline_id=pipeline.id)
+    in_batch = self._record_batching_of_enqueued_tasks()
+    self.assertTrue(pipeline.start())
+    self.assertEqual(in_batch, [True, True, True])
+
+  def test_start_single_job_enqueues_its_task_in_a_batch(self):
+    pipeline = models.Pipeline.create()
+    job = models.Job.create(pipeline_id=pipeline.id)
+    in_batch = self._record_batching_of_enqueued_tasks()
+    self.assertIsNotNone(pipeline.start_single_job(job))
+    self.assertEqual(in_batch, [True])
+
   @parameterized.named_parameters(
       ('One job running', models.Job.STATUS.RUNNING),
       ('One job stopping', models.Job.STATUS.STOPPING),
@@ -379,6 +414,327 @@ class TestPipelineDestroy(ModelTestCase):
     pipeline.destroy()
     self.assertIsNone(models.Param.find(param1.id))
 
+  def test_destroy_keeps_other_pipelines(self):
+    pipeline1 = models.Pipeline.create()
+    pipeline2 = models.Pipeline.create()
+    job2 = models.Job.create(pipeline_id=pipeline2.id, name='j2')
+    pipeline1.destroy()
+    self.assertIsNotNone(models.Pipeline.find(pipeline2.id))
+    self.assertIsNotNone(models.Job.find(job2.id))
+
+  def test_destroy_and_reimport_100_jobs(self):
+    """Deletes a 100-job pipeline with one statement per table."""
+    num_jobs = 100
+    data = {
+        'params': [{'name': 'p1', 'type': 'string', 'value': 'foo'}],
+        'schedules': [{'id': None, 'cron': '0 * * * *'}],
+        'jobs': [
+            {
+                'id': i,
+                'name': f'job{i}',
+                'params': [{'name': 'p1', 'type': 'string', 'value': 'bar'}],
+                'hash_start_conditions': [
+                    {'preceding_job_id': i - 1, 'condition': 'success'}
+                ] if i > 0 else [],
+            }
+            for i in range(num_jobs)
+        ],
+    }
+    pipeline = models.Pipeline.create(name='pipeline1')
+    pipeline.import_data(data)
+    self.assertLen(models.StartCondition.all(), num_jobs - 1)
+
+    engine = extensions.db.engine
+    with controller_utils.StatementCounter(engine) as destroy_counter:
+      start_time = time.monotonic()
+      pipeline.destroy()
+      destroy_duration = time.monotonic() - start_time
+    for model in (models.Pipeline, models.Schedule, models.Job,
+                  models.StartCondition, models.Param):
+      self.assertEmpty(model.all())
+
+    pipeline = models.Pipeline.create(name='pipeline1')
+    with controller_utils.StatementCounter(engine) as import_counter:
+      start_time = time.monotonic()
+      pipeline.import_data(data)
+      import_duration = time.monotonic() - start_time
+    self.assertLen(models.Job.all(), num_jobs)
+
+    summary = (f'Deleting {num_jobs} jobs: {destroy_counter.count} '
+               f'statements in {destroy_duration * 1000:.1f}ms. Re-importing '
+               f'them: {import_counter.count} statements in '
+               f'{import_duration * 1000:.1f}ms.')
+    # Reloads the expired pipeline, selects the ids of pipelines, pipeline
+    # runs (none) and jobs, then issues 8 deletes: one per table and foreign
+    # key, except for the job runs of pipeline runs, and increments the
+    # listing revision once.
+    self.assertEqual(destroy_counter.count, 13, summary)
+    self.assertEqual(destroy_counter.commits, 1)
+    # Inserts each job for its primary key, then issues 9 statements: the
+    # pipeline param and schedule with their reloads, the pipeline reload,
+    # DAG and listing revision increments, then job params and start
+    # conditions in bulk.
+    self.assertEqual(import_counter.count, num_jobs + 9, summary)
+    self.assertEqual(import_counter.commits, 1)
+
+
+class TestMlModelDestroy(ModelTestCase):
+
+  def test_destroy_deletes_pipelines_and_relations(self):
+    ml_model = models.MlModel.create(
+        name='model1', type='LOGISTIC_REG', unique_id='CLIENT_ID')
+    models.MlModelFeature.create(
+        ml_model_id=ml_model.id, name='f1', source='GOOGLE_ANALYTICS')
+    pipeline_id = models.Pipeline.create(ml_model_id=ml_model.id).id
+    job_id = models.Job.create(pipeline_id=pipeline_id).id
+    ml_model_id = ml_model.id
+    ml_model.destroy()
+    self.assertIsNone(models.MlModel.find(ml_model_id))
+    self.assertEmpty(models.MlModelFeature.all())
+    self.assertIsNone(models.Pipeline.find(pipeline_id))
+    self.assertIsNone(models.Job.find(job_id))
+
+
+class TestLoadingProfiles(ModelTestCase):
+
+  def _create_pipeline(self, num_jobs: int) -> int:
+    pipeline = models.Pipeline.create()
+    for _ in range(num_jobs):
+      job = models.Job.create(pipeline_id=pipeline.id)
+      models.Param.create(job_id=job.id, name='p', type='string', value='v')
+    pipeline_id = pipeline.id
+    extensions.db.session.expunge_all()
+    return pipeline_id
+
+  def test_detail_profile_loads_jobs_in_fixed_statements(self):
+    pipeline_id = self._create_pipeline(10)
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      pipeline = models.Pipeline.find(
+          pipeline_id, profile=mixins.LoadingProfile.DETAIL)
+      for job in pipeline.jobs:
+        self.assertLen(job.params, 1)
+        self.assertEmpty(job.start_conditions)
+      self.assertEmpty(pipeline.schedules)
+    # Pipeline, schedules, variables, jobs, their params and start conditions.
+    self.assertEqual(counter.count, 6)
+
+  def test_state_machine_profile_raises_on_job_graph_traversal(self):
+    pipeline_id = self._create_pipeline(1)
+    pipeline = models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.STATE_MACHINE)
+    with self.assertRaises(sqlalchemy.exc.InvalidRequestError):
+      pipeline.jobs[0].dependent_jobs  # pylint: disable=pointless-statement
+
+
+class TestParamRendering(ModelTestCase):
+
+  def _create_pipeline(self, num_jobs: int,
+                       num_params: int) -> models.Pipeline:
+    """Inserts a pipeline variable and jobs with params using it."""
+    pipeline = models.Pipeline.create(name='pipeline1')
+    models.Param.create(
+        pipeline_id=pipeline.id, name='dataset', type='string',
+        value='{{ "ds_" ~ "prod" | upper }}')
+    session = extensions.db.session
+    session.execute(models.Job.__table__.insert(), [
+        {'id': i + 1, 'pipeline_id': pipeline.id, 'name': f'job{i}',
+         'status': 'idle'}
+        for i in range(num_jobs)])
+    session.execute(models.Param.__table__.insert(), [
+        {'job_id': i + 1, 'name': f'p{j}', 'type': 'string',
+         'is_required': False,
+         'value': (f'{{% for day in range({j + 1}) %}}%(dataset).t{j}_'
+                   f'{{{{ day | string | upper }}}}{{% endfor %}}')}
+        for i in range(num_jobs) for j in range(num_params)])
+    session.commit()
+    return pipeline
+
+  def test_renders_50_jobs_with_10_params(self):
+    pipeline = self._create_pipeline(50, 10)
+
+    def compile_uncached(value):
+      return jinja2.Template(
+          models._update_legacy_syntaxes(value),
+          undefined=jinja2.StrictUndefined)
+
+    with mock.patch.object(
+        models, '_compile_template', side_effect=compile_uncached):
+      start_time = time.perf_counter()
+      self.assertTrue(pipeline.populate_params_runtime_values())
+      baseline_duration = time.perf_counter() - start_time
+
+    models._compile_template.cache_clear()
+    start_time = time.perf_counter()
+    self.assertTrue(pipeline.populate_params_runtime_values())
+    duration = time.perf_counter() - start_time
+
+    summary = (f'Rendering 50 jobs with 10 params: {duration * 1000:.0f}ms, '
+               f'instead of {baseline_duration * 1000:.0f}ms.')
+    self.assertEqual(
+        models.Param.where(job_id=1, name='p1').one().runtime_value,
+        'ds_PROD.t1_0ds_PROD.t1_1')
+    # The pipeline variable and 10 distinct job param values are compiled.
+    cache_info = models._compile_template.cache_info()
+    self.assertEqual(cache_info.misses, 11)
+    self.assertEqual(cache_info.hits, 50 * 10 - 10)
+    self.assertLess(duration, baseline_duration, summary)
+
+  def test_saves_runtime_values_with_one_statement(self):
+    self._create_pipeline(50, 10)
+    extensions.db.session.expunge_all()
+    pipeline = models.Pipeline.find(
+        1, profile=mixins.LoadingProfile.STATE_MACHINE)
+    engine = extensions.db.engine
+    with models.Pipeline.unit_of_work():
+      with controller_utils.StatementCounter(engine) as counter:
+        self.assertTrue(pipeline.populate_params_runtime_values())
+        worker_values = [
+            param.worker_value for job in pipeline.jobs for param in job.params]
+    # Selects the global variables, then updates all job params at once.
+    self.assertLen(counter.statements, 2)
+    self.assertStartsWith(counter.statements[1], 'UPDATE params')
+    self.assertEqual(worker_values[1], 'ds_PROD.t1_0ds_PROD.t1_1')
+    self.assertEqual(
+        models.Param.where(job_id=50, name='p1').one().runtime_value,
+        'ds_PROD.t1_0ds_PROD.t1_1')
+
+
+class TestLazyParamRendering(ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    models.Param.create(name='project', type='string', value='prj')
+    self.pipeline = models.Pipeline.create(name='pipeline1')
+    models.Param.create(
+        pipeline_id=self.pipeline.id, name='dataset', type='string',
+        value='{{ project }}.ds')
+    self.job1 = models.Job.create(
+        name='job1', pipeline_id=self.pipeline.id, worker_class='BQWaiter')
+    self.job2 = models.Job.create(
+        name='job2', pipeline_id=self.pipeline.id, worker_class='BQWaiter')
+    models.StartCondition.create(
+        job_id=self.job2.id,
+        preceding_job_id=self.job1.id,
+        condition=models.StartCondition.CONDITION.FAIL)
+    models.Param.create(
+        job_id=self.job1.id, name='table', type='string',
+        value='{{ dataset }}.t1')
+
+  def _create_job2_param(self, value):
+    return models.Param.create(
+        job_id=self.job2.id, name='table', type='string', label='Table',
+        value=value)
+
+  def _enqueued_worker_params(self):
+    return [
+        call_args[0][0].worker_params
+        for call_args in self.patched_task_enqueue.call_args_list
+    ]
+
+  def _finish_job1(self, succeeded: bool):
+    task_name, = [
+        task_enqueued.task_name for task_enqueued in models.TaskEnqueued.all()]
+    if succeeded:
+      self.job1.task_succeeded(task_name)
+    else:
+      self.job1.task_failed(task_name)
+
+  def test_renders_params_as_jobs_start(self):
+    job2_param = self._create_job2_param('{{ dataset }}.t2')
+    self.assertTrue(self.pipeline.start())
+    self.assertEqual(self._enqueued_worker_params(), [{'table': 'prj.ds.t1'}])
+    self.assertIsNone(job2_param.runtime_value)
+    # Variables are rendered once per run, with the run's values.
+    models.Param.where(pipeline_id=self.pipeline.id).one().update(
+        value='changed')
+    with mock.patch.object(
+        models.Pipeline, 'render_context',
+        autospec=True) as patched_render_context:
+      self._finish_job1(succeeded=False)
+    patched_render_context.assert_not_called()
+    self.assertEqual(
+        self._enqueued_worker_params()[1], {'table': 'prj.ds.t2'})
+    self.assertEqual(job2_param.runtime_value, 'prj.ds.t2')
+
+  def test_skips_params_of_jobs_not_started(self):
+    job2_param = self._create_job2_param('{{ missing }}')
+    self.assertTrue(self.pipeline.start())
+    self._finish_job1(succeeded=True)
+    self.assertLen(self._enqueued_worker_params(), 1)
+    self.assertNotEqual(self.job2.status, models.Job.STATUS.FAILED)
+    self.assertIsNone(job2_param.runtime_value)
+
+  def test_validates_params_of_all_jobs_on_demand(self):
+    self._create_job2_param('{{ missing }}')
+    self.assertFalse(self.pipeline.start(validate_params=True))
+    self.assertEqual(self.pipeline.status, models.Pipeline.STATUS.FAILED)
+    self.patched_task_enqueue.assert_not_called()
+
+  def test_fails_job_whose_params_cannot_be_rendered(self):
+    job2_param = self._create_job2_param('{{ missing }}')
+    self.assertTrue(self.pipeline.start())
+    self._finish_job1(succeeded=False)
+    self.assertEqual(self.job2.status, models.Job.STATUS.FAILED)
+    self.assertEqual(self.pipeline.status, models.Pipeline.STATUS.FAILED)
+    self.assertLen(self._enqueued_worker_params(), 1)
+    self.assertIsNone(job2_param.runtime_value)
+    self.patched_log_message.assert_any_call(
+        'Invalid job parameter "Table": \'missing\' is undefined',
+        log_level='ERROR',
+        pipeline_id=self.pipeline.id,
+        job_id=self.job2.id,
+        worker_class='BQWaiter')
+
+  def test_fails_start_if_params_of_a_root_job_cannot_be_rendered(self):
+    job3 = models.Job.create(
+        name='job3', pipeline_id=self.pipeline.id, worker_class='BQWaiter')
+    job3_param = models.Param.create(
+        job_id=job3.id, name='table', type='string', value='{{ nope }}')
+    self.assertFalse(self.pipeline.start())
+    self.patched_task_enqueue.assert_not_called()
+    self.assertEqual(self.pipeline.status, models.Pipeline.STATUS.FAILED)
+    for job in (self.job1, self.job2, job3):
+      self.assertEqual(job.status, models.Job.STATUS.FAILED)
+      self.assertEqual(job.running_tasks_count, 0)
+    # No job was left running, the pipeline can start again once fixed.
+    job3_param.update(value='{{ dataset }}.t3')
+    self.assertTrue(self.pipeline.start())
+    self.assertCountEqual(
+        self._enqueued_worker_params(),
+        [{'table': 'prj.ds.t1'}, {'table': 'prj.ds.t3'}])
+
+  def test_fails_start_if_variables_cannot_be_rendered(self):
+    models.Param.where(pipeline_id=self.pipeline.id).one().update(
+        value='{{ missing }}')
+    self.assertFalse(self.pipeline.start())
+    self.assertEqual(self.pipeline.status, models.Pipeline.STATUS.FAILED)
+    self.patched_task_enqueue.assert_not_called()
+
+  def test_prefetches_bigquery_tables_of_all_jobs_once(self):
+    self._create_job2_param('{{ bigquery("prj.ds.b", "f") }}')
+    models.Param.create(
+        job_id=self.job1.id, name='country', type='string',
+        value=('{{ bigquery("prj.ds.a", "f") if false else "us" }}'
+               '{{ bigquery(dataset ~ ".c", "f") if false else "" }}'))
+    prefetched_table_ids = []
+    with mock.patch.object(
+        inline, 'prefetch_bigquery_tables', autospec=True,
+        side_effect=lambda ids: prefetched_table_ids.append(set(ids))):
+      self.assertTrue(self.pipeline.start())
+    # Tables of the whole run are fetched on start, those of a job are only
+    # fetched again as it starts if they expired meanwhile. Tables named by
+    # expressions are only known once rendered.
+    self.assertEqual(
+        prefetched_table_ids, [{'prj.ds.a', 'prj.ds.b'}, {'prj.ds.a'}])
+    self.assertEqual(
+        self._enqueued_worker_params(),
+        [{'table': 'prj.ds.t1', 'country': 'us'}])
+
+  def test_start_single_job_only_renders_its_params(self):
+    self._create_job2_param('{{ missing }}')
+    self.assertTrue(self.pipeline.start_single_job(self.job1))
+    self.assertEqual(self._enqueued_worker_params(), [{'table': 'prj.ds.t1'}])
+
 
 class TestPipelineImport(ModelTestCase):
 
@@ -412,6 +768,79 @@ class TestPipelineImport(ModelTestCase):
     self.assertEqual(pipeline.jobs[0].name, 'j1')
     self.assertEqual(pipeline.jobs[1].name, 'j2')
 
+  def test_import_data_maps_start_conditions(self):
+    pipeline = models.Pipeline.create()
+    data = {
+        'params': [],
+        'schedules': [],
+        'jobs': [
+            {
+                'id': 'b',
+                'name': 'j2',
+                'params': [{'name': 'p1', 'type': 'boolean', 'value': '1'}],
+                'hash_start_conditions': [
+                    {'preceding_job_id': 'a', 'condition': 'fail'}],
+            },
+            {'id': 'a', 'name': 'j1', 'hash_start_conditions': []},
+        ]
+    }
+    pipeline.import_data(data)
+    job2, job1 = pipeline.jobs
+    self.assertEqual(job2.params[0].label, 'p1')
+    self.assertEqual(job2.params[0].value, '1')
+    start_condition, = job2.start_conditions
+    self.assertEqual(start_condition.preceding_job_id, job1.id)
+    self.assertEqual(start_condition.condition, 'fail')
+    self.assertEqual(
+        pipeline.get_dag().start_conditions_of(job2.id),
+        (dag.Edge(job1.id, job2.id, 'fail'),))
+
+  @parameterized.named_parameters(
+      ('missing_jobs', {'params': [], 'schedules': []}),
+      ('duplicate_job_ids', {
+          'params': [],
+          'schedules': [],
+          'jobs': [
+              {'id': 1, 'name': 'j1', 'hash_start_conditions': []},
+              {'id': 1, 'name': 'j2', 'hash_start_conditions': []},
+          ],
+      }),
+      ('unknown_preceding_job', {
+          'params': [],
+          'schedules': [],
+          'jobs': [{
+              'id': 1,
+              'name': 'j1',
+              'hash_start_conditions': [
+                  {'preceding_job_id': 2, 'condition': 'success'}],
+          }],
+      }),
+      ('invalid_condition', {
+          'params': [],
+          'schedules': [],
+          'jobs': [
+              {'id': 1, 'name': 'j1', 'hash_start_conditions': []},
+              {
+                  'id': 2,
+                  'name': 'j2',
+                  'hash_start_conditions': [
+                      {'preceding_job_id': 1, 'condition': 'maybe'}],
+              },
+          ],
+      }),
+      ('param_without_type', {
+          'params': [{'name': 'p1', 'value': 'foo'}],
+          'schedules': [],
+          'jobs': [],
+      }),
+  )
+  def test_import_data_rejects_invalid_payload(self, data):
+    pipeline = models.Pipeline.create()
+    with self.assertRaises(models.InvalidImportError):
+      pipeline.import_data(data)
+    self.assertEmpty(models.Job.all())
+    self.assertEmpty(models.Param.all())
+
 
 class TestJobStartedStatus(ModelTestCase):
 
@@ -814,5 +1243,605 @@ class TestJobStartingMultipleTasks(ModelTestCase):
       self.assertEqual(job.status, models.Job.STATUS.SUCCEEDED)
 
 
+class TestJobRunningTasksCount(ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    self.job = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+
+  def test_counter_follows_registered_tasks(self):
+    task1 = self.job.enqueue('BQWaiter', {})
+    self.job.enqueue('BQWaiter', {})
+    self.assertEqual(self.job.running_tasks_count, 2)
+    self.assertEqual(self.job.task_succeeded(task1.name), 1)
+    self.assertEqual(self.job.running_tasks_count, 1)
+
+  def test_duplicate_result_is_counted_once(self):
+    task1 = self.job.enqueue('BQWaiter', {})
+    self.job.enqueue('BQWaiter', {})
+    self.assertEqual(self.job.task_succeeded(task1.name), 1)
+    self.assertEqual(self.job.task_succeeded(task1.name), 1)
+    self.assertEqual(self.job.status, models.Job.STATUS.RUNNING)
+
+  def test_task_is_registered_before_being_published(self):
+    def assert_registered(task_inst, delay):
+      del delay  # Unused.
+      self.assertEqual(
+          self.job.registered_task_names([task_inst.name]), {task_inst.name})
+
+    self.patched_task_enqueue.side_effect = assert_registered
+    self.job.enqueue('BQWaiter', {})
+    self.patched_task_enqueue.assert_called_once()
+
+
+class TestJobRunningTasksCountConcurrency(ModelTestCase):
+
+  # Threads need their own connections, which an in-memory database lacks.
+  database_uri = None
+
+  def setUp(self):
+    tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.database_uri = f'sqlite:///{os.path.join(tmp_dir, "crmint.db")}'
+    super().setUp()
+    self.patched_last_task_finished = self.enter_context(
+        mock.patch.object(
+            models.Job, '_last_task_finished', autospec=True, return_value=0))
+
+  def test_concurrent_results_finish_job_once(self):
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+    task_names = [job.enqueue('BQWaiter', {}).name for _ in range(40)]
+    job_id = job.id
+
+    def finish_task(task_name):
+      with self.app.app_context():
+        models.Job.find(job_id).task_succeeded(task_name)
+
+    # Each result is delivered twice, as Pub/Sub may do.
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+      list(executor.map(finish_task, task_names * 2))
+
+    self.patched_last_task_finished.assert_called_once()
+    job = models.Job.find(job_id)
+    models.Job.session.refresh(job)
+    self.assertEqual(job.running_tasks_count, 0)
+    self.assertEqual(job._enqueued_task_count(), 0)
+
+
+class TestPipelineDag(ModelTestCase):
+
+  def _create_pipeline(self, num_jobs: int) -> list[models.Job]:
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    jobs = []
+    with models.Pipeline.unit_of_work():
+      for _ in range(num_jobs):
+        jobs.append(models.Job.create(
+            pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING))
+    return jobs
+
+  def test_revision_changes_with_structure(self):
+    pipeline = models.Pipeline.create()
+    job1 = models.Job.create(pipeline_id=pipeline.id)
+    job2 = models.Job.create(pipeline_id=pipeline.id)
+    revision = pipeline.dag_revision
+    job1.set_status(models.Job.STATUS.RUNNING)
+    self.assertEqual(pipeline.dag_revision, revision)
+    sc = models.StartCondition.create(
+        job_id=job2.id, preceding_job_id=job1.id, condition='success')
+    self.assertEqual(pipeline.dag_revision, revision + 1)
+    self.assertEqual(pipeline.get_dag().dependents_of(job1.id), (job2.id,))
+    sc.update(condition='fail')
+    self.assertEqual(pipeline.dag_revision, revision + 2)
+    job2.destroy()
+    self.assertEqual(pipeline.dag_revision, revision + 3)
+    self.assertEqual(pipeline.get_dag().order, (job1.id,))
+
+  def test_dag_is_loaded_once_per_revision(self):
+    jobs = self._create_pipeline(3)
+    pipeline = jobs[0].pipeline
+    pipeline.get_dag()
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      pipeline.get_dag()
+    self.assertEqual(counter.count, 0)
+
+  def test_finishing_task_runs_fixed_number_of_statements(self):
+    counts = []
+    for num_jobs in (10, 100):
+      jobs = self._create_pipeline(num_jobs)
+      task_names = [job.enqueue('Worker', {}).name for job in jobs[:2]]
+      jobs[0].task_succeeded(task_names[0])  # Loads the pipeline structure.
+      with controller_utils.StatementCounter(extensions.db.engine) as counter:
+        jobs[1].task_succeeded(task_names[1])
+      self.assertEqual(jobs[1].status, models.Job.STATUS.SUCCEEDED)
+      counts.append(counter.count)
+    self.assertEqual(counts[0], counts[1])
+
+
+class TestOptimisticConcurrency(ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.patched_sleep = self.enter_context(
+        mock.patch.object(time, 'sleep', autospec=True))
+    metrics.reset()
+
+  def _update_concurrently(self, job):
+    """Increments the job version, as another controller instance would."""
+    extensions.db.session.execute(
+        sqlalchemy.update(models.Job)
+        .where(models.Job.id == job.id)
+        .values(version=models.Job.version + 1)
+        .execution_options(synchronize_session=False))
+
+  def test_set_status_increments_version(self):
+    job = models.Job.create()
+    job.set_status(models.Job.STATUS.RUNNING)
+    job.set_status(models.Job.STATUS.SUCCEEDED)
+    extensions.db.session.commit()
+    self.assertEqual(job.version, 2)
+    self.assertEqual(job.status, models.Job.STATUS.SUCCEEDED)
+
+  def test_set_status_fails_if_updated_concurrently(self):
+    job = models.Job.create()
+    self._update_concurrently(job)
+    with self.assertRaises(mixins.ConflictError):
+      job.set_status(models.Job.STATUS.RUNNING)
+
+  def test_set_statuses_fails_if_one_job_updated_concurrently(self):
+    job1 = models.Job.create()
+    job2 = models.Job.create()
+    self._update_concurrently(job2)
+    with self.assertRaises(mixins.ConflictError):
+      models.Job.set_statuses([job1, job2], models.Job.STATUS.WAITING)
+
+  def test_retries_unit_of_work_on_conflict(self):
+    job = models.Job.create(status=models.Job.STATUS.WAITING)
+    attempts = []
+
+    def start_job():
+      attempts.append(job.status)
+      if len(attempts) == 1:
+        self._update_concurrently(job)
+      job.set_status(models.Job.STATUS.RUNNING)
+
+    models.Job.run_with_retries(start_job)
+    self.assertLen(attempts, 2)
+    self.assertEqual(job.status, models.Job.STATUS.RUNNING)
+    self.assertEqual(metrics.get_all()['conflicts'], 1)
+    self.patched_sleep.assert_called_once()
+
+  def test_gives_up_after_max_attempts(self):
+    job = models.Job.create()
+
+    def start_job():
+      self._update_concurrently(job)
+      job.set_status(models.Job.STATUS.RUNNING)
+
+    with self.assertRaises(mixins.ConflictError):
+      models.Job.run_with_retries(start_job)
+    self.assertEqual(
+        metrics.get_all()['conflicts'], mixins.MAX_CONFLICT_ATTEMPTS)
+    self.assertEqual(models.Job.find(job.id).status, models.Job.STATUS.IDLE)
+
+  def test_dependent_job_is_started_once(self):
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job1 = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+    job2 = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.WAITING)
+    models.StartCondition.create(
+        job_id=job2.id, preceding_job_id=job1.id, condition='success')
+    task_name = job1.enqueue('Worker', {}).name
+    self.patched_task_enqueue.reset_mock()
+    original_start = models.Job.start
+    start_calls = []
+
+    def start(job, statuses=None):
+      start_calls.append(job.id)
+      if len(start_calls) == 1:
+        # Another instance starts the dependent job in the meantime.
+        self._update_concurrently(job)
+      return original_start(job, statuses)
+
+    with mock.patch.object(models.Job, 'start', start):
+      job1.task_succeeded(task_name)
+    self.assertEqual(start_calls, [job2.id, job2.id])
+    self.assertEqual(job2.status, models.Job.STATUS.RUNNING)
+    self.assertEqual(self.patched_task_enqueue.call_count, 1)
+
+
+class TestRunHistory(ModelTestCase):
+
+  def _create_pipeline(self) -> tuple[models.Pipeline, list[models.Job]]:
+    pipeline = models.Pipeline.create(name='pipeline1')
+    job1 = models.Job.create(
+        name='job1', pipeline_id=pipeline.id, worker_class='BQWaiter')
+    job2 = models.Job.create(
+        name='job2', pipeline_id=pipeline.id, worker_class='BQWaiter')
+    models.StartCondition.create(
+        job_id=job2.id,
+        preceding_job_id=job1.id,
+        condition=models.StartCondition.CONDITION.SUCCESS)
+    return pipeline, [job1, job2]
+
+  def _finish_task(self, job: models.Job, succeeded: bool = True) -> None:
+    task_name, = [
+        task_enqueued.task_name
+        for task_enqueued in models.TaskEnqueued.all()
+        if task_enqueued.task_namespace == job._get_task_namespace()]
+    models.JobRun.record_tasks(
+        job.id,
+        succeeded=int(succeeded),
+        failed=int(not succeeded),
+        attempts=2,
+        queue_wait=1.5)
+    if succeeded:
+      job.task_succeeded(task_name)
+    else:
+      job.task_failed(task_name)
+
+  def test_records_runs_of_pipeline_and_jobs(self):
+    pipeline, (job1, job2) = self._create_pipeline()
+    self.assertTrue(pipeline.start())
+    pipeline_run, = models.PipelineRun.all()
+    self.assertEqual(pipeline_run.status, models.Pipeline.STATUS.RUNNING)
+    self.assertIsNone(pipeline_run.duration)
+    self._finish_task(job1)
+    self._finish_task(job2)
+    self.assertEqual(pipeline.status, models.Pipeline.STATUS.SUCCEEDED)
+    extensions.db.session.expire_all()
+    self.assertEqual(pipeline_run.status, models.Pipeline.STATUS.SUCCEEDED)
+    self.assertGreaterEqual(pipeline_run.duration, 0)
+    job_run1, job_run2 = pipeline_run.job_runs
+    self.assertEqual(job_run1.job_id, job1.id)
+    self.assertEqual(job_run1.name, 'job1')
+    self.assertEqual(job_run2.job_id, job2.id)
+    self.assertEqual(job_run2.status, models.Job.STATUS.SUCCEEDED)
+    self.assertEqual(job_run2.tasks_count, 1)
+    self.assertEqual(job_run2.task_attempts, 2)
+    self.assertEqual(job_run2.average_queue_wait, 1.5)
+
+  def test_records_failed_run(self):
+    pipeline, (job1, _) = self._create_pipeline()
+    self.assertTrue(pipeline.start())
+    self._finish_task(job1, succeeded=False)
+    self.assertEqual(pipeline.status, models.Pipeline.STATUS.FAILED)
+    extensions.db.session.expire_all()
+    pipeline_run, = models.PipelineRun.all()
+    self.assertEqual(pipeline_run.status, models.Pipeline.STATUS.FAILED)
+    job_run, = pipeline_run.job_runs
+    self.assertEqual(job_run.status, models.Job.STATUS.FAILED)
+    self.assertEqual(job_run.tasks_failed, 1)
+
+  def test_records_run_of_single_job(self):
+    pipeline, (_, job2) = self._create_pipeline()
+    self.assertTrue(pipeline.start_single_job(job2))
+    pipeline_run, = models.PipelineRun.all()
+    job_run, = pipeline_run.job_runs
+    self.assertEqual(job_run.job_id, job2.id)
+    self._finish_task(job2)
+    extensions.db.session.expire_all()
+    # Other jobs did not run, the pipeline is back to idle.
+    self.assertEqual(pipeline_run.status, models.Pipeline.STATUS.IDLE)
+    self.assertEqual(job_run.status, models.Job.STATUS.SUCCEEDED)
+
+  def test_destroy_deletes_runs(self):
+    pipeline, _ = self._create_pipeline()
+    self.assertTrue(pipeline.start())
+    pipeline.stop()
+    pipeline.destroy()
+    self.assertEqual(models.PipelineRun.query.count(), 0)
+    self.assertEqual(models.JobRun.query.count(), 0)
+
+
+class TestStatusEvents(ModelTestCase):
+
+  def _create_pipeline(self) -> tuple[models.Pipeline, list[models.Job]]:
+    pipeline = models.Pipeline.create(name='pipeline1')
+    job1 = models.Job.create(name='job1', pipeline_id=pipeline.id)
+    job2 = models.Job.create(name='job2', pipeline_id=pipeline.id)
+    models.StartCondition.create(
+        job_id=job2.id,
+        preceding_job_id=job1.id,
+        condition=models.StartCondition.CONDITION.SUCCESS)
+    return pipeline, [job1, job2]
+
+  def test_records_status_changes_on_start(self):
+    pipeline, (job1, job2) = self._create_pipeline()
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      self.assertTrue(pipeline.start())
+    self.assertEqual(counter.commits, 1)
+    events = [(event.job_id, event.status)
+              for event in models.StatusEvent.since(0)]
+    self.assertEqual(events, [
+        (None, models.Pipeline.STATUS.RUNNING),
+        (job1.id, models.Job.STATUS.WAITING),
+        (job2.id, models.Job.STATUS.WAITING),
+        (job1.id, models.Job.STATUS.RUNNING),
+    ])
+    self.assertTrue(all(
+        event.pipeline_id == pipeline.id
+        for event in models.StatusEvent.all()))
+
+  def test_since_resumes_from_cursor(self):
+    pipeline1, _ = self._create_pipeline()
+    pipeline2 = models.Pipeline.create(name='pipeline2')
+    pipeline1.set_status(models.Pipeline.STATUS.RUNNING)
+    pipeline2.set_status(models.Pipeline.STATUS.RUNNING)
+    pipeline1.set_status(models.Pipeline.STATUS.STOPPING)
+    models.Pipeline.commit()
+    cursor = models.StatusEvent.since(0)[0].id
+    self.assertEqual(
+        [event.pipeline_id for event in models.StatusEvent.since(cursor)],
+        [pipeline2.id, pipeline1.id])
+    self.assertEqual(
+        [event.status
+         for event in models.StatusEvent.since(cursor, pipeline1.id)],
+        [models.Pipeline.STATUS.STOPPING])
+    last_event = models.StatusEvent.since(cursor)[-1]
+    events_until = models.StatusEvent.since(cursor, until=last_event.id - 1)
+    self.assertEqual(
+        [event.pipeline_id for event in events_until], [pipeline2.id])
+
+  def test_last_id_precedes_events_possibly_committed_out_of_order(self):
+    pipeline, _ = self._create_pipeline()
+    settled_at = (datetime.datetime.utcnow() - models.StatusEvent.COMMIT_DELAY
+                  - datetime.timedelta(seconds=1))
+    settled_event = models.StatusEvent.create(
+        pipeline_id=pipeline.id, status='running', created_at=settled_at)
+    models.StatusEvent.create(pipeline_id=pipeline.id, status='succeeded')
+    self.assertEqual(models.StatusEvent.last_id(), settled_event.id)
+
+  def test_horizon_holds_back_events_following_a_missing_id(self):
+    pipeline, _ = self._create_pipeline()
+    event1 = models.StatusEvent.create(pipeline_id=pipeline.id, status='a')
+    # Event 2 is not committed yet, event 3 must not be read before it.
+    event3 = models.StatusEvent.create(
+        id=event1.id + 2, pipeline_id=pipeline.id, status='c')
+    self.assertEqual(models.StatusEvent.horizon(0), event1.id)
+    self.assertEqual(models.StatusEvent.horizon(event1.id), event1.id)
+    models.StatusEvent.create(
+        id=event1.id + 1, pipeline_id=pipeline.id, status='b')
+    self.assertEqual(models.StatusEvent.horizon(event1.id), event3.id)
+    # Event 4 was rolled back, event 5 is read once the delay has passed.
+    settled_at = (datetime.datetime.utcnow() - models.StatusEvent.COMMIT_DELAY
+                  - datetime.timedelta(seconds=1))
+    event5 = models.StatusEvent.create(
+        id=event3.id + 2, pipeline_id=pipeline.id, status='e',
+        created_at=settled_at)
+    self.assertEqual(models.StatusEvent.horizon(event3.id), event5.id)
+
+  def test_prune_deletes_expired_events(self):
+    pipeline, _ = self._create_pipeline()
+    expired_at = (datetime.datetime.utcnow() - models.StatusEvent.RETENTION
+                  - datetime.timedelta(minutes=1))
+    models.StatusEvent.create(
+        pipeline_id=pipeline.id, status='running', created_at=expired_at)
+    recent_event = models.StatusEvent.create(
+        pipeline_id=pipeline.id, status='succeeded')
+    self.assertEqual(models.StatusEvent.prune(), 1)
+    self.assertEqual(
+        [event.id for event in models.StatusEvent.all()], [recent_event.id])
+
+
+class TestUnitOfWork(ModelTestCase):
+
+  def test_commits_once(self):
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      with models.Pipeline.unit_of_work():
+        pipeline = models.Pipeline.create(name='pipeline1')
+        for i in range(5):
+          models.Job.create(name=f'job{i}', pipeline_id=pipeline.id)
+        pipeline.set_status(models.Pipeline.STATUS.RUNNING)
+    self.assertEqual(counter.commits, 1)
+    self.assertLen(models.Job.all(), 5)
+
+  def test_nested_units_of_work_commit_once(self):
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      with models.Pipeline.unit_of_work():
+        pipeline = models.Pipeline.create(name='pipeline1')
+        with models.Job.unit_of_work():
+          models.Job.create(name='job1', pipeline_id=pipeline.id)
+        self.assertEqual(counter.commits, 0)
+    self.assertEqual(counter.commits, 1)
+
+  def test_rolls_back_on_error(self):
+    with self.assertRaises(RuntimeError):
+      with models.Pipeline.unit_of_work():
+        models.Pipeline.create(name='pipeline1')
+        raise RuntimeError('Failed')
+    self.assertEmpty(models.Pipeline.all())
+
+  def test_publishes_tasks_after_commit(self):
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+    with models.Job.unit_of_work():
+      job.enqueue('BQWaiter', {})
+      self.patched_task_enqueue.assert_not_called()
+    self.patched_task_enqueue.assert_called_once()
+
+  def test_drops_tasks_on_rollback(self):
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+    with self.assertRaises(RuntimeError):
+      with models.Job.unit_of_work():
+        job.enqueue('BQWaiter', {})
+        raise RuntimeError('Failed')
+    self.patched_task_enqueue.assert_not_called()
+    self.assertEqual(models.TaskEnqueued.query.count(), 0)
+
+  def _create_pipeline(self, num_jobs: int) -> models.Pipeline:
+    pipeline = models.Pipeline.create(name='pipeline1')
+    for i in range(num_jobs):
+      job = models.Job.create(
+          name=f'job{i}', pipeline_id=pipeline.id, worker_class='BQWaiter')
+      models.Param.create(
+          job_id=job.id, name='job_id', type='string', value='{{ "foo" }}')
+    # Loads the pipeline in a new session, as the start endpoint does.
+    pipeline_id = pipeline.id
+    extensions.db.session.expunge_all()
+    return models.Pipeline.find(
+        pipeline_id, profile=mixins.LoadingProfile.STATE_MACHINE)
+
+  def test_start_pipeline_round_trips(self):
+    pipeline = self._create_pipeline(50)
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      self.assertTrue(pipeline.start())
+    self.assertEqual(counter.commits, 1)
+
+    # Same operation, committing on every change as before units of work.
+    pipeline = self._create_pipeline(50)
+    self.enter_context(
+        mock.patch.object(
+            mixins.ActiveRecordMixin,
+            'in_unit_of_work',
+            classmethod(lambda cls: False)))
+    with controller_utils.StatementCounter(
+        extensions.db.engine) as baseline_counter:
+      self.assertTrue(pipeline.start())
+
+    summary = (f'Starting 50 jobs: {counter.count} statements and '
+               f'{counter.commits} commit(s), instead of '
+               f'{baseline_counter.count} statements and '
+               f'{baseline_counter.commits} commits.')
+    round_trips = counter.count + counter.commits
+    baseline_round_trips = baseline_counter.count + baseline_counter.commits
+    self.assertLess(round_trips * 8, baseline_round_trips, summary)
+
+
+class TestDelayedTask(ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    metrics.reset()
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    self.job = models.Job.create(
+        pipeline_id=pipeline.id,
+        status=models.Job.STATUS.RUNNING,
+        worker_class='BQWaiter')
+
+  def test_delayed_enqueue_is_held_in_database(self):
+    task_enqueued = self.job.enqueue('BQWaiter', {'job_id': 'foo'}, delay=60)
+    self.patched_task_enqueue.assert_not_called()
+    delayed_task = models.DelayedTask.where(
+        task_name=task_enqueued.name).first()
+    self.assertIsNotNone(delayed_task)
+    self.assertEqual(self.job._enqueued_task_count(), 1)
+    self.assertEqual(metrics.get_all()['delayed_tasks_scheduled'], 1)
+    self.assertEqual(metrics.get_all()['delayed_tasks_bounces_avoided'], 1)
+
+  def test_delayed_enqueue_is_counted_once_committed(self):
+    attempts = []
+
+    def enqueue_with_conflict():
+      attempts.append(1)
+      self.job.enqueue('BQWaiter', {'job_id': 'foo'}, delay=60)
+      if len(attempts) == 1:
+        raise mixins.ConflictError('Concurrent update')
+
+    self.enter_context(mock.patch.object(time, 'sleep', autospec=True))
+    models.Job.run_with_retries(enqueue_with_conflict)
+    self.assertLen(attempts, 2)
+    self.assertEqual(models.DelayedTask.query.count(), 1)
+    self.assertEqual(metrics.get_all()['delayed_tasks_scheduled'], 1)
+    self.assertEqual(metrics.get_all()['delayed_tasks_bounces_avoided'], 1)
+
+  def test_enqueue_without_delay_is_published(self):
+    self.job.enqueue('BQWaiter', {'job_id': 'foo'})
+    self.patched_task_enqueue.assert_called_once()
+    self.assertEqual(models.DelayedTask.query.count(), 0)
+
+  def test_delayed_enqueue_is_published_if_transport_delays(self):
+    self.enter_context(
+        mock.patch.object(
+            message,
+            'supports_delayed_delivery',
+            autospec=True,
+            return_value=True))
+    self.job.enqueue('BQWaiter', {'job_id': 'foo'}, delay=60)
+    self.patched_task_enqueue.assert_called_once_with(mock.ANY, 60)
+    self.assertEqual(models.DelayedTask.query.count(), 0)
+
+  def test_enqueue_due_tasks_skips_tasks_not_due(self):
+    self.job.enqueue('BQWaiter', {'job_id': 'foo'}, delay=60)
+    self.assertEqual(models.DelayedTask.enqueue_due_tasks(), 0)
+    self.patched_task_enqueue.assert_not_called()
+    self.assertEqual(models.DelayedTask.query.count(), 1)
+
+  def test_enqueue_due_tasks_publishes_and_deletes_due_tasks(self):
+    task1 = self.job.enqueue('BQWaiter', {'job_id': 'foo'}, delay=60)
+    task2 = self.job.enqueue('BQWaiter', {'job_id': 'bar'}, delay=120)
+    now = datetime.datetime.utcnow() + datetime.timedelta(seconds=90)
+    self.assertEqual(models.DelayedTask.enqueue_due_tasks(now), 1)
+    self.patched_task_enqueue.assert_called_once()
+    published_task = self.patched_task_enqueue.call_args[0][0]
+    self.assertEqual(published_task.name, task1.name)
+    self.assertEqual(published_task.worker_params, {'job_id': 'foo'})
+    remaining_names = [t.task_name for t in models.DelayedTask.all()]
+    self.assertEqual(remaining_names, [task2.name])
+    self.assertEqual(metrics.get_all()['delayed_tasks_enqueued'], 1)
+
+  def test_enqueue_due_tasks_keeps_tasks_failing_to_publish(self):
+    failed_future = futures.Future()
+    failed_future.set_exception(TimeoutError())
+    transport = mock.Mock(supports_delayed_delivery=False)
+    transport.publish.return_value = failed_future
+    message.set_transport(transport)
+    self.addCleanup(message.set_transport, None)
+    self.patched_task_enqueue.side_effect = (
+        lambda task_inst, delay=0: message.send({}, 'TOPIC'))
+    patched_log = self.enter_context(
+        mock.patch.object(
+            crmint_logging, 'log_global_message', autospec=True))
+    self.job.enqueue('BQWaiter', {'job_id': 'foo'}, delay=60)
+    now = datetime.datetime.utcnow() + datetime.timedelta(seconds=90)
+    # Callers publish their own messages in a batch, the failure must be
+    # detected before leaving it.
+    with message.batch():
+      self.assertEqual(models.DelayedTask.enqueue_due_tasks(now), 0)
+      self.assertEqual(models.DelayedTask.query.count(), 1)
+    transport.publish.assert_called_once()
+    patched_log.assert_called_once_with(mock.ANY, log_level='ERROR')
+    self.assertNotIn('delayed_tasks_enqueued', metrics.get_all())
+
+
+class TestGeneralSettingsSnapshot(ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    models.GeneralSetting.create(name='client_id', value='foo')
+    models.GeneralSetting.create(name='client_secret', value='bar')
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    self.job = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+
+  def test_snapshot_is_cached_until_invalidated(self):
+    snapshot1 = models.GeneralSetting.snapshot()
+    models.GeneralSetting.where(name='client_id').first().update(value='baz')
+    self.assertIs(models.GeneralSetting.snapshot(), snapshot1)
+    models.GeneralSetting.invalidate_snapshot()
+    snapshot2 = models.GeneralSetting.snapshot()
+    self.assertNotEqual(snapshot2.version, snapshot1.version)
+    self.assertEqual(snapshot2.values['client_id'], 'baz')
+
+  def test_task_carries_only_settings_of_its_worker(self):
+    self.enter_context(
+        mock.patch.dict(global_settings.WORKER_GLOBAL_SETTINGS,
+                        {'FooWorker': ['client_id']}))
+    self.job.enqueue('FooWorker', {})
+    self.job.enqueue('BarWorker', {})
+    task1 = self.patched_task_enqueue.call_args_list[0][0][0]
+    task2 = self.patched_task_enqueue.call_args_list[1][0][0]
+    self.assertEqual(task1.general_settings, {'client_id': 'foo'})
+    self.assertEqual(task2.general_settings, {})
+    self.assertEqual(task1.general_settings_version,
+                     models.GeneralSetting.snapshot().version)
+
+
 if __name__ == '__main__':
   absltest.main()
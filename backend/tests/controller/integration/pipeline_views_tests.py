@@ -12,11 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import json
+import time
 from unittest import mock
 
 from absl.testing import absltest
+from absl.testing import parameterized
+from sqlalchemy import orm
 
 from common import crmint_logging
+from common import insight
+from controller import extensions
 from controller import models
 from tests import controller_utils
 
@@ -50,6 +57,15 @@ class TestPipelineViews(controller_utils.ControllerAppTest):
     self.assertEqual(response.status_code, 200)
     self.assertEqual(pipeline.status, models.Job.STATUS.RUNNING)
 
+  def test_start_pipeline_validates_params_on_demand(self):
+    pipeline = models.Pipeline.create()
+    job = models.Job.create(pipeline_id=pipeline.id)
+    models.Param.create(
+        job_id=job.id, name='p1', type='string', value='{{ missing }}')
+    response = self.client.post('/api/pipelines/1/start?validate_params=true')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(pipeline.status, models.Pipeline.STATUS.FAILED)
+
   def test_stop_pipeline(self):
     pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
     models.Job.create(pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
@@ -63,6 +79,43 @@ class TestPipelineViews(controller_utils.ControllerAppTest):
     response = self.client.get('/api/pipelines/1/export')
     self.assertEqual(response.status_code, 200)
 
+  def test_import_exported_pipeline(self):
+    pipeline = models.Pipeline.create(name='My Pipeline')
+    job1 = models.Job.create(pipeline_id=pipeline.id, name='j1')
+    job2 = models.Job.create(pipeline_id=pipeline.id, name='j2')
+    models.StartCondition.create(
+        job_id=job2.id, preceding_job_id=job1.id, condition='success')
+    exported = self.client.get('/api/pipelines/1/export')
+    response = self.client.post(
+        '/api/pipelines/import',
+        data={'upload_file': (io.BytesIO(exported.data), 'pipeline.json')})
+    self.assertEqual(response.status_code, 201)
+    imported = models.Pipeline.find(response.json['id'])
+    self.assertEqual(imported.name, 'My Pipeline')
+    self.assertEqual([job.name for job in imported.jobs], ['j1', 'j2'])
+    start_condition, = imported.jobs[1].start_conditions
+    self.assertEqual(start_condition.preceding_job_id, imported.jobs[0].id)
+
+  def test_import_invalid_pipeline_creates_nothing(self):
+    data = {
+        'name': 'My Pipeline',
+        'params': [],
+        'schedules': [],
+        'jobs': [{
+            'id': 'a',
+            'name': 'j1',
+            'hash_start_conditions': [
+                {'preceding_job_id': 'missing', 'condition': 'success'}],
+        }],
+    }
+    response = self.client.post(
+        '/api/pipelines/import',
+        data={'upload_file': (
+            io.BytesIO(json.dumps(data).encode()), 'pipeline.json')})
+    self.assertEqual(response.status_code, 400)
+    self.assertEmpty(models.Pipeline.all())
+    self.assertEmpty(models.Job.all())
+
   def test_enable_run_on_schedule(self):
     pipeline = models.Pipeline.create()
     response = self.client.patch(
@@ -85,5 +138,157 @@ class TestPipelineViews(controller_utils.ControllerAppTest):
     self.assertEqual(response.status_code, 200)
 
 
+class TestPipelineListConditionalGet(controller_utils.ControllerAppTest):
+
+  def setUp(self):
+    super().setUp()
+    self.enter_context(
+        mock.patch.object(insight, 'GAProvider', autospec=True))
+    self.pipeline = models.Pipeline.create(name='pipeline1')
+    models.Job.create(pipeline_id=self.pipeline.id)
+
+  def _etag(self):
+    response = self.client.get('/api/pipelines')
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('Last-Modified', response.headers)
+    return response.headers['ETag']
+
+  def test_unchanged_list_is_not_modified(self):
+    etag = self._etag()
+    with controller_utils.StatementCounter(extensions.db.engine) as counter:
+      response = self.client.get(
+          '/api/pipelines', headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response.headers['ETag'], etag)
+    self.assertEqual(response.data, b'')
+    # Only the change token is read.
+    self.assertEqual(counter.count, 1)
+
+  def test_status_change_modifies_list(self):
+    etag = self._etag()
+    self.pipeline.set_status(models.Pipeline.STATUS.RUNNING)
+    models.Pipeline.commit()
+    response = self.client.get(
+        '/api/pipelines', headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json[0]['status'], 'running')
+    self.assertNotEqual(response.headers['ETag'], etag)
+
+  @parameterized.named_parameters(
+      ('new_param', lambda pipeline: models.Param.create(
+          pipeline_id=pipeline.id, name='p1', type='string')),
+      ('new_schedule', lambda pipeline: models.Schedule.create(
+          pipeline_id=pipeline.id, cron='* * * * *')),
+      ('deleted_pipeline', lambda pipeline: pipeline.destroy()),
+  )
+  def test_change_modifies_list(self, change):
+    etag = self._etag()
+    change(self.pipeline)
+    response = self.client.get(
+        '/api/pipelines', headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 200)
+
+  def test_edits_within_a_second_modify_list(self):
+    param = models.Param.create(
+        pipeline_id=self.pipeline.id, name='p1', type='string', value='foo')
+    etag = self._etag()
+    # Update times of both edits are likely equal, with a second precision.
+    param.update(value='bar')
+    response = self.client.get(
+        '/api/pipelines', headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json[0]['params'][0]['value'], 'bar')
+
+  def test_enqueued_tasks_do_not_modify_list(self):
+    job = models.Job.first()
+    job.set_status(models.Job.STATUS.RUNNING)
+    models.Job.commit()
+    etag = self._etag()
+    job.enqueue('BQWaiter', {})
+    models.Job.commit()
+    self.assertEqual(job.running_tasks_count, 1)
+    response = self.client.get(
+        '/api/pipelines', headers={'If-None-Match': etag})
+    self.assertEqual(response.status_code, 304)
+
+
+class TestPipelineListLoading(controller_utils.ControllerAppTest):
+
+  def _create_pipelines(self, num_pipelines: int, num_jobs: int) -> None:
+    """Inserts pipelines with 2 schedules, 2 variables and chained jobs."""
+    session = extensions.db.session
+    session.execute(models.Pipeline.__table__.insert(), [
+        {'id': i + 1, 'name': f'pipeline{i}', 'status': 'idle',
+         'run_on_schedule': False}
+        for i in range(num_pipelines)])
+    session.execute(models.Schedule.__table__.insert(), [
+        {'pipeline_id': i + 1, 'cron': f'{j} * * * *'}
+        for i in range(num_pipelines) for j in range(2)])
+    session.execute(models.Param.__table__.insert(), [
+        {'pipeline_id': i + 1, 'name': f'var{j}', 'type': 'string',
+         'value': 'foo', 'is_required': False}
+        for i in range(num_pipelines) for j in range(2)])
+    session.execute(models.Job.__table__.insert(), [
+        {'id': i * num_jobs + j + 1, 'pipeline_id': i + 1, 'name': f'job{j}',
+         'worker_class': 'BQWaiter', 'status': 'idle'}
+        for i in range(num_pipelines) for j in range(num_jobs)])
+    session.execute(models.Param.__table__.insert(), [
+        {'job_id': job_id, 'name': f'param{j}', 'type': 'string',
+         'value': 'bar', 'is_required': False}
+        for job_id in range(1, num_pipelines * num_jobs + 1)
+        for j in range(2)])
+    session.execute(models.StartCondition.__table__.insert(), [
+        {'job_id': i * num_jobs + j + 2,
+         'preceding_job_id': i * num_jobs + j + 1,
+         'condition': 'success'}
+        for i in range(num_pipelines) for j in range(num_jobs - 1)])
+    session.commit()
+
+  def _list_pipelines(self) -> tuple[int, int, float]:
+    """Returns the rows, statements and seconds taken to list pipelines."""
+    extensions.db.session.expunge_all()
+    with controller_utils.RowCounter(extensions.db.engine) as row_counter:
+      with controller_utils.StatementCounter(
+          extensions.db.engine) as statement_counter:
+        start_time = time.perf_counter()
+        response = self.client.get('/api/pipelines')
+        duration = time.perf_counter() - start_time
+    self.assertEqual(response.status_code, 200)
+    self.assertLen(response.json, 500)
+    self.assertTrue(response.json[0]['has_jobs'])
+    self.assertLen(response.json[0]['schedules'], 2)
+    self.assertLen(response.json[0]['params'], 2)
+    return row_counter.rows, statement_counter.count, duration
+
+  def test_list_500_pipelines_with_20_jobs(self):
+    self._create_pipelines(500, 20)
+    rows, statements, duration = self._list_pipelines()
+
+    # Same listing with the relationships joined eagerly, as they used to be.
+    joined_options = [
+        orm.joinedload(models.Pipeline.schedules),
+        orm.joinedload(models.Pipeline.params),
+        orm.joinedload(models.Pipeline.jobs).options(
+            orm.joinedload(models.Job.params).defer(
+                models.Param.value).defer(models.Param.runtime_value),
+            orm.joinedload(models.Job.start_conditions)),
+    ]
+    with mock.patch.object(
+        models.Pipeline, 'loading_options', return_value=joined_options):
+      baseline_rows, baseline_statements, baseline_duration = (
+          self._list_pipelines())
+
+    summary = (f'Listing 500 pipelines with 20 jobs: {rows} rows, '
+               f'{statements} statements in {duration * 1000:.0f}ms, instead '
+               f'of {baseline_rows} rows, {baseline_statements} statements in '
+               f'{baseline_duration * 1000:.0f}ms.')
+    # The change token, then pipelines, their schedules, variables and job
+    # ids, without duplicates.
+    self.assertEqual(rows, 1 + 500 + 1000 + 1000 + 10000, summary)
+    self.assertEqual(statements, 5, summary)
+    self.assertLess(rows * 5, baseline_rows, summary)
+    self.assertLess(duration, baseline_duration, summary)
+
+
 if __name__ == '__main__':
   absltest.main()
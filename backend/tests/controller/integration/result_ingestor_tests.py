@@ -0,0 +1,210 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for controller.result.ingestor."""
+
+import json
+import threading
+import time
+import types
+from unittest import mock
+
+from absl.testing import absltest
+
+from common import crmint_logging
+from common import result
+from common import task
+from controller import extensions
+from controller import mixins
+from controller import models
+from controller.result import ingestor
+from controller.result import views
+from tests import controller_utils
+
+_SUBSCRIPTION_PATH = 'projects/PROJECT/subscriptions/SUBSCRIPTION'
+
+
+def _make_received_message(index, data):
+  return types.SimpleNamespace(
+      ack_id=f'ack-{index}',
+      message=types.SimpleNamespace(
+          message_id=f'message-{index}',
+          data=json.dumps(data).encode('utf-8'),
+          attributes={'start_time': str(int(time.time()) - 10)}))
+
+
+class _FakeSubscriber:
+  """Subscriber returning the queued messages in batches."""
+
+  def __init__(self, data_list):
+    self.received_messages = [
+        _make_received_message(i, data) for i, data in enumerate(data_list)]
+    self.ack_ids = []
+
+  def subscription_path(self, project, subscription):
+    del project, subscription  # Unused argument
+    return _SUBSCRIPTION_PATH
+
+  def pull(self, request, timeout):
+    del timeout  # Unused argument
+    max_messages = request['max_messages']
+    batch = self.received_messages[:max_messages]
+    self.received_messages = self.received_messages[max_messages:]
+    return types.SimpleNamespace(received_messages=batch)
+
+  def acknowledge(self, request):
+    self.ack_ids.extend(request['ack_ids'])
+
+
+class ResultIngestorTest(controller_utils.ModelTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.enter_context(
+        mock.patch.object(task.Task, 'enqueue', autospec=True))
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_message', autospec=True))
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_global_message', autospec=True))
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_pipeline_status', autospec=True))
+    self.pipeline = models.Pipeline.create(
+        status=models.Pipeline.STATUS.RUNNING)
+
+  def _start_fan_out(self, num_tasks):
+    """Returns a running job and the result data of its tasks."""
+    job = models.Job.create(
+        pipeline_id=self.pipeline.id, status=models.Job.STATUS.RUNNING)
+    task_names = [job.enqueue('Processor', {}).name for _ in range(num_tasks)]
+    data_list = [
+        {
+            'task_name': task_name,
+            'job_id': job.id,
+            'success': True,
+            'workers_to_enqueue': [],
+        }
+        for task_name in task_names
+    ]
+    return job, data_list
+
+  def test_ingests_results_in_batches(self):
+    job, data_list = self._start_fan_out(25)
+    subscriber = _FakeSubscriber(data_list)
+    self.assertEqual(
+        ingestor.ingest_batch(subscriber, _SUBSCRIPTION_PATH, 20), 20)
+    self.assertEqual(job.status, models.Job.STATUS.RUNNING)
+    self.assertEqual(job._enqueued_task_count(), 5)
+    self.assertEqual(
+        ingestor.ingest_batch(subscriber, _SUBSCRIPTION_PATH, 20), 5)
+    self.assertEqual(job.status, models.Job.STATUS.SUCCEEDED)
+    self.assertLen(subscriber.ack_ids, 25)
+
+  def test_duplicates_and_invalid_messages_are_acknowledged(self):
+    job, data_list = self._start_fan_out(2)
+    subscriber = _FakeSubscriber(data_list + data_list[:1])
+    subscriber.received_messages.append(
+        types.SimpleNamespace(
+            ack_id='ack-invalid',
+            message=types.SimpleNamespace(
+                message_id='message-invalid', data=b'not json',
+                attributes={'start_time': '0'})))
+    ingestor.ingest_batch(subscriber, _SUBSCRIPTION_PATH, 10)
+    self.assertLen(subscriber.ack_ids, 4)
+    self.assertEqual(job.status, models.Job.STATUS.SUCCEEDED)
+
+  def test_last_result_status_is_applied(self):
+    job, data_list = self._start_fan_out(2)
+    data_list[-1]['success'] = False
+    views.process_results(
+        [result.Result.from_data(data) for data in data_list])
+    self.assertEqual(job.status, models.Job.STATUS.FAILED)
+
+  def test_run_reports_throughput(self):
+    _, data_list = self._start_fan_out(10)
+    subscriber = _FakeSubscriber(data_list)
+    stop_event = threading.Event()
+    original_pull = subscriber.pull
+
+    def pull(request, timeout):
+      response = original_pull(request, timeout)
+      if not response.received_messages:
+        stop_event.set()
+      return response
+
+    subscriber.pull = pull
+    stats = ingestor.run(subscriber, stop_event)
+    self.assertEqual(stats.results, 10)
+    self.assertGreater(stats.results_per_second, 0)
+
+  def test_run_survives_failing_batches(self):
+    job, data_list = self._start_fan_out(4)
+    subscriber = _FakeSubscriber(data_list)
+    stop_event = threading.Event()
+    original_pull = subscriber.pull
+
+    def pull(request, timeout):
+      response = original_pull(dict(request, max_messages=2), timeout)
+      if not response.received_messages:
+        stop_event.set()
+      return response
+
+    subscriber.pull = pull
+    original_process_results = views.process_results
+    calls = []
+
+    def process_results(results):
+      calls.append(results)
+      if len(calls) == 1:
+        raise mixins.ConflictError('Concurrent update')
+      return original_process_results(results)
+
+    self.enter_context(mock.patch.object(ingestor, '_RETRY_DELAY', 0))
+    self.enter_context(
+        mock.patch.object(views, 'process_results', new=process_results))
+    stats = ingestor.run(subscriber, stop_event)
+    self.assertLen(calls, 2)
+    self.assertEqual(stats.results, 2)
+    # Messages of the failed batch are left to be redelivered.
+    self.assertEqual(subscriber.ack_ids, ['ack-2', 'ack-3'])
+    crmint_logging.log_global_message.assert_any_call(
+        mock.ANY, log_level='ERROR')
+    self.assertEqual(job._enqueued_task_count(), 2)
+
+  def test_batched_ingestion_runs_fewer_statements(self):
+    """Compares per-result and batched processing of a 200 tasks fan-out."""
+    num_tasks = 200
+    _, data_list = self._start_fan_out(num_tasks)
+    engine = extensions.db.engine
+    with controller_utils.StatementCounter(engine) as single_counter:
+      start_time = time.monotonic()
+      for data in data_list:
+        views.process_result(result.Result.from_data(data))
+      single_rate = num_tasks / (time.monotonic() - start_time)
+
+    _, data_list = self._start_fan_out(num_tasks)
+    with controller_utils.StatementCounter(engine) as batch_counter:
+      start_time = time.monotonic()
+      views.process_results(
+          [result.Result.from_data(data) for data in data_list])
+      batch_rate = num_tasks / (time.monotonic() - start_time)
+
+    summary = (f'Per result: {single_rate:.0f} results/s, '
+               f'{single_counter.count} statements. '
+               f'Batched: {batch_rate:.0f} results/s, '
+               f'{batch_counter.count} statements.')
+    self.assertLess(batch_counter.count * 20, single_counter.count, summary)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import base64
+import datetime
 import json
 from typing import Any, Tuple
 from unittest import mock
@@ -104,6 +105,46 @@ class TestResultViews(controller_utils.ControllerAppTest):
     self.assertEqual(job1.status, expected_job_status)
     self.assertEqual(job1._enqueued_task_count(), expected_enqueing_count)
 
+  def test_duplicate_result_is_ignored(self):
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_pipeline_status', autospec=True))
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job1 = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.WAITING)
+    task1 = job1.start()
+    payload = _create_pubsub_encoded_result_payload(
+        task_name=task1.name,
+        success=True,
+        workers_to_enqueue=[('WorkerA', {}, 0)])
+    # Pub/Sub redelivers the same result.
+    for _ in range(2):
+      response = self.client.post('/push/task-finished', json=payload)
+      self.assertEqual(response.status_code, 200)
+    self.assertEqual(job1.status, models.Job.STATUS.RUNNING)
+    self.assertEqual(job1._enqueued_task_count(), 1)
+
+  def test_heartbeat_is_recorded_on_running_task(self):
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job1 = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.WAITING)
+    task1 = job1.start()
+    self.assertIsNone(task1.last_heartbeat_at)
+    data = {'task_name': task1.name, 'job_id': job1.id}
+    data_encoded = base64.b64encode(json.dumps(data).encode('utf8'))
+    payload = {
+        'message': {
+            'attributes': {
+                'start_time': 1434636430,  # 9 seconds before freeze time
+            },
+            'data': data_encoded.decode('utf8'),
+        }
+    }
+    response = self.client.post('/push/task-heartbeat', json=payload)
+    self.assertEqual(response.status_code, 200)
+    models.TaskEnqueued.session.refresh(task1)
+    self.assertEqual(task1.last_heartbeat_at,
+                     datetime.datetime(2015, 6, 18, 16, 7, 19))
+
 
 if __name__ == '__main__':
   absltest.main()
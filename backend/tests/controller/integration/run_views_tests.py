@@ -0,0 +1,91 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from absl.testing import absltest
+
+from controller import models
+from tests import controller_utils
+
+
+class TestRunViews(controller_utils.ControllerAppTest):
+
+  def setUp(self):
+    super().setUp()
+    self.pipeline = models.Pipeline.create(name='pipeline1')
+    self.job = models.Job.create(
+        name='job1', pipeline_id=self.pipeline.id, worker_class='BQWaiter')
+    started_at = datetime.datetime(2023, 6, 1, 12, 0, 0)
+    for i in range(3):
+      pipeline_run = models.PipelineRun.create(
+          pipeline_id=self.pipeline.id,
+          status=models.Pipeline.STATUS.SUCCEEDED,
+          started_at=started_at,
+          finished_at=started_at + datetime.timedelta(seconds=10 + i))
+      models.JobRun.create(
+          pipeline_run_id=pipeline_run.id,
+          job_id=self.job.id,
+          name=self.job.name,
+          worker_class=self.job.worker_class,
+          status=models.Job.STATUS.SUCCEEDED,
+          started_at=started_at,
+          finished_at=started_at + datetime.timedelta(seconds=5),
+          tasks_succeeded=2,
+          tasks_failed=0,
+          task_attempts=3,
+          queue_wait=4.0)
+
+  def test_list_pipeline_runs_most_recent_first(self):
+    response = self.client.get(
+        f'/api/pipelines/{self.pipeline.id}/runs?per_page=2')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json['total'], 3)
+    self.assertEqual(response.json['pages'], 2)
+    self.assertEqual([run['duration'] for run in response.json['runs']],
+                     [12.0, 11.0])
+    response = self.client.get(
+        f'/api/pipelines/{self.pipeline.id}/runs?per_page=2&page=2')
+    self.assertEqual([run['duration'] for run in response.json['runs']],
+                     [10.0])
+
+  def test_list_rejects_invalid_page_size(self):
+    response = self.client.get(
+        f'/api/pipelines/{self.pipeline.id}/runs?per_page=1000')
+    self.assertEqual(response.status_code, 400)
+
+  def test_retrieve_pipeline_run_with_job_runs(self):
+    response = self.client.get(f'/api/pipelines/{self.pipeline.id}/runs/1')
+    self.assertEqual(response.status_code, 200)
+    job_run, = response.json['job_runs']
+    self.assertEqual(job_run['name'], 'job1')
+    self.assertEqual(job_run['duration'], 5.0)
+    self.assertEqual(job_run['tasks_count'], 2)
+    self.assertEqual(job_run['average_queue_wait'], 2.0)
+
+  def test_missing_pipeline_run(self):
+    other_pipeline = models.Pipeline.create()
+    response = self.client.get(f'/api/pipelines/{other_pipeline.id}/runs/1')
+    self.assertEqual(response.status_code, 404)
+
+  def test_list_job_runs(self):
+    response = self.client.get(f'/api/jobs/{self.job.id}/runs')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json['total'], 3)
+    self.assertLen(response.json['runs'], 3)
+    self.assertEqual(response.json['runs'][0]['task_attempts'], 3)
+
+
+if __name__ == '__main__':
+  absltest.main()
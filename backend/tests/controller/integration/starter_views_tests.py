@@ -14,11 +14,14 @@
 
 import base64
 import json
+from unittest import mock
 
 from absl.testing import absltest
 from absl.testing import parameterized
 import freezegun
 
+from common import task
+from controller import mixins
 from controller import models
 from tests import controller_utils
 
@@ -72,5 +75,72 @@ class TestStarterViews(controller_utils.ControllerAppTest):
     self.assertEqual(pipeline.status, pipeline_status)
 
 
+  def test_scheduler_tick_publishes_due_delayed_tasks(self):
+    pipeline = models.Pipeline.create(status=models.Pipeline.STATUS.RUNNING)
+    job = models.Job.create(
+        pipeline_id=pipeline.id, status=models.Job.STATUS.RUNNING)
+    with freezegun.freeze_time('2015-06-18T16:06:10'):
+      job.enqueue('BQWaiter', {}, delay=60)
+    self.assertEqual(models.DelayedTask.query.count(), 1)
+    with freezegun.freeze_time('2015-06-18T16:07:19'):
+      data = {
+          'pipeline_ids': 'scheduled',
+      }
+      data_encoded = base64.b64encode(json.dumps(data).encode('utf8'))
+      payload = {
+          'message': {
+              'attributes': {
+                  'start_time': 1434636430,  # 9 seconds ago
+              },
+              'data': data_encoded.decode('utf8'),
+          }
+      }
+      response = self.client.post('/push/start-pipeline', json=payload)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(models.DelayedTask.query.count(), 0)
+    # Patched by `tests.utils.AppTestCase`.
+    task.Task.enqueue.assert_called_once()
+
+  @freezegun.freeze_time('2015-06-18T16:07:19')
+  def test_conflict_does_not_stop_other_scheduled_pipelines(self):
+    pipelines = []
+    for _ in range(2):
+      pipeline = models.Pipeline.create(run_on_schedule=True)
+      models.Job.create(pipeline_id=pipeline.id)
+      models.Schedule.create(pipeline_id=pipeline.id, cron='7 16 * * *')
+      pipelines.append(pipeline)
+    conflicting_pipeline_id = pipelines[0].id
+    original_start = models.Pipeline.start
+
+    def start(pipeline, *args, **kwargs):
+      if pipeline.id == conflicting_pipeline_id:
+        raise mixins.ConflictError('Concurrent update')
+      return original_start(pipeline, *args, **kwargs)
+
+    self.enter_context(mock.patch.object(models.Pipeline, 'start', new=start))
+    data = {
+        'pipeline_ids': 'scheduled',
+    }
+    data_encoded = base64.b64encode(json.dumps(data).encode('utf8'))
+    payload = {
+        'message': {
+            'attributes': {
+                'start_time': 1434636430,  # 9 seconds ago
+            },
+            'data': data_encoded.decode('utf8'),
+        }
+    }
+    response = self.client.post('/push/start-pipeline', json=payload)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(pipelines[0].status, models.Pipeline.STATUS.IDLE)
+    self.assertEqual(pipelines[1].status, models.Pipeline.STATUS.RUNNING)
+    self.patched_log_message.assert_any_call(
+        mock.ANY,
+        log_level='ERROR',
+        worker_class='N/A',
+        pipeline_id=conflicting_pipeline_id,
+        job_id=0)
+
+
 if __name__ == '__main__':
   absltest.main()
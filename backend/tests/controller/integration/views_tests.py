@@ -17,6 +17,8 @@ from unittest import mock
 from absl.testing import absltest
 
 from controller import ads_auth_code
+from controller import inline
+from controller import metrics
 from controller import models
 from tests import controller_utils
 
@@ -72,6 +74,36 @@ class TestViews(controller_utils.ControllerAppTest):
         name='google_ads_refresh_token').first()
     self.assertEqual(ads_token_setting.value, 'new-token')
 
+  def test_update_general_settings_invalidates_snapshot(self):
+    models.GeneralSetting.snapshot()
+    payload = {
+        'settings': [
+            {
+                'name': 'google_ads_authentication_code',
+                'type': 'string',
+                'value': '',
+            },
+            {
+                'name': 'client_id',
+                'type': 'string',
+                'value': 'new-client-id',
+            },
+        ]
+    }
+    response = self.client.put('/api/general_settings', json=payload)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+        models.GeneralSetting.snapshot().values['client_id'], 'new-client-id')
+
+  def test_retrieve_metrics(self):
+    metrics.reset()
+    metrics.increment('delayed_tasks_scheduled', 2)
+    response = self.client.get('/api/metrics')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+        response.json,
+        {'delayed_tasks_scheduled': 2, 'delayed_tasks_pending': 0})
+
   def test_reset_statuses_expect_post(self):
     response = self.client.get('/api/reset/statuses')
     self.assertEqual(response.status_code, 405)
@@ -80,6 +112,16 @@ class TestViews(controller_utils.ControllerAppTest):
     response = self.client.post('/api/reset/statuses')
     self.assertEqual(response.status_code, 200)
 
+  @mock.patch.object(inline, 'invalidate_bigquery_cache', autospec=True)
+  def test_can_reset_inline_cache(self, patched_invalidate):
+    response = self.client.post('/api/reset/inline_cache')
+    self.assertEqual(response.status_code, 200)
+    patched_invalidate.assert_called_once_with(None)
+    response = self.client.post(
+        '/api/reset/inline_cache?table_id=prj.ds.config')
+    self.assertEqual(response.status_code, 200)
+    patched_invalidate.assert_called_with('prj.ds.config')
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,76 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from absl.testing import absltest
+
+from controller import dag
+
+
+class TestPipelineDag(absltest.TestCase):
+
+  def test_build_indexes_edges(self):
+    # 1 -> 3, 2 -> 3, 3 -> 4 and 5 isolated.
+    edges = [
+        dag.Edge(3, 4, 'success'),
+        dag.Edge(1, 3, 'success'),
+        dag.Edge(2, 3, 'fail'),
+    ]
+    pipeline_dag = dag.PipelineDag.build(1, [5, 4, 3, 2, 1], edges)
+    self.assertEqual(pipeline_dag.order, (1, 2, 5, 3, 4))
+    self.assertEqual(pipeline_dag.leaves, {4, 5})
+    self.assertEqual(pipeline_dag.dependents_of(1), (3,))
+    self.assertEqual(pipeline_dag.dependents_of(4), ())
+    self.assertEqual(
+        pipeline_dag.start_conditions_of(3),
+        (dag.Edge(1, 3, 'success'), dag.Edge(2, 3, 'fail')))
+    self.assertEqual(pipeline_dag.start_conditions_of(1), ())
+
+  def test_build_puts_cycles_last(self):
+    edges = [dag.Edge(2, 3, 'success'), dag.Edge(3, 2, 'success')]
+    pipeline_dag = dag.PipelineDag.build(1, [1, 2, 3], edges)
+    self.assertEqual(pipeline_dag.order, (1, 2, 3))
+    self.assertEqual(pipeline_dag.leaves, {1})
+
+
+class TestDagCache(absltest.TestCase):
+
+  def test_loads_once_per_revision(self):
+    cache = dag.DagCache()
+    load = mock.Mock(
+        side_effect=lambda: dag.PipelineDag.build(1, [1], []))
+    cache.get(1, 1, load)
+    cache.get(1, 1, load)
+    self.assertEqual(load.call_count, 1)
+    load.side_effect = lambda: dag.PipelineDag.build(2, [1], [])
+    self.assertEqual(cache.get(1, 2, load).revision, 2)
+    self.assertEqual(load.call_count, 2)
+
+  def test_evicts_least_recently_used(self):
+    cache = dag.DagCache(max_size=2)
+    load = mock.Mock(
+        side_effect=lambda: dag.PipelineDag.build(1, [1], []))
+    cache.get(1, 1, load)
+    cache.get(2, 1, load)
+    cache.get(1, 1, load)
+    cache.get(3, 1, load)  # Evicts pipeline 2.
+    cache.get(1, 1, load)
+    self.assertEqual(load.call_count, 3)
+    cache.get(2, 1, load)
+    self.assertEqual(load.call_count, 4)
+
+
+if __name__ == '__main__':
+  absltest.main()
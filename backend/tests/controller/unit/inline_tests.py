@@ -12,8 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+from unittest import mock
+
 from absl.testing import absltest
 import freezegun
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
 
 from controller import inline
 
@@ -49,5 +54,128 @@ class TestFunctions(absltest.TestCase):
     self.assertEqual(func('2018-03-29', '%Y-%m-%d'), 3)
 
 
+
+class TestBigQueryFunction(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.patched_client = self.enter_context(
+        mock.patch.object(bigquery, 'Client', autospec=True))
+    self.list_rows = self.patched_client.return_value.list_rows
+    self.list_rows.side_effect = self._list_rows
+    self.tables = {
+        'prj.ds.config': [
+            bigquery.Row(('us', [1, 2]), {'country': 0, 'ids': 1})],
+        'prj.ds.other': [bigquery.Row(('fr',), {'country': 0})],
+        'prj.ds.empty': [],
+    }
+    self.enter_context(
+        mock.patch.object(inline, '_bq_cache', inline._TableCache(ttl=60)))
+    inline.open_session()
+    self.addCleanup(inline.close_session)
+
+  def _list_rows(self, table_id, max_results):
+    del max_results  # Unused argument
+    try:
+      return self.tables[table_id]
+    except KeyError:
+      raise NotFound(table_id) from None
+
+  def _start_new_session(self):
+    inline.close_session()
+    inline.open_session()
+
+  def test_reads_first_row(self):
+    func = inline.functions['bigquery']
+    self.assertEqual(func('prj.ds.config', 'country'), 'us')
+    self.assertEqual(func('prj.ds.config', 'ids'), '1\n2')
+    self.list_rows.assert_called_once_with('prj.ds.config', max_results=1)
+
+  def test_reports_missing_tables_and_fields(self):
+    func = inline.functions['bigquery']
+    with self.assertRaisesRegex(ValueError, 'not found'):
+      func('prj.ds.missing', 'country')
+    with self.assertRaisesRegex(ValueError, 'is empty'):
+      func('prj.ds.empty', 'country')
+    with self.assertRaisesRegex(ValueError, "No field 'city'"):
+      func('prj.ds.config', 'city')
+
+  def test_shares_rows_across_sessions(self):
+    func = inline.functions['bigquery']
+    func('prj.ds.config', 'country')
+    self._start_new_session()
+    self.assertEqual(func('prj.ds.config', 'country'), 'us')
+    self.assertEqual(self.list_rows.call_count, 1)
+
+  def test_fetches_rows_again_once_expired(self):
+    func = inline.functions['bigquery']
+    with freezegun.freeze_time('2023-06-01T00:00:00') as frozen_time:
+      func('prj.ds.config', 'country')
+      self.tables['prj.ds.config'] = [bigquery.Row(('ca',), {'country': 0})]
+      frozen_time.tick(59)
+      self._start_new_session()
+      self.assertEqual(func('prj.ds.config', 'country'), 'us')
+      frozen_time.tick(1)
+      self._start_new_session()
+      self.assertEqual(func('prj.ds.config', 'country'), 'ca')
+    self.assertEqual(self.list_rows.call_count, 2)
+
+  def test_fetches_rows_again_once_invalidated(self):
+    func = inline.functions['bigquery']
+    func('prj.ds.config', 'country')
+    func('prj.ds.other', 'country')
+    inline.invalidate_bigquery_cache('prj.ds.config')
+    # Sessions open keep the rows they read.
+    self.assertEqual(func('prj.ds.config', 'country'), 'us')
+    self._start_new_session()
+    func('prj.ds.config', 'country')
+    func('prj.ds.other', 'country')
+    self.assertEqual(self.list_rows.call_count, 3)
+    inline.invalidate_bigquery_cache()
+    self._start_new_session()
+    func('prj.ds.config', 'country')
+    func('prj.ds.other', 'country')
+    self.assertEqual(self.list_rows.call_count, 5)
+
+  def test_sessions_are_per_thread(self):
+
+    def render_in_another_session():
+      inline.open_session()
+      inline.functions['bigquery']('prj.ds.other', 'country')
+      inline.close_session()
+
+    thread = threading.Thread(target=render_in_another_session)
+    thread.start()
+    thread.join()
+    # The session of this thread is still open.
+    self.assertEqual(inline.functions['bigquery']('prj.ds.config', 'ids'),
+                     '1\n2')
+
+  def test_prefetches_tables_concurrently(self):
+    # Both fetches must be in flight at the same time to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def list_rows(table_id, max_results):
+      barrier.wait()
+      return self._list_rows(table_id, max_results)
+
+    self.list_rows.side_effect = list_rows
+    inline.prefetch_bigquery_tables(
+        ['prj.ds.config', 'prj.ds.other', 'prj.ds.config'])
+    self.assertEqual(self.list_rows.call_count, 2)
+    self.list_rows.side_effect = self._list_rows
+    func = inline.functions['bigquery']
+    self.assertEqual(func('prj.ds.config', 'country'), 'us')
+    self.assertEqual(func('prj.ds.other', 'country'), 'fr')
+    self.assertEqual(self.list_rows.call_count, 2)
+
+  def test_prefetch_leaves_errors_to_rendering(self):
+    inline.prefetch_bigquery_tables(['prj.ds.missing', 'prj.ds.config'])
+    inline.prefetch_bigquery_tables(['prj.ds.config'])
+    self.assertEqual(self.list_rows.call_count, 2)
+    with self.assertRaisesRegex(ValueError, 'not found'):
+      inline.functions['bigquery']('prj.ds.missing', 'country')
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -19,29 +19,100 @@ from unittest import mock
 
 from absl.testing import parameterized
 import flask
+import sqlalchemy
 
 from controller import app
 from controller import database
 from controller import extensions
+from controller import models
 from tests import utils
 
 
+class StatementCounter:
+  """Counts SQL statements and commits executed by an engine."""
+
+  def __init__(self, engine):
+    self.count = 0
+    self.commits = 0
+    self.statements = []
+    self._engine = engine
+
+  def _increment(self, conn, cursor, statement, *args, **kwargs):
+    del conn, cursor, args, kwargs  # Unused argument
+    self.count += 1
+    self.statements.append(statement)
+
+  def _increment_commits(self, *args, **kwargs):
+    del args, kwargs  # Unused argument
+    self.commits += 1
+
+  def __enter__(self):
+    sqlalchemy.event.listen(
+        self._engine, 'before_cursor_execute', self._increment)
+    sqlalchemy.event.listen(self._engine, 'commit', self._increment_commits)
+    return self
+
+  def __exit__(self, *args):
+    sqlalchemy.event.remove(
+        self._engine, 'before_cursor_execute', self._increment)
+    sqlalchemy.event.remove(self._engine, 'commit', self._increment_commits)
+
+
+class RowCounter:
+  """Counts rows fetched by the queries executed through an engine.
+
+  Queries are recorded while counting and executed again to count their rows,
+  since the database driver does not tell it up front.
+  """
+
+  def __init__(self, engine):
+    self.rows = 0
+    self._engine = engine
+    self._queries = []
+
+  def _record(self, conn, cursor, statement, parameters, context,
+              executemany):
+    del conn, cursor, context  # Unused argument
+    if not executemany and statement.lstrip().upper().startswith('SELECT'):
+      self._queries.append((statement, parameters))
+
+  def __enter__(self):
+    sqlalchemy.event.listen(self._engine, 'before_cursor_execute', self._record)
+    return self
+
+  def __exit__(self, *args):
+    sqlalchemy.event.remove(self._engine, 'before_cursor_execute', self._record)
+    connection = self._engine.raw_connection()
+    try:
+      cursor = connection.cursor()
+      for statement, parameters in self._queries:
+        cursor.execute(statement, parameters)
+        self.rows += len(cursor.fetchall())
+    finally:
+      connection.close()
+
+
 class ModelTestCase(parameterized.TestCase):
   """Base class for model testing."""
 
+  database_uri = 'sqlite:///:memory:'
+
   def setUp(self):
     super().setUp()
     # Pushes an application context manually.
     test_app = flask.Flask(__name__)
     test_app.config['TESTING'] = True
     test_app.config['PRESERVE_CONTEXT_ON_EXCEPTION'] = False
-    test_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    test_app.config['SQLALCHEMY_DATABASE_URI'] = self.database_uri
     test_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     extensions.db.init_app(test_app)
+    self.app = test_app
     self.ctx = test_app.app_context()
     self.ctx.push()
     # Creates tables & loads seed data
     extensions.db.create_all()
+    models.GeneralSetting.invalidate_snapshot()
+    models.Pipeline.invalidate_dag_cache()
 
   def tearDown(self):
     super().tearDown()
@@ -12,10 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import json
+import time
+from unittest import mock
+
+from jobs import task_runner
+import jobs_app
 from jobs_app import app
 from tests import utils
 
 
+def _make_start_task_payload(task_name):
+  data = {
+      'task_name': task_name,
+      'pipeline_id': 1,
+      'job_id': 2,
+      'worker_class': 'Commenter',
+      'worker_params': {},
+      'general_settings': {},
+      'attempts': 1,
+  }
+  data_encoded = base64.b64encode(json.dumps(data).encode('utf8'))
+  return {
+      'message': {
+          'attributes': {'start_time': str(int(time.time()) - 10)},
+          'data': data_encoded.decode('utf8'),
+      }
+  }
+
+
 class TestJobsApp(utils.AppTestCase):
 
   def create_app(self):
@@ -27,3 +53,30 @@ class TestJobsApp(utils.AppTestCase):
   def test_root_accessible(self):
     response = self.client.get('/api/workers')
     self.assertEqual(response.status_code, 200)
+
+  def test_start_task_runs_in_background(self):
+    self.enter_context(
+        mock.patch.object(jobs_app, '_BACKGROUND_EXECUTION', True))
+    patched_run = self.enter_context(
+        mock.patch.object(task_runner, 'run', autospec=True))
+    response = self.client.post(
+        '/push/start-task',
+        json=_make_start_task_payload('TASK'),
+        base_url='http://localhost:8081')
+    self.assertEqual(response.status_code, 202)
+    jobs_app._executor.submit(lambda: None).result()  # Waits for the task.
+    patched_run.assert_called_once()
+    self.assertEqual(patched_run.call_args[0][0].name, 'TASK')
+
+  def test_start_task_is_retried_if_workers_are_busy(self):
+    self.enter_context(
+        mock.patch.object(jobs_app, '_BACKGROUND_EXECUTION', True))
+    self.enter_context(mock.patch.object(task_runner, 'run', autospec=True))
+    self.enter_context(
+        mock.patch.object(
+            jobs_app._free_workers, 'acquire', return_value=False))
+    response = self.client.post(
+        '/push/start-task',
+        json=_make_start_task_payload('TASK'),
+        base_url='http://localhost:8081')
+    self.assertEqual(response.status_code, 429)
@@ -0,0 +1,94 @@
+"""Tests for jobs_subscriber."""
+
+import json
+import time
+from unittest import mock
+
+from absl.testing import absltest
+from google.cloud import pubsub_v1
+
+from common import crmint_logging
+from jobs import task_ledger
+from jobs import task_runner
+import jobs_subscriber
+
+
+def _make_pubsub_message(data, delay=0):
+  pubsub_message = mock.create_autospec(
+      pubsub_v1.subscriber.message.Message, instance=True)
+  pubsub_message.data = json.dumps(data).encode('utf-8')
+  pubsub_message.attributes = {'start_time': str(int(time.time()) + delay)}
+  pubsub_message.message_id = 'MESSAGE_ID'
+  return pubsub_message
+
+
+_TASK_DATA = {
+    'task_name': 'TASK',
+    'pipeline_id': 1,
+    'job_id': 2,
+    'worker_class': 'Commenter',
+    'worker_params': {},
+    'general_settings': {},
+    'attempts': 1,
+}
+
+
+class JobsSubscriberTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.patched_run = self.enter_context(
+        mock.patch.object(task_runner, 'run', autospec=True))
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_global_message', autospec=True))
+
+  def test_acks_after_running_task(self):
+    pubsub_message = _make_pubsub_message(_TASK_DATA)
+    jobs_subscriber.handle_message(pubsub_message)
+    self.patched_run.assert_called_once()
+    self.assertEqual(self.patched_run.call_args[0][0].name, 'TASK')
+    pubsub_message.ack.assert_called_once()
+    pubsub_message.nack.assert_not_called()
+
+  def test_nacks_delayed_message(self):
+    pubsub_message = _make_pubsub_message(_TASK_DATA, delay=3600)
+    jobs_subscriber.handle_message(pubsub_message)
+    self.patched_run.assert_not_called()
+    pubsub_message.nack.assert_called_once()
+
+  def test_drops_invalid_message(self):
+    pubsub_message = _make_pubsub_message(_TASK_DATA)
+    pubsub_message.data = b'not json'
+    jobs_subscriber.handle_message(pubsub_message)
+    self.patched_run.assert_not_called()
+    pubsub_message.ack.assert_called_once()
+
+  def test_nacks_if_task_cannot_be_run(self):
+    self.patched_run.side_effect = RuntimeError('Cannot report result')
+    pubsub_message = _make_pubsub_message(_TASK_DATA)
+    jobs_subscriber.handle_message(pubsub_message)
+    pubsub_message.nack.assert_called_once()
+    pubsub_message.ack.assert_not_called()
+
+  def test_nacks_if_task_is_already_running(self):
+    self.patched_run.side_effect = task_ledger.TaskInProgressError('Running')
+    pubsub_message = _make_pubsub_message(_TASK_DATA)
+    jobs_subscriber.handle_message(pubsub_message)
+    pubsub_message.nack.assert_called_once()
+    pubsub_message.ack.assert_not_called()
+
+  def test_subscribes_with_flow_control(self):
+    subscriber = mock.create_autospec(
+        pubsub_v1.SubscriberClient, instance=True)
+    subscriber.subscription_path.return_value = 'SUBSCRIPTION_PATH'
+    jobs_subscriber.subscribe(subscriber)
+    _, kwargs = subscriber.subscribe.call_args
+    self.assertEqual(kwargs['callback'], jobs_subscriber.handle_message)
+    self.assertEqual(kwargs['flow_control'].max_messages,
+                     jobs_subscriber._MAX_MESSAGES)
+    self.assertEqual(kwargs['flow_control'].max_lease_duration,
+                     jobs_subscriber._MAX_LEASE_DURATION)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,59 @@
+"""Tests for jobs.params_store."""
+
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+
+from jobs import params_store
+
+
+class ParamsStoreTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    directory = self.enter_context(tempfile.TemporaryDirectory())
+    self.store = params_store.LocalStore(directory)
+    self.patched_put = self.enter_context(
+        mock.patch.object(self.store, 'put', wraps=self.store.put))
+
+  def test_small_values_are_inline(self):
+    params = {'api_secret': 'secret', 'mp_batch_size': 20}
+    self.assertEqual(params_store.pack(params, self.store), params)
+    self.patched_put.assert_not_called()
+
+  def test_large_values_round_trip(self):
+    params = {'api_secret': 'secret', 'template': 'x' * 10000}
+    packed_params = params_store.pack(params, self.store)
+    self.assertEqual(packed_params['api_secret'], 'secret')
+    self.assertIsInstance(packed_params['template'], dict)
+    self.assertEqual(params_store.unpack(packed_params, self.store), params)
+
+  def test_fan_out_stores_value_once(self):
+    template = 'y' * 10000
+    packed_params_list = [
+        params_store.pack({'template': template, 'bq_page_token': str(i)},
+                          self.store)
+        for i in range(50)
+    ]
+    self.patched_put.assert_called_once()
+    self.assertLen({str(p['template']) for p in packed_params_list}, 1)
+    # Each message carries a short reference instead of the template.
+    self.assertLess(len(str(packed_params_list[0])), 200)
+
+  def test_unpack_without_store_fails_on_references(self):
+    packed_params = params_store.pack({'template': 'z' * 10000}, self.store)
+    self.enter_context(
+        mock.patch.object(params_store, 'get_store', return_value=None))
+    with self.assertRaises(ValueError):
+      params_store.unpack(packed_params)
+
+  def test_unpack_without_references_is_noop(self):
+    self.enter_context(
+        mock.patch.object(params_store, 'get_store', return_value=None))
+    params = {'template': 'foo'}
+    self.assertIs(params_store.unpack(params), params)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,64 @@
+"""Tests for jobs.task_ledger."""
+
+import time
+from unittest import mock
+
+from absl.testing import absltest
+
+from jobs import task_ledger
+
+
+class TaskLedgerTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.ledger = task_ledger.MemoryLedger()
+    self.enter_context(
+        mock.patch.object(
+            task_ledger, 'get_ledger', return_value=self.ledger))
+
+  def test_first_delivery_claims_task(self):
+    self.assertIsNone(task_ledger.claim('TASK-1'))
+
+  def test_duplicate_delivery_of_running_task_is_postponed(self):
+    task_ledger.claim('TASK-1')
+    with self.assertRaises(task_ledger.TaskInProgressError):
+      task_ledger.claim('TASK-1')
+
+  def test_duplicate_delivery_of_finished_task_returns_result(self):
+    result_data = {'task_name': 'TASK', 'success': True}
+    task_ledger.claim('TASK-1')
+    task_ledger.finish('TASK-1', result_data)
+    record = task_ledger.claim('TASK-1')
+    self.assertTrue(record.finished)
+    self.assertEqual(record.result, result_data)
+
+  def test_released_task_can_be_claimed_again(self):
+    task_ledger.claim('TASK-1')
+    task_ledger.release('TASK-1')
+    self.assertIsNone(task_ledger.claim('TASK-1'))
+
+  def test_stale_claim_is_taken_over(self):
+    task_ledger.claim('TASK-1')
+    self.enter_context(
+        mock.patch.object(
+            time, 'time', return_value=time.time() + 3 * 3600))
+    self.assertIsNone(task_ledger.claim('TASK-1'))
+
+  def test_memory_ledger_evicts_oldest_records(self):
+    ledger = task_ledger.MemoryLedger(max_records=2)
+    record = task_ledger.Record(finished=True, updated_at=0)
+    for key in ('A', 'B', 'C'):
+      ledger.create(key, record)
+    self.assertIsNone(ledger.get('A'))
+    self.assertIsNotNone(ledger.get('C'))
+
+  def test_record_serialization(self):
+    record = task_ledger.Record(
+        finished=True, updated_at=1.5, result={'success': False})
+    self.assertEqual(
+        task_ledger.Record.from_json(record.to_json()), record)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,206 @@
+"""Tests for jobs.task_runner."""
+
+import tempfile
+import time
+from unittest import mock
+
+from absl.testing import absltest
+
+from common import crmint_logging
+from common import heartbeat
+from common import result
+from common import task
+from jobs import params_store
+from jobs import task_ledger
+from jobs import task_runner
+from jobs.workers import finder
+from jobs.workers import worker
+
+
+class DummyWorker(worker.Worker):
+  """Worker enqueuing a follow-up worker or failing on demand."""
+
+  PARAMS = [('error', 'string', False, '', 'Error to raise')]
+
+  MAX_ATTEMPTS = 2
+
+  def _execute(self):
+    if self._params['error'] == 'worker':
+      raise worker.WorkerException('Failed')
+    if self._params['error'] == 'unexpected':
+      raise ValueError('Unexpected')
+    self._enqueue('DummyWorker', {'error': ''}, 0)
+
+
+class SettingsWorker(worker.Worker):
+  """Worker enqueuing itself with the general settings it received."""
+
+  GLOBAL_SETTINGS = ['client_id']
+
+  def _execute(self):
+    self._enqueue('SettingsWorker', {'client_id': self._params['client_id']})
+
+
+class SlowWorker(worker.Worker):
+  """Worker waiting, like workers polling a long running job."""
+
+  def _execute(self):
+    time.sleep(0.1)
+
+
+class TaskRunnerTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.patched_get_worker_class = self.enter_context(
+        mock.patch.object(
+            finder, 'get_worker_class', autospec=True,
+            return_value=DummyWorker))
+    self.enter_context(
+        mock.patch.object(crmint_logging, 'log_message', autospec=True))
+    self.patched_report = self.enter_context(
+        mock.patch.object(result.Result, 'report', autospec=True))
+    self.patched_reenqueue = self.enter_context(
+        mock.patch.object(task.Task, 'reenqueue', autospec=True))
+    self.enter_context(
+        mock.patch.object(
+            task_ledger, 'get_ledger',
+            return_value=task_ledger.MemoryLedger()))
+
+  def _make_task(self, error, attempts=1):
+    return task.Task('TASK', 1, 2, 'DummyWorker', {'error': error}, {},
+                     attempts=attempts)
+
+  def test_reports_success_with_workers_to_enqueue(self):
+    task_runner.run(self._make_task(''))
+    self.patched_report.assert_called_once()
+    result_inst = self.patched_report.call_args[0][0]
+    self.assertTrue(result_inst.success)
+    self.assertEqual(result_inst.workers_to_enqueue,
+                     [('DummyWorker', {'error': ''}, 0)])
+
+  def test_reports_failure_on_worker_exception(self):
+    task_runner.run(self._make_task('worker'))
+    result_inst = self.patched_report.call_args[0][0]
+    self.assertFalse(result_inst.success)
+    self.patched_reenqueue.assert_not_called()
+
+  def test_reenqueues_on_unexpected_error(self):
+    task_runner.run(self._make_task('unexpected'))
+    self.patched_reenqueue.assert_called_once()
+    self.patched_report.assert_not_called()
+
+  def test_gives_up_after_max_attempts(self):
+    task_runner.run(self._make_task('unexpected', attempts=2))
+    self.patched_reenqueue.assert_not_called()
+    result_inst = self.patched_report.call_args[0][0]
+    self.assertFalse(result_inst.success)
+
+  def test_reports_attempts_and_queue_wait(self):
+    task_inst = self._make_task('unexpected', attempts=2)
+    task_inst.enqueued_at = time.time() - 30
+    task_runner.run(task_inst)
+    result_inst = self.patched_report.call_args[0][0]
+    self.assertEqual(result_inst.attempts, 2)
+    self.assertBetween(result_inst.queue_wait, 30, 40)
+
+  def test_resolves_general_settings_by_snapshot_version(self):
+    task1 = task.Task('TASK1', 1, 2, 'DummyWorker', {'error': ''},
+                      {'client_id': 'foo'},
+                      general_settings_version='version1')
+    task2 = task.Task('TASK2', 1, 2, 'DummyWorker', {'error': ''},
+                      {'client_secret': 'bar'},
+                      general_settings_version='version1')
+    task3 = task.Task('TASK3', 1, 2, 'DummyWorker', {'error': ''}, {},
+                      general_settings_version='version2')
+    task_runner.resolve_general_settings(task1)
+    self.assertEqual(
+        task_runner.resolve_general_settings(task2),
+        {'client_id': 'foo', 'client_secret': 'bar'})
+    self.assertEqual(task_runner.resolve_general_settings(task3), {})
+
+  def test_passes_global_settings_to_worker(self):
+    self.patched_get_worker_class.return_value = SettingsWorker
+    task_inst = task.Task('TASK', 1, 2, 'SettingsWorker', {},
+                          {'client_id': 'foo'},
+                          general_settings_version='version3')
+    task_runner.run(task_inst)
+    result_inst = self.patched_report.call_args[0][0]
+    self.assertEqual(result_inst.workers_to_enqueue,
+                     [('SettingsWorker', {'client_id': 'foo'}, 0)])
+
+  def test_packs_and_unpacks_large_params(self):
+    store = params_store.LocalStore(
+        self.enter_context(tempfile.TemporaryDirectory()))
+    self.enter_context(
+        mock.patch.object(params_store, 'get_store', return_value=store))
+    self.patched_get_worker_class.return_value = SettingsWorker
+    task_inst = task.Task('TASK', 1, 2, 'SettingsWorker', {},
+                          {'client_id': 'x' * 10000})
+    task_runner.run(task_inst)
+    result_inst = self.patched_report.call_args[0][0]
+    (_, packed_params, _), = result_inst.workers_to_enqueue
+    self.assertNotEqual(packed_params['client_id'], 'x' * 10000)
+    self.assertEqual(params_store.unpack(packed_params),
+                     {'client_id': 'x' * 10000})
+
+  def test_duplicate_delivery_reports_recorded_result(self):
+    patched_execute = self.enter_context(
+        mock.patch.object(
+            DummyWorker, '_execute', autospec=True,
+            side_effect=DummyWorker._execute))
+    task_runner.run(self._make_task(''))
+    task_runner.run(self._make_task(''))
+    patched_execute.assert_called_once()
+    self.assertEqual(self.patched_report.call_count, 2)
+    first_result, second_result = [
+        c[0][0] for c in self.patched_report.call_args_list]
+    self.assertEqual(second_result.to_data(), first_result.to_data())
+
+  def test_duplicate_delivery_of_running_task_raises(self):
+    task_ledger.claim(task_ledger.key_for(self._make_task('')))
+    with self.assertRaises(task_ledger.TaskInProgressError):
+      task_runner.run(self._make_task(''))
+    self.patched_report.assert_not_called()
+
+  def test_failed_report_is_retried_by_next_delivery(self):
+    self.patched_report.side_effect = [RuntimeError('Timeout'), None]
+    with self.assertRaises(RuntimeError):
+      task_runner.run(self._make_task(''))
+    task_runner.run(self._make_task(''))
+    self.assertEqual(self.patched_report.call_count, 2)
+
+  def test_reenqueued_attempt_runs_once(self):
+    task_runner.run(self._make_task('unexpected'))
+    task_runner.run(self._make_task('unexpected'))
+    self.patched_reenqueue.assert_called_once()
+    self.patched_report.assert_not_called()
+
+  def test_sends_heartbeats_while_worker_runs(self):
+    self.enter_context(
+        mock.patch.object(task_runner, '_HEARTBEAT_INTERVAL', 0.02))
+    patched_send = self.enter_context(
+        mock.patch.object(heartbeat.Heartbeat, 'send', autospec=True))
+    self.patched_get_worker_class.return_value = SlowWorker
+    task_runner.run(task.Task('TASK', 1, 2, 'SlowWorker', {}, {}))
+    self.assertGreaterEqual(patched_send.call_count, 2)
+    self.assertEqual(patched_send.call_args[0][0].task_name, 'TASK')
+    sent_count = patched_send.call_count
+    time.sleep(0.05)
+    self.assertEqual(patched_send.call_count, sent_count)
+
+  def test_heartbeat_failures_do_not_fail_task(self):
+    self.enter_context(
+        mock.patch.object(task_runner, '_HEARTBEAT_INTERVAL', 0.02))
+    self.enter_context(
+        mock.patch.object(
+            heartbeat.Heartbeat, 'send', autospec=True,
+            side_effect=TimeoutError()))
+    self.patched_get_worker_class.return_value = SlowWorker
+    task_runner.run(task.Task('TASK', 1, 2, 'SlowWorker', {}, {}))
+    result_inst = self.patched_report.call_args[0][0]
+    self.assertTrue(result_inst.success)
+
+
+if __name__ == '__main__':
+  absltest.main()
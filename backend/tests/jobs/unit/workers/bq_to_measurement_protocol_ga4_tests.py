@@ -10,6 +10,7 @@ from google.auth import credentials
 from google.cloud import bigquery
 import requests
 
+from jobs.workers import rate_limiter
 from jobs.workers import worker
 from jobs.workers.bigquery import bq_to_measurement_protocol_ga4
 
@@ -169,6 +170,8 @@ class TestBQToMeasurementProtocolProcessor(absltest.TestCase):
             return_value=self._bq_client))
     self._patched_post = self.enter_context(
         mock.patch.object(requests, 'post', autospec=True))
+    self._patched_acquire = self.enter_context(
+        mock.patch.object(rate_limiter, 'acquire', autospec=True))
 
   def test_debug_flag_sends_data_to_debug_endpoint(self):
     worker_inst = bq_to_measurement_protocol_ga4.BQToMeasurementProtocolProcessorGA4(
@@ -307,6 +310,9 @@ class TestBQToMeasurementProtocolProcessor(absltest.TestCase):
     self.enter_context(mock.patch.object(worker_inst, '_log', autospec=True))
     worker_inst._execute()
     self.assertEqual(self._patched_post.call_count, 2)
+    self._patched_acquire.assert_called_with(
+        'ga4_measurement_protocol', 'G-4713LA7M1F')
+    self.assertEqual(self._patched_acquire.call_count, 2)
     self._patched_post.assert_called_with(
         'https://www.google-analytics.com/mp/collect?measurement_id=G-4713LA7M1F&api_secret=xyz',
         data=json.dumps({
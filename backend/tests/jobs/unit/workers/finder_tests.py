@@ -2,6 +2,7 @@
 
 from absl.testing import absltest
 
+from common import global_settings
 from jobs.workers import finder
 from jobs.workers.bigquery import bq_query_launcher
 from jobs.workers.bigquery import bq_to_measurement_protocol_ga4
@@ -23,6 +24,13 @@ class FindWorkerClassTest(absltest.TestCase):
     with self.assertRaises(ModuleNotFoundError):
       finder.get_worker_class('UnknownWorkerClass')
 
+  def test_global_settings_are_shared_with_controller(self):
+    for worker_name, worker_class in finder.WORKERS_MAPPING.items():
+      with self.subTest(worker_name):
+        self.assertCountEqual(
+            worker_class.GLOBAL_SETTINGS,
+            global_settings.for_worker(worker_name))
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -8,12 +8,14 @@ from unittest import mock
 from absl.testing import absltest
 from absl.testing import parameterized
 from google import auth
+from google.api_core import exceptions
 from google.auth import credentials
 from google.cloud import bigquery
 from googleapiclient import discovery
 from googleapiclient import http
 
 from common import crmint_logging
+from jobs.workers import rate_limiter
 from jobs.workers.ga import ga_utils
 from tests import utils
 
@@ -70,6 +72,19 @@ class GoogleAnalyticsUtilsTest(parameterized.TestCase):
     client = ga_utils.get_client(service, version)
     self.assertEqual(client._baseUrl, api_base_url)
 
+  def test_execute_acquires_rate_limit_on_each_attempt(self):
+    patched_acquire = self.enter_context(
+        mock.patch.object(rate_limiter, 'acquire', autospec=True))
+    self.enter_context(mock.patch('time.sleep', autospec=True))
+    request = mock.create_autospec(http.HttpRequest, instance=True)
+    request.execute.side_effect = [
+        exceptions.TooManyRequests('Quota exceeded'), {'id': '1'}]
+    self.assertEqual(
+        ga_utils._execute(request, 'ga4_admin', 'property-1'), {'id': '1'})
+    self.assertEqual(
+        patched_acquire.call_args_list,
+        [mock.call('ga4_admin', 'property-1')] * 2)
+
   def test_get_dataimport_upload_status_pending(self):
     # Response does not contain yet an upload item.
     response = {
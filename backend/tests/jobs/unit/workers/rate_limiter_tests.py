@@ -0,0 +1,132 @@
+# Copyright 2023 Google Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for jobs.workers.rate_limiter."""
+
+import random
+import time
+from unittest import mock
+
+from absl.testing import absltest
+from google.api_core import exceptions
+from google.cloud import storage
+
+from jobs.workers import rate_limiter
+
+
+class _FakeClock:
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+
+class RateLimiterTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.clock = _FakeClock()
+    self.enter_context(mock.patch.object(time, 'time', self.clock.time))
+    self.patched_sleep = self.enter_context(
+        mock.patch.object(time, 'sleep', side_effect=self.clock.sleep))
+    self.buckets = rate_limiter.MemoryBuckets()
+    self.enter_context(
+        mock.patch.object(
+            rate_limiter, 'get_buckets', return_value=self.buckets))
+    self.enter_context(
+        mock.patch.dict(rate_limiter._RATES, {'api': 2.0, 'unlimited': 0}))
+
+  def test_burst_within_capacity_does_not_wait(self):
+    self.assertEqual(rate_limiter.acquire('api', 'property-1'), 0)
+    self.assertEqual(rate_limiter.acquire('api', 'property-1'), 0)
+    self.patched_sleep.assert_not_called()
+
+  def test_waits_once_bucket_is_empty(self):
+    for _ in range(2):
+      rate_limiter.acquire('api', 'property-1')
+    self.assertAlmostEqual(rate_limiter.acquire('api', 'property-1'), 0.5)
+    self.assertAlmostEqual(rate_limiter.acquire('api', 'property-1'), 0.5)
+
+  def test_limits_rate_over_time(self):
+    start = self.clock.now
+    for _ in range(20):
+      rate_limiter.acquire('api', 'property-1')
+    # Two permits of burst, then two permits per second.
+    self.assertAlmostEqual(self.clock.now - start, 9.0)
+
+  def test_buckets_are_keyed_by_resource(self):
+    for _ in range(2):
+      rate_limiter.acquire('api', 'property-1')
+    self.assertEqual(rate_limiter.acquire('api', 'property-2'), 0)
+
+  def test_unlimited_api_does_not_wait(self):
+    for _ in range(100):
+      rate_limiter.acquire('unlimited', 'property-1')
+    self.patched_sleep.assert_not_called()
+
+  def test_parse_rates(self):
+    self.assertEqual(
+        rate_limiter._parse_rates('ga4_admin=0.5, ga_management=5,'),
+        {'ga4_admin': 0.5, 'ga_management': 5.0})
+
+  def test_shared_buckets_lease_blocks_of_permits(self):
+    self.enter_context(mock.patch.object(storage, 'Client', autospec=True))
+    buckets = rate_limiter.GcsBuckets('bucket')
+    patched_reserve_shared = self.enter_context(
+        mock.patch.object(buckets, '_reserve_shared', return_value=0.0))
+    for _ in range(10):
+      buckets.reserve('api-property-1', 1, rate=5.0, capacity=5.0)
+    self.assertEqual(patched_reserve_shared.call_count, 2)
+
+  def test_shared_bucket_updates_are_retried_with_backoff(self):
+    self.enter_context(mock.patch.object(storage, 'Client', autospec=True))
+    self.enter_context(
+        mock.patch.object(
+            random, 'uniform', autospec=True, side_effect=lambda a, b: b))
+    buckets = rate_limiter.GcsBuckets('bucket')
+    buckets._bucket.get_blob.return_value = None
+    buckets._bucket.blob.return_value.upload_from_string.side_effect = [
+        exceptions.TooManyRequests('Rate exceeded'),
+        exceptions.PreconditionFailed('Generation mismatch'),
+        None,
+    ]
+    self.assertEqual(
+        buckets._reserve_shared('api-property-1', 1, rate=5.0, capacity=5.0),
+        0)
+    self.assertEqual(
+        [c.args[0] for c in self.patched_sleep.call_args_list], [0.2, 0.4])
+
+  def test_shared_bucket_update_gives_up_after_max_attempts(self):
+    self.enter_context(mock.patch.object(storage, 'Client', autospec=True))
+    buckets = rate_limiter.GcsBuckets('bucket')
+    buckets._bucket.get_blob.return_value = None
+    buckets._bucket.blob.return_value.upload_from_string.side_effect = (
+        exceptions.TooManyRequests('Rate exceeded'))
+    with self.assertRaises(RuntimeError):
+      buckets._reserve_shared('api-property-1', 1, rate=5.0, capacity=5.0)
+    self.assertEqual(self.patched_sleep.call_count,
+                     rate_limiter._MAX_UPDATE_ATTEMPTS - 1)
+
+  def test_bucket_serialization(self):
+    bucket = rate_limiter.Bucket(tokens=-1.5, updated_at=10.0)
+    self.assertEqual(rate_limiter.Bucket.from_json(bucket.to_json()), bucket)
+
+
+if __name__ == '__main__':
+  absltest.main()
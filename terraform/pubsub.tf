@@ -12,6 +12,12 @@ locals {
       "minimum_backoff" = 10,  # seconds
     }
 
+    "crmint-3-task-heartbeat" = {
+      "endpoint" = "${google_cloud_run_service.controller_run.status[0].url}/push/task-heartbeat",
+      "ack_deadline_seconds" = 60,
+      "minimum_backoff" = 10,  # seconds
+    }
+
     "crmint-3-start-pipeline" = {
       "endpoint" = "${google_cloud_run_service.controller_run.status[0].url}/push/start-pipeline",
       "ack_deadline_seconds" = 60,
@@ -181,6 +181,8 @@ resource "google_cloud_run_service" "jobs_run" {
       annotations = {
         "autoscaling.knative.dev/minScale" = "0"
         "autoscaling.knative.dev/maxScale" = "5"
+        # Background tasks run after their request has been answered.
+        "run.googleapis.com/cpu-throttling" = var.jobs_background_execution ? "false" : "true"
       }
     }
     spec {
@@ -209,6 +211,10 @@ resource "google_cloud_run_service" "jobs_run" {
           name  = "PUBSUB_VERIFICATION_TOKEN"
           value = random_id.pubsub_verification_token.b64_url
         }
+        env {
+          name  = "JOBS_BACKGROUND_EXECUTION"
+          value = var.jobs_background_execution ? "1" : "0"
+        }
       }
 
       timeout_seconds = 900  # 15min
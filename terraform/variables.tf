@@ -129,6 +129,15 @@ variable "jobs_image" {
   default = "europe-docker.pkg.dev/crmint-builds/crmint/jobs:latest"
 }
 
+variable "jobs_background_execution" {
+  description = <<EOF
+    Runs tasks after acknowledging their Pub/Sub message, so that waiting
+    workers do not hold a request open. Keeps CPU allocated to the jobs
+    service outside of requests.
+    EOF
+  default = false
+}
+
 
 ##
 # Custom domain